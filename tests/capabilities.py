@@ -4,12 +4,15 @@
 # See the COPYING file in the top-level directory.
 
 import os
+import tempfile
 import unittest
 
 from tests import utils
 
 from virtinst import Capabilities
 from virtinst import DomainCapabilities
+from virtinst.capscache import CapsCache
+from virtinst import xmlapi
 
 
 class TestCapabilities(unittest.TestCase):
@@ -87,6 +90,51 @@ class TestCapabilities(unittest.TestCase):
         self.assertTrue(len(cpu_64) > 0)
 
 
+    def testCapsReadonlyParse(self):
+        xml = open("tests/capabilities-xml/test-qemu-with-kvm.xml").read()
+        streamapi = xmlapi.READONLY_XMLAPI(xml)
+        domapi = xmlapi.XMLAPI(xml)
+        for xpath in ["./host/cpu/model", "./host/cpu/topology/@cores",
+                      "./host/cpu/feature[3]/@name", "./guest[2]/arch/@name",
+                      "./guest/arch/domain[@type='kvm']/@type",
+                      "./guest[1]/features/pae", "./host/idontexist"]:
+            for is_bool in [False, True]:
+                self.assertEqual(
+                        streamapi.get_xpath_content(xpath, is_bool),
+                        domapi.get_xpath_content(xpath, is_bool))
+        for xpath in ["./guest", "./host/cpu/feature",
+                      "./guest/arch/@name"]:
+            self.assertEqual(streamapi.count(xpath), domapi.count(xpath))
+
+        caps = self._buildCaps("test-qemu-with-kvm.xml")
+        self.assertEqual(caps.host.cpu.model, "core2duo")
+        caps.host.cpu.model = "foobar"
+        self.assertEqual(caps.host.cpu.model, "foobar")
+        self.assertTrue("<model>foobar</model>" in caps.get_xml())
+        self.assertEqual(caps.guests[1].arch, "x86_64")
+
+    def testCapsReadonlyParseAttributes(self):
+        # Attribute lookups only match elements that have the attribute
+        streamapi = xmlapi.READONLY_XMLAPI(
+                "<foo><bar a='1'/><bar b='2'/><bar b='3'/></foo>")
+        self.assertEqual(streamapi.get_xpath_content("./bar/@b", False), "2")
+        self.assertEqual(streamapi.get_xpath_content("./bar/@b", True), True)
+        self.assertEqual(streamapi.get_xpath_content("./bar/@c", False), None)
+        self.assertEqual(streamapi.get_xpath_content("./bar/@c", True), None)
+        self.assertEqual(streamapi.count("./bar/@b"), 2)
+        self.assertEqual(streamapi.count("./bar/@c"), 0)
+
+    def testCapsReadonlyParseCopy(self):
+        xml = open("tests/capabilities-xml/test-qemu-with-kvm.xml").read()
+        streamapi = xmlapi.READONLY_XMLAPI(xml)
+        streamapi.set_xpath_content("./host/cpu/model", "foobar")
+        copyapi = streamapi.copy_api()
+        self.assertEqual(
+                copyapi.get_xpath_content("./host/cpu/model", False),
+                "foobar")
+        self.assertTrue("<model>foobar</model>" in copyapi.get_xml("."))
+
+
     ##############################
     # domcapabilities.py testing #
     ##############################
@@ -116,3 +164,70 @@ class TestCapabilities(unittest.TestCase):
         cpu_model = custom_mode.get_model("Opteron_G4")
         self.assertTrue(bool(cpu_model))
         self.assertTrue(cpu_model.usable)
+
+    def testDomainCapabilitiesCache(self):
+        conn = utils.URIs.open_kvm()
+        args = ("/usr/bin/qemu-kvm", "x86_64", None, "kvm")
+        caps = DomainCapabilities.build_from_params(conn, *args)
+        self.assertEqual(caps.arch, "x86_64")
+        self.assertTrue(
+            DomainCapabilities.build_from_params(conn, *args) is caps)
+
+        conn.invalidate_caps()
+        newcaps = DomainCapabilities.build_from_params(conn, *args)
+        self.assertFalse(newcaps is caps)
+        self.assertEqual(newcaps.arch, "x86_64")
+
+
+    ########################
+    # capscache.py testing #
+    ########################
+
+    def testCapsCache(self):
+        class _FakeConn(object):
+            uri = "qemu:///system"
+            version = 1000000
+            def local_libvirt_version(self):
+                return 4000000
+            def daemon_version(self):
+                return 4000000
+            def conn_version(self):
+                return self.version
+            def is_remote(self):
+                return False
+
+        tmpdir = tempfile.mkdtemp()
+        emulator = os.path.join(tmpdir, "qemu-kvm")
+        open(emulator, "w").close()
+        orig_path = CapsCache.get_cache_path
+        CapsCache.get_cache_path = staticmethod(
+            lambda uri: os.path.join(tmpdir, "cache.json"))
+
+        try:
+            conn = _FakeConn()
+            cache = CapsCache.load(conn)
+            self.assertEqual(cache.get_caps(), None)
+            cache.set_caps("<capabilities/>", [emulator])
+            cache.set_domcaps(emulator, "x86_64", None, "kvm", "<domcaps/>")
+            cache.set_support(5, True)
+            cache.save()
+
+            cache = CapsCache.load(conn)
+            self.assertEqual(cache.get_caps(), "<capabilities/>")
+            self.assertEqual(
+                cache.get_domcaps(emulator, "x86_64", None, "kvm"),
+                "<domcaps/>")
+            self.assertEqual(cache.get_support(5), True)
+            self.assertEqual(cache.get_support(6), None)
+
+            # Emulator binary changed
+            os.utime(emulator, (0, 0))
+            self.assertEqual(CapsCache.load(conn).get_caps(), None)
+
+            # Hypervisor version changed
+            cache = CapsCache.load(conn)
+            cache.set_caps("<capabilities/>", [emulator])
+            conn.version = 2000000
+            self.assertEqual(CapsCache.load(conn).get_caps(), None)
+        finally:
+            CapsCache.get_cache_path = orig_path
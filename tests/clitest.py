@@ -722,6 +722,17 @@ c.add_compare("--cdrom %(EXISTIMG1)s --disk size=1 --disk %(EXISTIMG2)s,device=c
 
 
 
+c = vinst.add_category("batch", "--nographics --noautoconsole")
+c.add_valid("--batch %s/batch-manifest.json" % XMLDIR, grep="3 succeeded, 0 failed")  # batch install with string, list, and dict entries
+c.add_valid("--batch %s/batch-manifest.json --batch-jobs 1 --dry-run" % XMLDIR, grep="3 succeeded, 0 failed")  # batch dry run, serialized
+c.add_valid("--batch %s/batch-manifest.json --print-xml" % XMLDIR, grep="<name>batch-newdisk</name>")  # batch XML printing
+c.add_invalid("--batch %s/batch-manifest-fail.json" % XMLDIR, grep="1 succeeded, 4 failed")  # name collision, duplicate name, --connect in entry, bogus entry
+c.add_invalid("--batch %s/batch-manifest.json --batch-jobs 0" % XMLDIR)  # invalid --batch-jobs
+c.add_invalid("--batch %s/batch-manifest-check.json --dry-run" % XMLDIR, grep="1 succeeded, 1 failed")  # --check doesn't carry over to the next entry
+c.add_invalid("--batch /idontexist.json")  # missing manifest
+
+
+
 #############################
 # Remote URI specific tests #
 #############################
@@ -915,6 +926,19 @@ c.add_compare("--edit --print-diff --qemu-commandline clearxml=yes", "edit-clear
 c.add_compare("--connect %(URI-KVM)s test-hyperv-uefi --edit --boot uefi", "hyperv-uefi-collision")
 
 
+c = vixml.add_category("multiple domains", "")
+c.add_valid("test test-for-virtxml --edit --print-diff --memory 1024", grep="Original XML (test-for-virtxml)")  # diff for multiple named domains
+c.add_valid("--domain-regex ^test-for --edit --memory 1024,maxmemory=2048", grep="Domain 'test-for-virtxml' defined successfully.")  # select by regex
+c.add_valid("--all --edit --print-diff --cpu host-passthrough --jobs 1", grep="Altered XML (test-state-shutoff)")  # --all
+c.add_valid("- --edit --print-diff --memory 1024", input_file=(XMLDIR + "/virtxml-domain-list.txt"), grep="Original XML (test)")  # domain list from stdin
+c.add_invalid("test idontexist --edit --memory 1024")  # unknown domain
+c.add_invalid("--domain-regex idontexist --edit --memory 1024")  # regex matches nothing
+c.add_invalid("--domain-regex '(' --edit --memory 1024")  # invalid regex
+c.add_invalid("--all --edit --confirm --memory 1024")  # --confirm not supported
+c.add_invalid("test test-for-virtxml --edit --update --memory 1024", grep="Don't know how to --update for --memory")  # --update checked once, before any domain
+c.add_invalid("test test-for-virtxml --edit 10 --disk cache=none", grep="Failed to change 2 domain(s)")  # error summary
+
+
 c = vixml.add_category("simple edit diff", "test-for-virtxml --edit --print-diff --define")
 c.add_compare("""--metadata name=foo-my-new-name,os_name=fedora13,uuid=12345678-12F4-1234-1234-123456789AFA,description="hey this is my
 new
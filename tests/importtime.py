@@ -0,0 +1,110 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import logging
+import os
+import subprocess
+import sys
+import unittest
+
+import virtinst
+
+
+# Entry point name -> (python code, max cumulative import time in seconds)
+# The limits are deliberately generous, they are only here to catch
+# something like the whole package being pulled back in eagerly.
+_ENTRY_POINTS = {
+    "virtinst": ("import virtinst", 1),
+    "virt-install/virt-xml/virt-clone": (
+        "import virtinst; from virtinst import cli", 10),
+    "Guest": ("from virtinst import Guest", 10),
+}
+
+
+def _run_python(args, code):
+    """
+    Run code in a fresh python interpreter, return (stdout, stderr)
+    """
+    env = os.environ.copy()
+    env["VIRTINST_TEST_SUITE"] = "1"
+    proc = subprocess.Popen(
+            [sys.executable] + args + ["-c", code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=env, cwd=os.getcwd())
+    out, err = proc.communicate()
+    err = err.decode("utf-8", "replace")
+    if proc.returncode != 0:
+        raise RuntimeError("Running '%s' failed:\n%s" % (code, err))
+    return out.decode("utf-8", "replace"), err
+
+
+def _importtime(code):
+    """
+    Run code with 'python -X importtime' and return a dict of
+    imported module name -> cumulative import time in microseconds
+    """
+    dummy, err = _run_python(["-X", "importtime"], code)
+
+    ret = {}
+    for line in err.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line.split(":", 1)[1].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        ret[parts[2].strip()] = int(parts[1].strip())
+    return ret
+
+
+def _import_cost(code):
+    """
+    Return how many seconds running the import statements in code
+    takes in a fresh interpreter. Lazily imported submodules are
+    charged to the statement that triggers them, not to 'virtinst'
+    """
+    out, dummy = _run_python([],
+            "import time\n"
+            "start = time.time()\n"
+            "%s\n"
+            "print(time.time() - start)\n" % code)
+    return float(out.strip().splitlines()[-1])
+
+
+class TestImportTime(unittest.TestCase):
+    """
+    Make sure virtinst stays lazy on import, and track how long the
+    package takes to import for each entry point
+    """
+    def testPackageImportIsLazy(self):
+        modules = _importtime("import virtinst")
+        self.assertTrue("virtinst" in modules)
+        for modname in ["virtinst.cli", "virtinst.guest",
+                        "virtinst.devices", "virtinst.domain",
+                        "virtinst.xmlbuilder", "virtinst.capabilities"]:
+            self.assertFalse(modname in modules,
+                "'import virtinst' imported %s" % modname)
+
+    def testLazyAttributes(self):
+        from virtinst import devices
+        from virtinst import domain
+        from virtinst import guest
+
+        # Everything the subpackages export should be reachable
+        for name in devices.__all__ + domain.__all__:
+            self.assertTrue(name in virtinst.__all__, name)
+            self.assertTrue(name in dir(virtinst), name)
+
+        self.assertTrue(virtinst.Guest is guest.Guest)
+        self.assertTrue(virtinst.DeviceDisk is devices.DeviceDisk)
+        self.assertTrue(virtinst.util is sys.modules["virtinst.util"])
+        self.assertRaises(AttributeError, getattr, virtinst, "NotAThing")
+
+    def testEntryPointCost(self):
+        for name, (code, limit) in _ENTRY_POINTS.items():
+            cost = _import_cost(code)
+            logging.debug("Import cost for %s: %.3fs", name, cost)
+            self.assertTrue(cost < limit,
+                "Importing virtinst for %s took %.3fs, limit is %ds" %
+                (name, cost, limit))
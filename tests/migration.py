@@ -0,0 +1,195 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import threading
+import time
+import unittest
+
+import libvirt
+
+from virtinst.migration import MigrationJob
+from virtinst.migration import MigrationOptions
+from virtinst.migration import MigrationQueue
+
+
+class _FakeDomain(object):
+    """
+    Stand in for a libvirt virDomain that 'migrates' until release()
+    is called, and tracks how many migrations run at once
+    """
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, name, fail=False):
+        self._name = name
+        self._fail = fail
+        self._release = threading.Event()
+        self._aborted = False
+        self.started = threading.Event()
+        self.migrate_args = None
+        self.postcopy_started = False
+
+    def name(self):
+        return self._name
+
+    def maxMemory(self):
+        return 1024
+
+    def jobInfo(self):
+        # Half of the 2MiB job is done
+        return [libvirt.VIR_DOMAIN_JOB_UNBOUNDED, 0, 0,
+                2 * 1024 * 1024, 1024 * 1024, 1024 * 1024,
+                0, 0, 0, 0, 0, 0]
+
+    def abortJob(self):
+        self._aborted = True
+        self._release.set()
+
+    def migrateStartPostCopy(self, flags):
+        ignore = flags
+        self.postcopy_started = True
+
+    def release(self):
+        self._release.set()
+
+    def migrate3(self, destconn, params, flags):
+        self.migrate_args = (destconn, params, flags)
+        with _FakeDomain.lock:
+            _FakeDomain.running += 1
+            _FakeDomain.max_running = max(_FakeDomain.max_running,
+                                          _FakeDomain.running)
+        self.started.set()
+        try:
+            self._release.wait(5)
+            if self._fail or self._aborted:
+                raise libvirt.libvirtError("migration of %s failed" %
+                                           self._name)
+        finally:
+            with _FakeDomain.lock:
+                _FakeDomain.running -= 1
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self):
+        _FakeDomain.running = 0
+        _FakeDomain.max_running = 0
+
+    def _make_queue(self, domains, **kwargs):
+        options = kwargs.pop("options", None) or MigrationOptions()
+        q = MigrationQueue("fakedestconn", options, **kwargs)
+        q.POLL_INTERVAL = .01
+        for domain in domains:
+            q.add(domain)
+        return q
+
+    def testOptions(self):
+        options = MigrationOptions()
+        flags = options.get_flags()
+        self.assertTrue(flags & libvirt.VIR_MIGRATE_LIVE)
+        self.assertTrue(flags & libvirt.VIR_MIGRATE_PERSIST_DEST)
+        self.assertFalse(flags & libvirt.VIR_MIGRATE_COMPRESSED)
+        self.assertEqual(options.get_params(), {})
+
+        options.dest_uri = "tcp:example.com"
+        options.temporary = True
+        options.compressed = True
+        options.auto_converge = True
+        options.postcopy = True
+        options.bandwidth = 100
+        options.parallel_connections = 4
+        flags = options.get_flags()
+        self.assertFalse(flags & libvirt.VIR_MIGRATE_PERSIST_DEST)
+        for flag in [libvirt.VIR_MIGRATE_COMPRESSED,
+                     libvirt.VIR_MIGRATE_AUTO_CONVERGE,
+                     libvirt.VIR_MIGRATE_POSTCOPY]:
+            self.assertTrue(flags & flag)
+        params = options.get_params()
+        self.assertEqual(params[libvirt.VIR_MIGRATE_PARAM_URI],
+                         "tcp:example.com")
+        self.assertEqual(params[libvirt.VIR_MIGRATE_PARAM_BANDWIDTH], 100)
+        self.assertEqual(len(params), 3)
+
+        # Tunnelled migration passes the URI separately
+        options.tunnel = True
+        self.assertTrue(libvirt.VIR_MIGRATE_PARAM_URI not in
+                        options.get_params())
+
+    def testConcurrencyLimit(self):
+        domains = [_FakeDomain("vm%d" % idx) for idx in range(5)]
+        progress = []
+        q = self._make_queue(domains, max_parallel=2,
+                             progress_cb=lambda q: progress.append(
+                                 q.get_progress()))
+        q.start()
+
+        domains[0].started.wait(5)
+        domains[1].started.wait(5)
+        for dummy in range(500):
+            if q.get_progress()[0] == 2 * 1024 * 1024:
+                break
+            time.sleep(.01)
+        self.assertEqual(_FakeDomain.running, 2)
+        self.assertFalse(domains[2].started.is_set())
+        self.assertEqual(q.jobs[0].state, MigrationJob.STATE_RUNNING)
+        self.assertEqual(q.jobs[4].state, MigrationJob.STATE_QUEUED)
+
+        # Two running jobs report half of 2MiB done, three queued jobs
+        # are estimated at 1MiB of memory each
+        processed, total, finished = q.get_progress()
+        self.assertEqual(processed, 2 * 1024 * 1024)
+        self.assertEqual(total, 7 * 1024 * 1024)
+        self.assertEqual(finished, 0)
+
+        for domain in domains:
+            domain.release()
+        q.wait()
+
+        self.assertEqual(_FakeDomain.max_running, 2)
+        self.assertEqual(q.get_failed(), [])
+        for domain in domains:
+            self.assertEqual(domain.migrate_args[0], "fakedestconn")
+        processed, total, finished = q.get_progress()
+        self.assertEqual(processed, total)
+        self.assertEqual(finished, 5)
+        self.assertEqual(progress[-1], (processed, total, finished))
+
+    def testFailureAndCancel(self):
+        domains = [_FakeDomain("vm0", fail=True), _FakeDomain("vm1"),
+                   _FakeDomain("vm2")]
+        q = self._make_queue(domains, max_parallel=1)
+        q.start()
+
+        domains[0].release()
+        domains[1].started.wait(5)
+        q.cancel()
+        q.wait()
+
+        states = [j.state for j in q.jobs]
+        self.assertEqual(states, [MigrationJob.STATE_FAILED,
+                                  MigrationJob.STATE_CANCELLED,
+                                  MigrationJob.STATE_CANCELLED])
+        self.assertEqual(q.get_failed(), [q.jobs[0]])
+        self.assertTrue("vm0" in str(q.jobs[0].error))
+        self.assertFalse(domains[2].started.is_set())
+
+    def testPostcopySwitchover(self):
+        options = MigrationOptions()
+        options.postcopy = True
+        options.postcopy_after = 0
+        domain = _FakeDomain("vm0")
+        q = self._make_queue([domain], options=options)
+        q.start()
+
+        for dummy in range(500):
+            if domain.postcopy_started:
+                break
+            time.sleep(.01)
+        domain.release()
+        q.wait()
+
+        self.assertTrue(domain.postcopy_started)
+        self.assertTrue(q.jobs[0].postcopy_started)
+        self.assertEqual(q.jobs[0].state, MigrationJob.STATE_DONE)
@@ -0,0 +1,105 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+Benchmark for cli option string parsing. It parses every sub-option
+string from the tests/clitest.py command matrix, plus some long
+synthetic strings with many indexed parameters.
+
+Run it with: python3 -m tests.perf.cliparse [--iterations N]
+"""
+
+import argparse
+import time
+
+from virtinst import cli
+
+
+def _get_parser_classes():
+    ret = {}
+    todo = [cli.VirtCLIParser]
+    while todo:
+        cls = todo.pop()
+        todo += cls.__subclasses__()
+        if cls.cli_arg_name and cls.cli_flag_name() not in ret:
+            ret[cls.cli_flag_name()] = cls
+    return ret
+
+
+def get_clitest_optstrs():
+    """
+    Return a list of (parserclass, optstr) for every option string in
+    the clitest.py command matrix
+    """
+    from tests import clitest
+
+    parsers = _get_parser_classes()
+    ret = []
+    for app in [getattr(clitest, n) for n in dir(clitest)]:
+        if not isinstance(app, clitest.App):
+            continue
+        for cmd in app.cmds:
+            argv = cmd.argv[1:]
+            for idx, arg in enumerate(argv):
+                flag, dummy, val = arg.partition("=")
+                if flag not in parsers:
+                    continue
+                if not val:
+                    if idx + 1 >= len(argv) or argv[idx + 1].startswith("-"):
+                        continue
+                    val = argv[idx + 1]
+                ret.append((parsers[flag], val))
+    return ret
+
+
+def get_synthetic_optstrs():
+    """
+    Long option strings with many indexed parameters, which is where
+    parsing used to go quadratic
+    """
+    cputune = ",".join(["vcpupin%d.vcpu=%d,vcpupin%d.cpuset=%d-%d" %
+                        (i, i, i, i, i + 1) for i in range(512)])
+    cells = ",".join(["cell%d.id=%d,cell%d.cpus=%d,cell%d.memory=1024" %
+                      (i, i, i, i, i) for i in range(128)])
+    seclabels = ",".join(["seclabel%d.model=dac,seclabel%d.label=foo%d" %
+                          (i, i, i) for i in range(128)])
+    return [
+        (cli.ParserCputune, cputune),
+        (cli.ParserCPU, "host-model," + cells),
+        (cli.ParserDisk, "/tmp/foo.img,size=1," + seclabels),
+    ]
+
+
+def _time_parse(optstrs, iterations):
+    start = time.time()
+    for dummy in range(iterations):
+        for parserclass, optstr in optstrs:
+            parserclass(None, optstr)
+    return time.time() - start
+
+
+def run(iterations=10):
+    """
+    Run the benchmark, return a dict of name -> seconds per iteration
+    """
+    results = {}
+    for name, optstrs in [("clitest", get_clitest_optstrs()),
+                          ("synthetic", get_synthetic_optstrs())]:
+        results[name] = _time_parse(optstrs, iterations) / iterations
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark cli option string parsing")
+    parser.add_argument("--iterations", type=int, default=10)
+    options = parser.parse_args()
+
+    for name, secs in sorted(run(options.iterations).items()):
+        print("%-12s %.4fs per iteration" % (name, secs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+Benchmark suite for the hot paths of virtinst and the virt-manager
+polling code. It runs against the libvirt test driver, using
+tests/testdriver.xml scaled up with generated guests, so results only
+depend on the local machine.
+
+Run it from the top of the source tree:
+
+    python3 -m tests.perf.suite run --output new.json
+    python3 -m tests.perf.suite compare baseline.json new.json
+
+'compare' exits non-zero if any benchmark regressed by more than
+--threshold percent.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import libvirt
+
+from tests.perf import cliparse
+from tests.perf import xmlcopy
+
+from virtinst import Cloner
+from virtinst import DeviceDisk
+from virtinst import Guest
+from virtinst import pollhelpers
+from virtinst import util
+from virtinst.connection import VirtinstConnection
+
+
+# Bump this if the layout of the results file changes
+_FORMAT_VERSION = 1
+
+_GUEST_TEMPLATE = """
+<domain type='test' xmlns:test='http://libvirt.org/schemas/domain/test/1.0'>
+  %(runstate)s
+  <name>bench-%(idx)d</name>
+  <uuid>%(idx)08x-1111-2222-3333-444444444444</uuid>
+  <memory>1048576</memory>
+  <currentMemory>524288</currentMemory>
+  <vcpu>2</vcpu>
+  <os>
+    <type arch='i686'>hvm</type>
+    <boot dev='hd'/>
+  </os>
+  <features>
+    <acpi/><apic/>
+  </features>
+  <clock offset='utc'/>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='/var/lib/bench/bench-%(idx)d-root.img'/>
+      <target dev='hda' bus='ide'/>
+    </disk>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='/var/lib/bench/bench-%(idx)d-data.qcow2'/>
+      <target dev='vdb' bus='virtio'/>
+    </disk>
+    <disk type='file' device='cdrom'>
+      <target dev='hdc' bus='ide'/>
+      <readonly/>
+    </disk>
+    <interface type='network'>
+      <mac address='52:54:00:%(mac0)02x:%(mac1)02x:%(mac2)02x'/>
+      <source network='default'/>
+      <model type='virtio'/>
+    </interface>
+    <graphics type='vnc' port='-1'/>
+    <console type='pty'/>
+    <memballoon model='virtio'/>
+  </devices>
+</domain>
+"""
+
+
+class _BenchContext(object):
+    """
+    State shared by all the benchmarks in one run
+    """
+    def __init__(self, tmpdir, guests, iterations, clone_size):
+        self.tmpdir = tmpdir
+        self.guests = guests
+        self.iterations = iterations
+        self.clone_size = clone_size
+
+        driverpath = os.path.join(tmpdir, "testdriver.xml")
+        _write_testdriver(driverpath, guests)
+        uri = "__virtinst_test__test://%s,predictable" % driverpath
+        self.conn = VirtinstConnection(uri)
+        self.conn.open(None, None)
+
+        self.domains = self.conn.listAllDomains(0)
+        self.domxml = [d.XMLDesc(0) for d in self.domains]
+
+    def close(self):
+        self.conn.close()
+
+
+def _write_testdriver(path, count):
+    """
+    Write a copy of tests/testdriver.xml with 'count' generated guests
+    added. Every other generated guest is shut off.
+    """
+    origpath = os.path.join(os.getcwd(), "tests", "testdriver.xml")
+    xml = open(origpath).read()
+
+    guests = []
+    for idx in range(count):
+        runstate = ""
+        if idx % 2:
+            runstate = "<test:runstate>5</test:runstate>"
+        guests.append(_GUEST_TEMPLATE % {
+            "idx": idx, "runstate": runstate,
+            "mac0": (idx >> 16) & 0xff, "mac1": (idx >> 8) & 0xff,
+            "mac2": idx & 0xff})
+
+    xml = xml.replace("</node>", "".join(guests) + "</node>")
+    with open(path, "w") as f:
+        f.write(xml)
+
+
+def _time_iterations(ctx, func):
+    """
+    Run func once to warm up, then return seconds per iteration
+    """
+    func()
+    start = time.time()
+    for dummy in range(ctx.iterations):
+        func()
+    return (time.time() - start) / ctx.iterations
+
+
+##############
+# Benchmarks #
+##############
+
+def bench_guest_parse(ctx):
+    def _parse():
+        for xml in ctx.domxml:
+            Guest(ctx.conn, parsexml=xml)
+    return _time_iterations(ctx, _parse)
+
+
+def bench_guest_get_xml(ctx):
+    guests = [Guest(ctx.conn, parsexml=xml) for xml in ctx.domxml]
+    state = {"count": 0}
+
+    def _get_xml():
+        # Change something each round so nothing can be served from
+        # a cached serialization
+        state["count"] += 1
+        for guest in guests:
+            guest.description = "bench %d" % state["count"]
+            guest.get_xml()
+    return _time_iterations(ctx, _get_xml)
+
+
+def bench_cli_parse(ctx):
+    results = cliparse.run(ctx.iterations)
+    return dict(("cli-parse-%s" % name, secs)
+                for name, secs in results.items())
+
+
+def bench_xml_copy(ctx):
+    results = xmlcopy.run(ctx.iterations)
+    return dict(("xml-%s" % name, secs)
+                for name, secs in results.items())
+
+
+def bench_path_in_use_by(ctx):
+    paths = ["/var/lib/bench/bench-%d-data.qcow2" % (ctx.guests - 1),
+             "/dev/default-pool/test-clone-simple.img",
+             "/var/lib/bench/idontexist.img"]
+
+    def _lookup():
+        for path in paths:
+            DeviceDisk.path_in_use_by(ctx.conn, path)
+
+    def _cold_lookup():
+        # Refetch domain XML like after a domain event, parsed objects
+        # for unchanged domains are reused
+        ctx.conn.invalidate_domain_cache()
+        _lookup()
+
+    return {
+        "path-in-use-by-warm": _time_iterations(ctx, _lookup),
+        "path-in-use-by-cold": _time_iterations(ctx, _cold_lookup),
+    }
+
+
+def bench_poll_cycle(ctx):
+    """
+    One steady state poll of every object type, like a virt-manager
+    connection tick with nothing changing
+    """
+    origmaps = {}
+
+    def _build(obj, key):
+        ignore = key
+        return obj
+
+    def _poll():
+        for name, func in [("vms", pollhelpers.fetch_vms),
+                           ("nets", pollhelpers.fetch_nets),
+                           ("pools", pollhelpers.fetch_pools),
+                           ("interfaces", pollhelpers.fetch_interfaces),
+                           ("nodedevs", pollhelpers.fetch_nodedevs)]:
+            origmap = origmaps.get(name, {})
+            dummy1, dummy2, current = func(ctx.conn, origmap.copy(), _build)
+            origmaps[name] = dict((obj.name(), obj) for obj in current)
+    return _time_iterations(ctx, _poll)
+
+
+def bench_stats_sample(ctx):
+    """
+    One stats tick like virt-manager's statsmanager: a single
+    getAllDomainStats call, falling back to per domain calls if the
+    driver doesn't support it
+    """
+    statflags = (libvirt.VIR_DOMAIN_STATS_STATE |
+                 libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                 libvirt.VIR_DOMAIN_STATS_VCPU |
+                 libvirt.VIR_DOMAIN_STATS_BALLOON |
+                 libvirt.VIR_DOMAIN_STATS_BLOCK |
+                 libvirt.VIR_DOMAIN_STATS_INTERFACE)
+    state = {"allstats": True}
+
+    def _sample():
+        if state["allstats"]:
+            try:
+                ctx.conn.getAllDomainStats(statflags, 0)
+                return
+            except libvirt.libvirtError as e:
+                if not util.is_error_nosupport(e):
+                    raise
+                state["allstats"] = False
+
+        for dom in ctx.domains:
+            if dom.isActive():
+                dom.info()
+    return _time_iterations(ctx, _sample)
+
+
+def bench_clone_copy(ctx):
+    """
+    Throughput of the local file copy used when cloning unmanaged
+    storage, in MiB per second
+    """
+    srcpath = os.path.join(ctx.tmpdir, "clone-src.img")
+    chunk = os.urandom(1024 * 1024)
+    with open(srcpath, "wb") as f:
+        for dummy in range(ctx.clone_size):
+            f.write(chunk)
+
+    origxml = _GUEST_TEMPLATE % {
+        "idx": ctx.guests, "runstate": "",
+        "mac0": 0xff, "mac1": 0xff, "mac2": 0xff}
+    origguest = Guest(ctx.conn, parsexml=origxml)
+    for disk in origguest.devices.disk[1:]:
+        origguest.remove_device(disk)
+    origguest.devices.disk[0].path = srcpath
+    origxml = origguest.get_xml()
+
+    elapsed = 0
+    for idx in range(ctx.iterations):
+        dstpath = os.path.join(ctx.tmpdir, "clone-dst.img")
+        design = Cloner(ctx.conn)
+        design.original_xml = origxml
+        design.clone_name = "bench-clone-%d" % idx
+        design.setup_original()
+        design.clone_paths = [dstpath]
+        design.setup_clone()
+
+        start = time.time()
+        design.start_duplicate(util.make_meter(quiet=True))
+        elapsed += time.time() - start
+        os.unlink(dstpath)
+
+    os.unlink(srcpath)
+    return ctx.clone_size * ctx.iterations / elapsed
+
+
+# name -> (function, unit, which direction is better). Functions that
+# return a dict report several results, named by the dict keys.
+_BENCHMARKS = {
+    "guest-parse": (bench_guest_parse, "s", "lower"),
+    "guest-get-xml": (bench_guest_get_xml, "s", "lower"),
+    "cli-parse": (bench_cli_parse, "s", "lower"),
+    "xml-copy": (bench_xml_copy, "s", "lower"),
+    "path-in-use-by": (bench_path_in_use_by, "s", "lower"),
+    "poll-cycle": (bench_poll_cycle, "s", "lower"),
+    "stats-sample": (bench_stats_sample, "s", "lower"),
+    "clone-copy": (bench_clone_copy, "MiB/s", "higher"),
+}
+
+
+##############
+# Public API #
+##############
+
+def run(guests=500, iterations=5, clone_size=64, only=None):
+    """
+    Run the benchmarks, return the results dict that is written out
+    as JSON
+
+    :param guests: Number of generated guests to add to the test driver
+    :param iterations: Timed iterations for each benchmark
+    :param clone_size: Size in MiB of the image used for clone-copy
+    :param only: List of benchmark names to run, default is all
+    """
+    names = sorted(_BENCHMARKS)
+    if only:
+        unknown = [n for n in only if n not in _BENCHMARKS]
+        if unknown:
+            raise ValueError("Unknown benchmarks: %s" % ", ".join(unknown))
+        names = [n for n in names if n in only]
+
+    tmpdir = tempfile.mkdtemp(prefix="virtinst-perf-")
+    ctx = _BenchContext(tmpdir, guests, iterations, clone_size)
+    results = {}
+    try:
+        for name in names:
+            func, unit, better = _BENCHMARKS[name]
+            ret = func(ctx)
+            if not isinstance(ret, dict):
+                ret = {name: ret}
+            for resultname, value in ret.items():
+                results[resultname] = {
+                    "value": value, "unit": unit, "better": better}
+    finally:
+        ctx.close()
+        shutil.rmtree(tmpdir)
+
+    return {
+        "format": _FORMAT_VERSION,
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "libvirt": libvirt.getVersion(),
+        "params": {"guests": guests, "iterations": iterations,
+                   "clone_size": clone_size},
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Compare two results dicts
+
+    :returns: (list of report lines, list of regressed benchmark names)
+    """
+    lines = []
+    regressed = []
+    if baseline.get("params") != current.get("params"):
+        lines.append("WARNING: benchmark parameters differ: %s vs %s" %
+                     (baseline.get("params"), current.get("params")))
+
+    lines.append("%-24s %12s %12s %9s" %
+                 ("benchmark", "baseline", "current", "change"))
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        old = baseline["results"].get(name)
+        new = current["results"].get(name)
+        if not old or not new:
+            lines.append("%-24s %s" % (name, "missing from " +
+                         (old and "current" or "baseline")))
+            continue
+
+        change = (new["value"] - old["value"]) / old["value"] * 100
+        worse = change if new["better"] == "lower" else -change
+        mark = ""
+        if worse > threshold:
+            mark = "  REGRESSION"
+            regressed.append(name)
+        lines.append("%-24s %12.4g %12.4g %+8.1f%% %s%s" %
+                     (name, old["value"], new["value"], change,
+                      new["unit"], mark))
+    return lines, regressed
+
+
+def _load(path):
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("format") != _FORMAT_VERSION:
+        raise ValueError("%s: unsupported results format %s" %
+                         (path, data.get("format")))
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="virt-manager/virtinst benchmark suite")
+    subparsers = parser.add_subparsers(dest="command")
+
+    runp = subparsers.add_parser("run", help="Run the benchmarks")
+    runp.add_argument("--guests", type=int, default=500,
+                      help="Generated guests to add to the test driver")
+    runp.add_argument("--iterations", type=int, default=5)
+    runp.add_argument("--clone-size", type=int, default=64,
+                      help="Size in MiB of the clone-copy image")
+    runp.add_argument("--only", action="append",
+                      help="Only run this benchmark, one of: %s" %
+                      ", ".join(sorted(_BENCHMARKS)))
+    runp.add_argument("--output", help="Write JSON results to this file")
+
+    comparep = subparsers.add_parser("compare",
+                                     help="Compare results with a baseline")
+    comparep.add_argument("baseline")
+    comparep.add_argument("current")
+    comparep.add_argument("--threshold", type=float, default=10.0,
+                          help="Percent slowdown counted as a regression")
+
+    options = parser.parse_args(argv)
+
+    if options.command == "run":
+        data = run(options.guests, options.iterations,
+                   options.clone_size, options.only)
+        for name, result in sorted(data["results"].items()):
+            print("%-24s %12.4g %s" % (name, result["value"], result["unit"]))
+        if options.output:
+            with open(options.output, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+        return 0
+
+    if options.command == "compare":
+        lines, regressed = compare(_load(options.baseline),
+                                   _load(options.current),
+                                   options.threshold)
+        print("\n".join(lines))
+        return regressed and 1 or 0
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
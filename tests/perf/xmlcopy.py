@@ -0,0 +1,133 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+Benchmark for copying parsed XML documents. XMLBuilder.get_xml copies
+the document of objects built from scratch, and tools like virt-xml
+edit a copy of a guest and diff it against the original.
+
+Every benchmark is run twice: once with XMLAPI.copy_api, and once by
+serializing the document and parsing it again, which is how copies
+used to be made.
+
+Run it with: python3 -m tests.perf.xmlcopy [--iterations N] [--devices N]
+"""
+
+import argparse
+import difflib
+import time
+
+from virtinst import xmlapi
+
+
+_DISK_TEMPLATE = """
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='/var/lib/bench/disk-%(idx)d.qcow2'/>
+      <target dev='vd%(idx)d' bus='virtio'/>
+      <address type='pci' domain='0x0000' bus='0x01' slot='0x%(slot)02x' function='0x0'/>
+    </disk>"""
+
+_INTERFACE_TEMPLATE = """
+    <interface type='network'>
+      <mac address='52:54:00:00:%(mac0)02x:%(mac1)02x'/>
+      <source network='default'/>
+      <model type='virtio'/>
+      <address type='pci' domain='0x0000' bus='0x02' slot='0x%(slot)02x' function='0x0'/>
+    </interface>"""
+
+
+def get_guest_xml(devices):
+    """
+    Return a guest XML document with 'devices' disks and as many
+    network interfaces
+    """
+    devxml = []
+    for idx in range(devices):
+        params = {"idx": idx, "slot": idx % 32,
+                  "mac0": (idx >> 8) & 0xff, "mac1": idx & 0xff}
+        devxml.append(_DISK_TEMPLATE % params)
+        devxml.append(_INTERFACE_TEMPLATE % params)
+
+    return """<domain type='kvm'>
+  <name>bench-large</name>
+  <uuid>11111111-2222-3333-4444-555555555555</uuid>
+  <memory>1048576</memory>
+  <currentMemory>1048576</currentMemory>
+  <vcpu>4</vcpu>
+  <os>
+    <type arch='x86_64'>hvm</type>
+    <boot dev='hd'/>
+  </os>
+  <devices>%s
+    <graphics type='vnc' port='-1'/>
+  </devices>
+</domain>
+""" % "".join(devxml)
+
+
+def _copy_reparse(api):
+    return xmlapi.XMLAPI(api.get_xml("."))
+
+
+def _copy_structural(api):
+    return api.copy_api()
+
+
+def _time_copy(api, copyfunc, iterations):
+    start = time.time()
+    for dummy in range(iterations):
+        copyfunc(api)
+    return (time.time() - start) / iterations
+
+
+def _time_edit_diff(api, copyfunc, iterations, devices):
+    """
+    Copy the document, change one disk path in the copy, and diff the
+    serialized copy against the original XML
+    """
+    origxml = api.get_xml(".")
+    start = time.time()
+    for idx in range(iterations):
+        newapi = copyfunc(api)
+        newapi.set_xpath_content(
+                "./devices/disk[%d]/source/@file" % (idx % devices + 1),
+                "/var/lib/bench/edited-%d.qcow2" % idx)
+        diff = list(difflib.unified_diff(origxml.splitlines(1),
+                                         newapi.get_xml(".").splitlines(1)))
+        if not diff:
+            raise RuntimeError("edit didn't change the XML")
+    return (time.time() - start) / iterations
+
+
+def run(iterations=10, devices=500):
+    """
+    Run the benchmark, return a dict of name -> seconds per iteration
+    """
+    api = xmlapi.XMLAPI(get_guest_xml(devices))
+    results = {}
+    for name, copyfunc in [("reparse", _copy_reparse),
+                           ("structural", _copy_structural)]:
+        results["copy-" + name] = _time_copy(api, copyfunc, iterations)
+        results["edit-diff-" + name] = _time_edit_diff(
+                api, copyfunc, iterations, devices)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark XML document copies")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--devices", type=int, default=500,
+                        help="Disks and interfaces in the guest XML")
+    options = parser.parse_args()
+
+    for name, secs in sorted(run(options.iterations,
+                                 options.devices).items()):
+        print("%-22s %.4fs per iteration" % (name, secs))
+
+
+if __name__ == "__main__":
+    main()
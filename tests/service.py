@@ -0,0 +1,165 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from tests import utils
+
+from virtinst import service
+
+
+class _Client(object):
+    def __init__(self, path):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._file = self._sock.makefile("rwb")
+        self._nextid = 0
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def send(self, method, **params):
+        self._nextid += 1
+        self.send_raw({"jsonrpc": "2.0", "id": self._nextid,
+                       "method": method, "params": params})
+        return self._nextid
+
+    def send_raw(self, request):
+        if not isinstance(request, str):
+            request = json.dumps(request)
+        self._file.write(request.encode("utf-8") + b"\n")
+        self._file.flush()
+
+    def recv(self):
+        return json.loads(self._file.readline().decode("utf-8"))
+
+    def call(self, method, **params):
+        reqid = self.send(method, **params)
+        ret = self.recv()
+        assert ret["id"] == reqid
+        return ret
+
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._path = os.path.join(self._tmpdir, "virtinst.sock")
+        self._service = service.VirtinstService(utils.URIs.test_full, 4)
+        self._server = service.VirtinstServer(self._path, self._service)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._service.close()
+        self._thread.join()
+        os.rmdir(self._tmpdir)
+
+    def _client(self):
+        client = _Client(self._path)
+        self.addCleanup(client.close)
+        return client
+
+    def testPing(self):
+        ret = self._client().call("ping")
+        self.assertEqual(ret["result"]["pid"], os.getpid())
+        self.assertEqual(os.stat(self._path).st_mode & 0o077, 0)
+
+    def testInstall(self):
+        client = self._client()
+        args = ["--name", "service-test", "--memory", "64", "--import",
+                "--disk", "none", "--graphics", "none"]
+        ret = client.call("install", args=args + ["--print-xml"])
+        self.assertTrue("<name>service-test</name>" in ret["result"]["xml"])
+        self.assertEqual(ret["result"]["final_xml"], None)
+
+        # Windows installs have a second step, returned on its own
+        ret = client.call("install", args=["--name", "service-test",
+                "--memory", "64", "--os-variant", "winxp",
+                "--cdrom", "/dev/default-pool/testvol1.img",
+                "--disk", "none", "--graphics", "none", "--print-xml"])
+        self.assertEqual(ret["result"]["xml"].count("<domain"), 1)
+        self.assertTrue('<boot dev="cdrom"/>' in ret["result"]["xml"])
+        self.assertTrue('<boot dev="hd"/>' in ret["result"]["final_xml"])
+
+        ret = client.call("install", args=args + ["--dry-run"])
+        self.assertEqual(ret["result"],
+                         {"name": "service-test", "dry_run": True})
+
+    def testXML(self):
+        client = self._client()
+        ret = client.call("xml", domain="test", args=["--memory", "1024"],
+                          print_xml=True)
+        self.assertTrue("<memory>1048576</memory>" in ret["result"]["xml"])
+        self.assertTrue("+  <memory>1048576</memory>" in ret["result"]["diff"])
+        self.assertFalse(ret["result"]["defined"])
+
+        ret = client.call("xml", domain="test-for-virtxml",
+                          action="add-device", args=["--sound", "ich6"])
+        self.assertTrue(ret["result"]["defined"])
+        self.assertTrue("ich6" in ret["result"]["diff"])
+
+    def testClone(self):
+        ret = self._client().call("clone", original="test-clone-simple",
+                name="service-clone", auto_clone=True, clone_running=True,
+                print_xml=True)
+        self.assertTrue("<name>service-clone</name>" in ret["result"]["xml"])
+
+    def testErrors(self):
+        client = self._client()
+        ret = client.call("idontexist")
+        self.assertEqual(ret["error"]["code"], service.METHOD_NOT_FOUND)
+
+        ret = client.call("install", args=["--memory", "64"])
+        self.assertEqual(ret["error"]["code"], service.INVALID_PARAMS)
+
+        ret = client.call("install", args=["--idontexist"])
+        self.assertEqual(ret["error"]["code"], service.INVALID_PARAMS)
+
+        # Validation checks are process wide, clients can't change them
+        ret = client.call("install", args=["--name", "foo", "--import",
+                "--disk", "none", "--check", "all=off"])
+        self.assertEqual(ret["error"]["code"], service.INVALID_PARAMS)
+
+        ret = client.call("xml", domain="idontexist", args=["--memory", "64"])
+        self.assertEqual(ret["error"]["code"], service.OPERATION_FAILED)
+        self.assertTrue("idontexist" in ret["error"]["message"])
+
+        # Errors raised through cli.fail() mustn't kill the service
+        ret = client.call("install", args=["--name", "foo", "--import",
+                "--disk", "/dev/default-pool/collidevol1.img"])
+        self.assertEqual(ret["error"]["code"], service.OPERATION_FAILED)
+        self.assertTrue("already in use" in ret["error"]["message"])
+        self.assertTrue("result" in client.call("ping"))
+
+        client.send_raw("{not json")
+        self.assertEqual(client.recv()["error"]["code"], service.PARSE_ERROR)
+        client.send_raw({"id": 5, "method": "ping"})
+        self.assertEqual(client.recv()["error"]["code"],
+                         service.INVALID_REQUEST)
+
+    def testConcurrentClients(self):
+        clients = [self._client() for dummy in range(3)]
+        sent = {}
+        for idx, client in enumerate(clients):
+            for dummy in range(4):
+                reqid = client.send("xml", domain="test", print_xml=True,
+                                    args=["--vcpus", str(idx + 1)])
+                sent[(idx, reqid)] = idx + 1
+
+        for idx, client in enumerate(clients):
+            for dummy in range(4):
+                ret = client.recv()
+                vcpus = sent.pop((idx, ret["id"]))
+                self.assertTrue(">%d</vcpu>" % vcpus in ret["result"]["xml"])
+        self.assertEqual(sent, {})
@@ -0,0 +1,56 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import threading
+import unittest
+
+from virtManager.statsbatch import StatsBatcher
+
+
+class _FakeVM(object):
+    def __init__(self, uuid, block=False):
+        self._uuid = uuid
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+        self.calls = 0
+
+    def get_uuid(self):
+        return self._uuid
+
+
+def _fetch_stats(vm):
+    vm.calls += 1
+    vm.release.wait(5)
+    return {"virt-manager.timestamp": 0}
+
+
+class TestStatsBatcher(unittest.TestCase):
+    def testSlowVM(self):
+        fastvm = _FakeVM("fast")
+        slowvm = _FakeVM("slow", block=True)
+        vms = [fastvm, slowvm]
+        batcher = StatsBatcher(4, "Stats batch test")
+
+        try:
+            # The slow VM times out on the first tick, and isn't
+            # resubmitted on the second while its request still runs
+            for tick in range(2):
+                ret = batcher.run(vms, _fetch_stats, 1)
+                self.assertTrue("fast" in ret)
+                self.assertFalse("slow" in ret)
+                self.assertTrue("slow" in batcher.skipped)
+                self.assertEqual(fastvm.calls, tick + 1)
+                self.assertEqual(slowvm.calls, 1)
+
+            slowvm.release.set()
+            batcher.get_pending("slow").result(5)
+            ret = batcher.run(vms, _fetch_stats, 1)
+            self.assertTrue("slow" in ret)
+            self.assertFalse("slow" in batcher.skipped)
+            self.assertEqual(slowvm.calls, 2)
+        finally:
+            slowvm.release.set()
+            batcher.cleanup()
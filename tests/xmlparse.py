@@ -8,6 +8,7 @@ import traceback
 import unittest
 
 import virtinst
+from virtinst.snapshot import DomainSnapshotSummary
 
 from tests import utils
 
@@ -1095,6 +1096,25 @@ class XMLParseTest(unittest.TestCase):
 
         utils.diff_compare(snap.get_xml(), outfile)
 
+    def testSnapshotSummary(self):
+        xml = open("tests/xmlparse-xml/change-snapshot-in.xml").read()
+        summary = DomainSnapshotSummary(xml)
+        snap = virtinst.DomainSnapshot(self.conn, parsexml=xml)
+
+        for propname in ["name", "state", "description", "parent",
+                         "creationTime", "memory_type"]:
+            self.assertEqual(getattr(summary, propname),
+                             getattr(snap, propname))
+        self.assertEqual(summary.disk_snapshot_modes, ["internal"])
+        self.assertFalse(summary.is_external())
+
+        summary = DomainSnapshotSummary(
+            "<domainsnapshot><name>foo</name>"
+            "<memory snapshot='external' file='/tmp/foo'/></domainsnapshot>")
+        self.assertEqual(summary.name, "foo")
+        self.assertEqual(summary.description, None)
+        self.assertTrue(summary.is_external())
+
 
     ###################
     # Interface tests #
@@ -1437,3 +1457,28 @@ class XMLParseTest(unittest.TestCase):
         guest = virtinst.Guest(self.conn, parsexml=open(infile).read())
 
         utils.diff_compare(guest.get_xml(), outfile)
+
+    def testDomainCache(self):
+        # Refetching unchanged domain XML should reuse the parsed objects
+        conn = utils.URIs.openconn(utils.URIs.test_default)
+        guest1 = conn.fetch_all_domains()[0]
+        conn.invalidate_domain_cache()
+        guest2 = conn.fetch_all_domains()[0]
+        self.assertTrue(guest1 is guest2)
+
+        # Changed XML must be reparsed
+        dom = conn.lookupByName(guest1.name)
+        origmem = guest1.memory
+        dom.setMemory(origmem // 2)
+        try:
+            conn.invalidate_domain_cache()
+            guest3 = conn.fetch_all_domains()[0]
+            self.assertTrue(guest3 is not guest1)
+            self.assertEqual(guest3.memory, origmem // 2)
+        finally:
+            dom.setMemory(origmem)
+
+        # Removed entries are always reparsed
+        conn.remove_cached_domain(guest1.name)
+        guest4 = conn.fetch_all_domains()[0]
+        self.assertTrue(guest4 is not guest3)
@@ -385,6 +385,13 @@ class vmmConfig(object):
         self.conf.set("/stats/update-interval", interval)
     def on_stats_update_interval_changed(self, cb):
         return self.conf.notify_add("/stats/update-interval", cb)
+    def get_stats_max_update_interval(self):
+        interval = self.conf.get("/stats/max-update-interval")
+        return max(interval, self.get_stats_update_interval())
+    def set_stats_max_update_interval(self, interval):
+        self.conf.set("/stats/max-update-interval", interval)
+    def on_stats_max_update_interval_changed(self, cb):
+        return self.conf.notify_add("/stats/max-update-interval", cb)
 
 
     # Disable/Enable different stats polling
@@ -448,6 +455,18 @@ class vmmConfig(object):
     def set_auto_usbredir(self, state):
         self.conf.set("/console/auto-redirect", state)
 
+    def get_console_log_replay_size(self):
+        return self.conf.get("/console/log-replay-size")
+
+    def get_console_thumbnail_interval(self):
+        return max(self.conf.get("/console/thumbnail-update-interval"), 1)
+    def set_console_thumbnail_interval(self, val):
+        self.conf.set("/console/thumbnail-update-interval", val)
+    def get_console_thumbnail_max_parallel(self):
+        return max(self.conf.get("/console/thumbnail-max-parallel"), 1)
+    def set_console_thumbnail_max_parallel(self, val):
+        self.conf.set("/console/thumbnail-max-parallel", val)
+
     # Show VM details toolbar
     def get_details_show_toolbar(self):
         res = self.conf.get("/details/show-toolbar")
@@ -603,6 +622,10 @@ class vmmConfig(object):
 
         self.conf.set("/connections/autoconnect", uris)
 
+    # Number of threads fetching object XML while a connection opens
+    def get_conn_init_workers(self):
+        return max(self.conf.get("/connections/init-workers"), 1)
+
 
     # Default directory location dealings
     def _get_default_dir_key(self, _type):
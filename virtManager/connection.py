@@ -4,7 +4,9 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import collections
 import logging
+import math
 import os
 import threading
 import time
@@ -17,6 +19,7 @@ from virtinst import pollhelpers
 from virtinst import util
 
 from . import connectauth
+from . import module_trace
 from .baseclass import vmmGObject
 from .domain import vmmDomain
 from .interface import vmmInterface
@@ -145,6 +148,200 @@ class _ObjectList(vmmGObject):
             return self._objects[:]
 
 
+class _PollRate(object):
+    """
+    Tracks the effective polling interval for a single connection.
+
+    The interval starts at the configured stats update interval. It
+    backs off for connections where a tick takes a big chunk of the
+    interval (laggy remote hosts), or where nothing has changed for a
+    while (idle hosts), up to the configured maximum. Any observed
+    change or libvirt event speeds it back up.
+    """
+    # If a tick takes longer than this fraction of the interval, the
+    # connection can't keep up, so back off
+    SLOW_FRACTION = 0.5
+    # Number of consecutive ticks without changes before backing off
+    QUIET_TICKS = 5
+    BACKOFF_FACTOR = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._min = 1
+        self._max = 1
+        self._interval = 1
+        self._last_tick = 0
+        self._quiet_ticks = 0
+        self._changes = 0
+        self.last_duration = 0
+
+    def _clamp(self, value):
+        return int(max(self._min, min(self._max, math.ceil(value))))
+
+    def get_interval(self):
+        return self._interval
+
+    def set_bounds(self, minval, maxval):
+        with self._lock:
+            self._min = minval
+            self._max = max(minval, maxval)
+            self._interval = self._clamp(self._interval)
+
+    def note_change(self, count=1):
+        with self._lock:
+            self._changes += count
+
+    def reset(self):
+        """
+        Drop back to the fastest allowed interval. Called when we see
+        libvirt events, since the connection is clearly not idle.
+        """
+        with self._lock:
+            self._quiet_ticks = 0
+            self._interval = self._min
+
+    def is_due(self, now):
+        # The engine timer fires every self._min seconds, so allow half
+        # of that for timer jitter
+        return (now + (self._min / 2.0)) >= (self._last_tick + self._interval)
+
+    def record_tick(self, start, duration):
+        """
+        Record a finished tick and recalculate the interval
+
+        :param start: time.time() value when the tick started
+        :param duration: How many seconds the tick took
+        :returns: The new interval
+        """
+        with self._lock:
+            changes = self._changes
+            self._changes = 0
+            self._last_tick = start
+            self.last_duration = duration
+
+            newval = self._interval
+            if duration > self._interval * self.SLOW_FRACTION:
+                self._quiet_ticks = 0
+                newval = max(self._interval * self.BACKOFF_FACTOR,
+                             duration / self.SLOW_FRACTION)
+            elif changes:
+                self._quiet_ticks = 0
+                newval = self._interval / float(self.BACKOFF_FACTOR)
+            else:
+                self._quiet_ticks += 1
+                if self._quiet_ticks >= self.QUIET_TICKS:
+                    self._quiet_ticks = 0
+                    newval = self._interval * self.BACKOFF_FACTOR
+
+            self._interval = self._clamp(newval)
+            return self._interval
+
+
+class _NodeDevIndex(object):
+    """
+    Lookup tables for nodedevs by device_type, capability_type and
+    (vendor_id, product_id), so filtering doesn't need to walk and
+    parse every nodedev on hosts with thousands of them.
+
+    Entries are keyed by connkey and kept in insertion order. Devices
+    whose XML couldn't be fetched are remembered and retried on the
+    next lookup.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devs = {}
+        self._keys = {}
+        self._by_type = {}
+        self._by_cap = {}
+        self._by_ids = {}
+        self._unparsed = {}
+
+    @staticmethod
+    def _get_keys(dev):
+        xmlobj = dev.get_xmlobj()
+        return (xmlobj.device_type,
+                getattr(xmlobj, "capability_type", None),
+                (getattr(xmlobj, "vendor_id", None),
+                 getattr(xmlobj, "product_id", None)))
+
+    @staticmethod
+    def _table_remove(table, key, connkey):
+        entries = table.get(key)
+        if entries is None:
+            return
+        entries.pop(connkey, None)
+        if not entries:
+            del(table[key])
+
+    def _remove(self, connkey):
+        self._devs.pop(connkey, None)
+        self._unparsed.pop(connkey, None)
+        keys = self._keys.pop(connkey, None)
+        if not keys:
+            return
+        devtype, devcap, ids = keys
+        self._table_remove(self._by_type, devtype, connkey)
+        self._table_remove(self._by_cap, devcap, connkey)
+        self._table_remove(self._by_ids, ids, connkey)
+
+    def _add(self, dev):
+        connkey = dev.get_connkey()
+        try:
+            keys = self._get_keys(dev)
+        except libvirt.libvirtError as e:
+            # Libvirt nodedev XML fetching can be busted
+            # https://bugzilla.redhat.com/show_bug.cgi?id=1225771
+            if e.get_error_code() != libvirt.VIR_ERR_NO_NODE_DEVICE:
+                logging.debug("Error fetching nodedev XML", exc_info=True)
+            self._unparsed[connkey] = dev
+            return
+
+        devtype, devcap, ids = keys
+        self._devs[connkey] = dev
+        self._keys[connkey] = keys
+        self._by_type.setdefault(devtype, collections.OrderedDict())[
+            connkey] = dev
+        self._by_cap.setdefault(devcap, collections.OrderedDict())[
+            connkey] = dev
+        self._by_ids.setdefault(ids, collections.OrderedDict())[
+            connkey] = dev
+
+    def _retry_unparsed(self):
+        for dev in list(self._unparsed.values()):
+            del(self._unparsed[dev.get_connkey()])
+            self._add(dev)
+
+    def add(self, dev):
+        with self._lock:
+            self._remove(dev.get_connkey())
+            self._add(dev)
+
+    def remove(self, dev):
+        with self._lock:
+            self._remove(dev.get_connkey())
+
+    def lookup(self, devtype=None, devcap=None, ids=None):
+        """
+        Return the nodedevs matching every passed key
+        """
+        with self._lock:
+            self._retry_unparsed()
+
+            tables = []
+            if devtype:
+                tables.append(self._by_type.get(devtype, {}))
+            if devcap:
+                tables.append(self._by_cap.get(devcap, {}))
+            if ids:
+                tables.append(self._by_ids.get(ids, {}))
+            if not tables:
+                return list(self._devs.values())
+
+            tables.sort(key=len)
+            return [dev for connkey, dev in tables[0].items() if
+                    all(connkey in t for t in tables[1:])]
+
+
 class vmmConnection(vmmGObject):
     __gsignals__ = {
         "vm-added": (vmmGObject.RUN_FIRST, None, [str]),
@@ -159,6 +356,7 @@ class vmmConnection(vmmGObject):
         "nodedev-added": (vmmGObject.RUN_FIRST, None, [str]),
         "nodedev-removed": (vmmGObject.RUN_FIRST, None, [str]),
         "resources-sampled": (vmmGObject.RUN_FIRST, None, []),
+        "init-progress": (vmmGObject.RUN_FIRST, None, []),
         "state-changed": (vmmGObject.RUN_FIRST, None, []),
         "open-completed": (vmmGObject.RUN_FIRST, None, [object]),
     }
@@ -182,7 +380,9 @@ class vmmConnection(vmmGObject):
         self.connect_error = None
 
         self._init_object_count = None
+        self._init_object_total = None
         self._init_object_event = None
+        self._init_progress_emitted = 0
 
         self._network_capable = None
         self._storage_capable = None
@@ -201,10 +401,12 @@ class vmmConnection(vmmGObject):
         self._xml_flags = {}
 
         self._objects = _ObjectList()
+        self._nodedev_index = _NodeDevIndex()
         self.statsmanager = vmmStatsManager()
 
         self._stats = []
         self._hostinfo = None
+        self._pollrate = _PollRate()
 
         self.add_gsettings_handle(
             self._on_config_pretty_name_changed(
@@ -572,6 +774,17 @@ class vmmConnection(vmmGObject):
     def is_connecting(self):
         return self._state == self._STATE_CONNECTING
 
+    def get_init_progress(self):
+        """
+        Return (initialized objects, total objects) while the connection
+        is still loading its initial objects, None otherwise
+        """
+        total = self._init_object_total
+        remaining = self._init_object_count
+        if total is None or remaining is None:
+            return None
+        return max(total - remaining, 0), total
+
     def get_state_text(self):
         if self.is_disconnected():
             return _("Disconnected")
@@ -618,37 +831,11 @@ class vmmConnection(vmmGObject):
     ############################
 
     def filter_nodedevs(self, devtype=None, devcap=None):
-        retdevs = []
-        for dev in self.list_nodedevs():
-            try:
-                xmlobj = dev.get_xmlobj()
-            except libvirt.libvirtError as e:
-                # Libvirt nodedev XML fetching can be busted
-                # https://bugzilla.redhat.com/show_bug.cgi?id=1225771
-                if e.get_error_code() != libvirt.VIR_ERR_NO_NODE_DEVICE:
-                    logging.debug("Error fetching nodedev XML", exc_info=True)
-                continue
-
-            if devtype and xmlobj.device_type != devtype:
-                continue
-
-            if devcap:
-                if (not hasattr(xmlobj, "capability_type") or
-                    xmlobj.capability_type != devcap):
-                    continue
-
-            retdevs.append(dev)
-
-        return retdevs
+        return self._nodedev_index.lookup(devtype=devtype, devcap=devcap)
 
     def get_nodedev_count(self, devtype, vendor, product):
-        count = 0
-        devs = self.filter_nodedevs(devtype)
-
-        for dev in devs:
-            if (vendor == dev.xmlobj.vendor_id and
-                product == dev.xmlobj.product_id):
-                count += 1
+        count = len(self._nodedev_index.lookup(devtype=devtype,
+                                               ids=(vendor, product)))
 
         logging.debug("There are %d node devices with "
                       "vendorId: %s, productId: %s",
@@ -709,6 +896,7 @@ class vmmConnection(vmmGObject):
                 obj.change_name_backend(newobj)
 
         if newobj and obj.is_domain():
+            self._backend.remove_cached_domain(oldconnkey)
             self.emit("vm-renamed", oldconnkey, obj.get_connkey())
 
 
@@ -730,6 +918,8 @@ class vmmConnection(vmmGObject):
         name = domain.name()
         logging.debug("domain xmlmisc event: domain=%s event=%s args=%s",
                 name, eventstr, args)
+        self._pollrate.reset()
+        self._backend.invalidate_domain_cache()
         obj = self.get_vm(name)
         if not obj:
             return
@@ -743,6 +933,8 @@ class vmmConnection(vmmGObject):
         name = domain.name()
         logging.debug("domain lifecycle event: domain=%s %s", name,
                 LibvirtEnumMap.domain_lifecycle_str(state, reason))
+        self._pollrate.reset()
+        self._backend.invalidate_domain_cache()
 
         obj = self.get_vm(name)
 
@@ -758,6 +950,7 @@ class vmmConnection(vmmGObject):
         name = domain.name()
         logging.debug("domain agent lifecycle event: domain=%s %s", name,
                 LibvirtEnumMap.domain_agent_lifecycle_str(state, reason))
+        self._pollrate.reset()
 
         obj = self.get_vm(name)
 
@@ -773,6 +966,7 @@ class vmmConnection(vmmGObject):
         name = network.name()
         logging.debug("network lifecycle event: network=%s %s",
                 name, LibvirtEnumMap.network_lifecycle_str(state, reason))
+        self._pollrate.reset()
         obj = self.get_net(name)
 
         if obj:
@@ -788,6 +982,7 @@ class vmmConnection(vmmGObject):
         name = pool.name()
         logging.debug("storage pool lifecycle event: pool=%s %s",
             name, LibvirtEnumMap.storage_lifecycle_str(state, reason))
+        self._pollrate.reset()
 
         obj = self.get_pool(name)
 
@@ -818,6 +1013,7 @@ class vmmConnection(vmmGObject):
         name = dev.name()
         logging.debug("node device lifecycle event: nodedev=%s %s",
             name, LibvirtEnumMap.nodedev_lifecycle_str(state, reason))
+        self._pollrate.reset()
 
         self.schedule_priority_tick(pollnodedev=True, force=True)
 
@@ -960,6 +1156,7 @@ class vmmConnection(vmmGObject):
             self._node_device_cb_ids = []
 
         self._stats = []
+        self._pollrate = _PollRate()
 
         if self._init_object_event:
             self._init_object_event.clear()
@@ -973,7 +1170,9 @@ class vmmConnection(vmmGObject):
                 logging.debug("Failed to cleanup %s: %s", obj, e)
         self._objects.cleanup()
         self._objects = _ObjectList()
+        self._nodedev_index = _NodeDevIndex()
 
+        module_trace.unregister_conn(self._backend.get_conn_for_api_arg())
         closeret = self._backend.close()
         if closeret == 1 and self.config.test_leak_debug:
             logging.debug("LEAK: conn close() returned 1, "
@@ -1010,6 +1209,8 @@ class vmmConnection(vmmGObject):
 
         try:
             self._backend.open(connectauth.creds_dialog, self)
+            module_trace.register_conn(self._backend.get_conn_for_api_arg(),
+                                       self.get_uri())
             return True, None
         except Exception as e:
             exc = e
@@ -1083,6 +1284,7 @@ class vmmConnection(vmmGObject):
         self._init_object_event.wait()
         self._init_object_event = None
         self._init_object_count = None
+        self._init_object_total = None
 
     def _open_thread(self):
         ConnectError = None
@@ -1140,6 +1342,10 @@ class vmmConnection(vmmGObject):
                 continue
 
             logging.debug("%s=%s removed", class_name, name)
+            if obj.is_domain():
+                self._backend.remove_cached_domain(obj.get_connkey())
+            elif obj.is_nodedev():
+                self._nodedev_index.remove(obj)
             self._remove_object_signal(obj)
             obj.cleanup()
 
@@ -1166,6 +1372,10 @@ class vmmConnection(vmmGObject):
                     class_name, obj.get_name())
                 return
 
+            obj.connect("state-changed", self._object_state_changed_cb)
+            if obj.is_nodedev():
+                self._nodedev_index.add(obj)
+
             if not obj.is_nodedev():
                 # Skip nodedev logging since it's noisy and not interesting
                 logging.debug("%s=%s status=%s added", class_name,
@@ -1185,6 +1395,17 @@ class vmmConnection(vmmGObject):
                 self._init_object_count -= 1
                 if self._init_object_count <= 0:
                     self._init_object_event.set()
+                self._emit_init_progress()
+
+    def _object_state_changed_cb(self, obj):
+        # Nodedev update events refetch the XML and land here. The signal
+        # is emitted from an idle callback, so the object may have been
+        # removed since, and must not go back in the index.
+        if (obj.is_nodedev() and self._objects and
+            self._objects.lookup_object(obj.__class__,
+                                        obj.get_connkey()) is obj):
+            self._nodedev_index.add(obj)
+        self._pollrate.note_change()
 
     def _update_nets(self, dopoll):
         keymap = dict((o.get_connkey(), o) for o in self.list_nets())
@@ -1235,6 +1456,8 @@ class vmmConnection(vmmGObject):
 
             if initial_poll:
                 self._init_object_count += len(new)
+            if gone or new:
+                self._pollrate.note_change(len(gone) + len(new))
 
             gone_objects.extend(gone)
             preexisting_objects.extend([o for o in master if o not in new])
@@ -1247,34 +1470,60 @@ class vmmConnection(vmmGObject):
         new_ifaces = _process_objects(self._update_interfaces(polliface))
         new_nodedevs = _process_objects(self._update_nodedevs(pollnodedev))
 
-        # Kick off one thread per object type to handle the initial
-        # XML fetching. Going any more fine grained then this probably
-        # won't be that useful due to libvirt's locking structure.
-        #
         # Would prefer to start refreshing some objects before all polling
         # is complete, but we need init_object_count to be fully accurate
         # before we start initializing objects
 
+        if initial_poll:
+            self._init_object_total = self._init_object_count
+            self._emit_init_progress(force=True)
+
         if initial_poll and self._init_object_count == 0:
             # If the connection doesn't have any objects, new_object_cb
             # is never called and the event is never set, so let's do it here
             self._init_object_event.set()
 
-        for newlist in [new_vms, new_nets, new_pools,
-                new_ifaces, new_nodedevs]:
-            if not newlist:
-                continue
+        # VMs first, in the manager's sort order, so the rows the user
+        # sees at the top of the list fill in first
+        new_vms.sort(key=lambda o: o.get_name())
+        self._init_new_objects(new_vms + new_nets + new_pools +
+                               new_ifaces + new_nodedevs)
 
-            def cb(lst):
-                for obj in lst:
-                    obj.connect_once("initialized", self._new_object_cb)
-                    obj.init_libvirt_state()
+        return gone_objects, preexisting_objects
 
-            self._start_thread(cb,
-                "refreshing xml for new %s" % newlist[0].class_name(),
-                args=(newlist,))
+    def _init_new_objects(self, newobjs):
+        """
+        Fetch the initial XML and state for newly seen objects. On
+        connect that's one XMLDesc RPC per object, so spread them over
+        a pool of threads: libvirtd serves concurrent RPCs fine, and on
+        big remote hosts the round trip latency dominates otherwise.
+        """
+        if not newobjs:
+            return
 
-        return gone_objects, preexisting_objects
+        pending = collections.deque(newobjs)
+        def _worker():
+            while True:
+                try:
+                    obj = pending.popleft()
+                except IndexError:
+                    return
+                obj.connect_once("initialized", self._new_object_cb)
+                obj.init_libvirt_state()
+
+        nworkers = min(self.config.get_conn_init_workers(), len(newobjs))
+        for idx in range(nworkers):
+            self._start_thread(_worker,
+                "refreshing xml for new objects %d" % idx)
+
+    def _emit_init_progress(self, force=False):
+        # Rate limit, there can be thousands of objects
+        now = time.time()
+        if (not force and self._init_object_count and
+            now - self._init_progress_emitted < .25):
+            return
+        self._init_progress_emitted = now
+        self.idle_emit("init-progress")
 
     def _tick(self, stats_update=False,
              pollvm=False, pollnet=False,
@@ -1418,14 +1667,42 @@ class vmmConnection(vmmGObject):
         from .engine import vmmEngine
         vmmEngine.get_instance().schedule_priority_tick(self, kwargs)
 
+    def get_poll_interval(self):
+        """
+        The effective poll interval in seconds, adapted to how slow
+        and how busy this connection is.
+        """
+        return self._pollrate.get_interval()
+
+    def poll_is_due(self, now):
+        """
+        Used by the engine to decide if this connection should be
+        included in the periodic tick
+        """
+        return self._pollrate.is_due(now)
+
+    def _record_tick(self, start):
+        self._pollrate.set_bounds(self.config.get_stats_update_interval(),
+                                  self.config.get_stats_max_update_interval())
+        oldinterval = self._pollrate.get_interval()
+        duration = time.time() - start
+        newinterval = self._pollrate.record_tick(start, duration)
+        if newinterval != oldinterval:
+            logging.debug("conn=%s poll interval changed from %ss to %ss "
+                "(tick took %.2fs)", self.get_uri(), oldinterval,
+                newinterval, duration)
+
     def tick_from_engine(self, *args, **kwargs):
         e = None
+        start = time.time()
         try:
             self._tick(*args, **kwargs)
         except Exception as err:
             e = err
 
         if e is None:
+            if self.is_active():
+                self._record_tick(start)
             return
 
         from_remote = getattr(libvirt, "VIR_FROM_REMOTE", None)
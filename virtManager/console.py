@@ -258,6 +258,10 @@ class vmmConsolePages(vmmGObjectUI):
         self.add_gsettings_handle(
             self.vm.on_console_resizeguest_changed(
                 self._refresh_resizeguest_from_settings))
+        self._refresh_console_log_from_settings()
+        self.add_gsettings_handle(
+            self.vm.on_console_log_changed(
+                self._refresh_console_log_from_settings))
         self.add_gsettings_handle(
             self.config.on_console_accels_changed(self._refresh_enable_accel))
 
@@ -464,6 +468,15 @@ class vmmConsolePages(vmmGObjectUI):
         self.vm.set_console_resizeguest(val)
         self._sync_resizeguest_with_display()
 
+    def _refresh_console_log_from_settings(self):
+        self.widget("details-menu-view-console-log").set_active(
+            bool(self.vm.get_console_log()))
+
+    def _console_log_ui_changed_cb(self, src):
+        val = src.get_active()
+        if val != bool(self.vm.get_console_log()):
+            self.vm.set_console_log(val)
+
     def _do_size_to_vm(self, src_ignore):
         # Resize the console to best fit the VM resolution
         if not self._viewer:
@@ -1048,6 +1061,8 @@ class vmmConsolePages(vmmGObjectUI):
         return self._refresh_can_fullscreen()
     def details_resizeguest_ui_changed_cb(self, *args, **kwargs):
         return self._resizeguest_ui_changed_cb(*args, **kwargs)
+    def details_console_log_ui_changed_cb(self, *args, **kwargs):
+        return self._console_log_ui_changed_cb(*args, **kwargs)
 
     def details_page_changed(self, *args, **kwargs):
         return self._page_changed(*args, **kwargs)
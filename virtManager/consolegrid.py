@@ -0,0 +1,320 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import collections
+import hashlib
+import logging
+import threading
+
+from gi.repository import Gtk
+from gi.repository import Pango
+
+from . import uiutil
+from .baseclass import vmmGObjectUI
+from .connmanager import vmmConnectionManager
+
+# Longest side of the scaled down screenshots
+_THUMBNAIL_SIZE = 320
+
+
+class _Tile(object):
+    """
+    One VM in the grid: a screenshot with the VM name below it
+    """
+    def __init__(self, vm):
+        self.vm = vm
+        self.has_screenshot = False
+
+        self.image = Gtk.Image()
+        self.image.set_size_request(_THUMBNAIL_SIZE,
+                                    _THUMBNAIL_SIZE * 3 // 4)
+        self.label = Gtk.Label()
+        self.label.set_ellipsize(Pango.EllipsizeMode.END)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=3)
+        box.pack_start(self.image, True, True, 0)
+        box.pack_start(self.label, False, False, 0)
+
+        self.widget = Gtk.FlowBoxChild()
+        self.widget.add(box)
+        self.widget.show_all()
+
+        self.refresh_label()
+        self.set_status_icon()
+
+    def refresh_label(self):
+        self.label.set_text(self.vm.get_name())
+        self.widget.set_tooltip_text(
+            "%s\n%s" % (self.vm.get_name(), self.vm.conn.get_pretty_desc()))
+
+    def set_status_icon(self):
+        self.has_screenshot = False
+        self.image.set_from_icon_name(self.vm.run_status_icon_name(),
+                                      Gtk.IconSize.DIALOG)
+
+    def set_pixbuf(self, pixbuf):
+        self.has_screenshot = True
+        self.image.set_from_pixbuf(pixbuf)
+
+
+class vmmConsoleGrid(vmmGObjectUI):
+    """
+    Window showing periodically refreshed, low resolution screenshots
+    of every running VM with graphics, across all connections.
+
+    Screenshots are taken with virDomainScreenshot by worker threads,
+    at most thumbnail-max-parallel at a time per connection. The
+    workers also hash, decode and scale the image, and only hand it to
+    the main loop when the screenshot changed since the last refresh.
+    """
+    @classmethod
+    def show_instance(cls, parentobj):
+        try:
+            if not cls._instance:
+                cls._instance = vmmConsoleGrid()
+            cls._instance.show(parentobj.topwin)
+        except Exception as e:
+            parentobj.err.show_err(
+                    _("Error launching console thumbnails: %s") % str(e))
+
+    def __init__(self):
+        vmmGObjectUI.__init__(self, "consolegrid.ui", "vmm-console-grid")
+        self._cleanup_on_app_close()
+
+        self._tiles = collections.OrderedDict()
+        self._timer = None
+
+        # Worker state, shared with the screenshot threads
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._workers = {}
+        self._inflight = set()
+        self._digests = {}
+        self._running = False
+
+        self.builder.connect_signals({
+            "on_vmm_console_grid_delete_event": self.close,
+            "on_grid_interval_changed": self._interval_changed,
+            "on_grid_max_parallel_changed": self._max_parallel_changed,
+            "on_grid_flowbox_child_activated": self._tile_activated,
+        })
+        self.bind_escape_key_close()
+
+        self.widget("grid-interval").set_value(
+            self.config.get_console_thumbnail_interval())
+        self.widget("grid-max-parallel").set_value(
+            self.config.get_console_thumbnail_max_parallel())
+
+    def _cleanup(self):
+        self._stop()
+        self._tiles = collections.OrderedDict()
+        with self._lock:
+            self._digests = {}
+
+    def show(self, parent):
+        logging.debug("Showing console thumbnails")
+        self.topwin.set_transient_for(parent)
+        self.topwin.present()
+        self._start()
+
+    def close(self, ignore1=None, ignore2=None):
+        logging.debug("Closing console thumbnails")
+        self.topwin.hide()
+        self._stop()
+        return 1
+
+
+    ##################
+    # Refresh timing #
+    ##################
+
+    def _start(self):
+        with self._lock:
+            self._running = True
+        self._refresh()
+        self._reset_timer()
+
+    def _stop(self):
+        with self._lock:
+            self._running = False
+            for pending in self._pending.values():
+                for vm in pending:
+                    self._inflight.discard(vm)
+            self._pending = {}
+        if self._timer:
+            self.remove_gobject_timeout(self._timer)
+            self._timer = None
+
+    def _reset_timer(self):
+        if self._timer:
+            self.remove_gobject_timeout(self._timer)
+            self._timer = None
+        if not self.topwin.get_visible():
+            return
+        interval = self.config.get_console_thumbnail_interval()
+        self._timer = self.timeout_add(interval * 1000, self._refresh_timer)
+
+    def _refresh_timer(self):
+        self._refresh()
+        return True
+
+    def _interval_changed(self, src):
+        self.config.set_console_thumbnail_interval(
+            int(uiutil.spin_get_helper(src)))
+        self._reset_timer()
+
+    def _max_parallel_changed(self, src):
+        self.config.set_console_thumbnail_max_parallel(
+            int(uiutil.spin_get_helper(src)))
+
+
+    ###################
+    # Tile management #
+    ###################
+
+    def _list_vms(self):
+        ret = collections.OrderedDict()
+        conns = vmmConnectionManager.get_instance().conns
+        for uri in sorted(conns):
+            conn = conns[uri]
+            if not conn.is_active():
+                continue
+
+            vms = []
+            for vm in conn.list_vms():
+                try:
+                    if vm.is_active() and vm.xmlobj.devices.graphics:
+                        vms.append(vm)
+                except Exception:
+                    logging.debug("Error checking graphics for %s",
+                                  vm.get_name(), exc_info=True)
+            if vms:
+                ret[uri] = sorted(vms, key=lambda v: v.get_name())
+        return ret
+
+    def _sync_tiles(self, vmmap):
+        flowbox = self.widget("grid-flowbox")
+        wanted = []
+        for vms in vmmap.values():
+            wanted.extend(vms)
+
+        for vm in list(self._tiles):
+            if vm in wanted:
+                continue
+            tile = self._tiles.pop(vm)
+            flowbox.remove(tile.widget)
+            with self._lock:
+                self._digests.pop(vm, None)
+
+        for vm in wanted:
+            if vm not in self._tiles:
+                tile = _Tile(vm)
+                self._tiles[vm] = tile
+                flowbox.add(tile.widget)
+            else:
+                self._tiles[vm].refresh_label()
+
+    def _refresh_status(self):
+        total = len(self._tiles)
+        shown = len([t for t in self._tiles.values() if t.has_screenshot])
+        if not total:
+            msg = _("No running VMs with graphics")
+        else:
+            msg = _("%(shown)d of %(total)d screenshots") % {
+                "shown": shown, "total": total}
+        self.widget("grid-status").set_text(msg)
+
+    def _refresh(self):
+        vmmap = self._list_vms()
+        self._sync_tiles(vmmap)
+        self._refresh_status()
+
+        for uri, vms in vmmap.items():
+            self._schedule(uri, vms)
+
+    def _update_tile(self, vm, pixbuf):
+        tile = self._tiles.get(vm)
+        if not tile:
+            return
+        if pixbuf:
+            tile.set_pixbuf(pixbuf)
+        else:
+            tile.set_status_icon()
+        self._refresh_status()
+
+    def _tile_activated(self, src, child):
+        ignore = src
+        for vm, tile in self._tiles.items():
+            if tile.widget == child:
+                from .details import vmmDetails
+                vmmDetails.get_instance(self, vm).show()
+                break
+
+
+    ######################
+    # Screenshot workers #
+    ######################
+
+    def _schedule(self, uri, vms):
+        maxparallel = self.config.get_console_thumbnail_max_parallel()
+
+        with self._lock:
+            pending = self._pending.setdefault(uri, collections.deque())
+            for vm in vms:
+                # Slow guests still in flight from the last refresh
+                # don't get queued twice
+                if vm in self._inflight:
+                    continue
+                self._inflight.add(vm)
+                pending.append(vm)
+
+            running = self._workers.get(uri, 0)
+            newworkers = max(min(maxparallel - running, len(pending)), 0)
+            self._workers[uri] = running + newworkers
+
+        for dummy in range(newworkers):
+            self._start_thread(self._worker, "Console thumbnails %s" % uri,
+                               args=(uri,))
+
+    def _worker(self, uri):
+        while True:
+            with self._lock:
+                pending = self._pending.get(uri)
+                if not self._running or not pending:
+                    self._workers[uri] -= 1
+                    return
+                vm = pending.popleft()
+
+            try:
+                self._process_vm(vm)
+            finally:
+                with self._lock:
+                    self._inflight.discard(vm)
+
+    def _process_vm(self, vm):
+        try:
+            mime, sdata = vm.take_screenshot()
+        except Exception:
+            logging.debug("Error taking thumbnail screenshot of %s",
+                          vm.get_name(), exc_info=True)
+            with self._lock:
+                self._digests.pop(vm, None)
+            self.idle_add(self._update_tile, vm, None)
+            return
+
+        digest = hashlib.sha1(sdata).hexdigest()
+        with self._lock:
+            if self._digests.get(vm) == digest:
+                return
+            self._digests[vm] = digest
+
+        try:
+            pixbuf = uiutil.make_screenshot_pixbuf(mime, sdata,
+                                                   _THUMBNAIL_SIZE)
+        except Exception:
+            logging.debug("Error decoding thumbnail screenshot of %s",
+                          vm.get_name(), exc_info=True)
+            pixbuf = None
+        self.idle_add(self._update_tile, vm, pixbuf)
@@ -0,0 +1,386 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import gzip
+import logging
+import os
+
+import libvirt
+
+from .baseclass import vmmGObject
+from .connmanager import vmmConnectionManager
+
+
+class _ConsoleLog(object):
+    """
+    Compressed, rotating log of text console output for a single VM,
+    with a seek index for quickly reading back the most recent output.
+
+    Output is buffered in memory up to FLUSH_SIZE, then appended to the
+    current log file as its own gzip member. Each member gets a line in
+    the index file recording the log file sequence number, the
+    compressed offset of the member, and the uncompressed range it
+    covers. That lets tail() decompress only the members it needs.
+    """
+    FLUSH_SIZE = 64 * 1024
+    MAX_FILE_SIZE = 1024 * 1024
+    MAX_FILES = 4
+    INDEX_NAME = "console.idx"
+
+    def __init__(self, logdir):
+        self._dir = logdir
+        self._pending = bytearray()
+        # List of (fileseq, offset, ustart, ulen)
+        self._index = []
+
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir, 0o700)
+        self._load_index()
+
+    def _filename(self, seq):
+        return os.path.join(self._dir, "console-%06d.log.gz" % seq)
+
+    def _indexpath(self):
+        return os.path.join(self._dir, self.INDEX_NAME)
+
+    def _load_index(self):
+        if not os.path.exists(self._indexpath()):
+            return
+
+        with open(self._indexpath()) as f:
+            for line in f:
+                try:
+                    entry = tuple(int(p) for p in line.split())
+                except ValueError:
+                    continue
+                if len(entry) != 4:
+                    continue
+                self._index.append(entry)
+
+        seqs = set(e[0] for e in self._index)
+        missing = [s for s in seqs if not os.path.exists(self._filename(s))]
+        if missing:
+            logging.debug("Console log files %s missing, dropping from index",
+                          missing)
+            self._index = [e for e in self._index if e[0] not in missing]
+            self._write_index()
+
+    def _write_index(self):
+        with open(self._indexpath(), "w") as f:
+            for entry in self._index:
+                f.write("%d %d %d %d\n" % entry)
+
+    def _total(self):
+        if not self._index:
+            return 0
+        return self._index[-1][2] + self._index[-1][3]
+
+    def _rotate(self, newseq):
+        keep = newseq - self.MAX_FILES + 1
+        for seq in set(e[0] for e in self._index if e[0] < keep):
+            try:
+                os.unlink(self._filename(seq))
+            except OSError as e:
+                logging.debug("Error removing old console log: %s", e)
+        self._index = [e for e in self._index if e[0] >= keep]
+        self._write_index()
+
+    def append(self, data):
+        self._pending += data
+        if len(self._pending) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        seq = self._index and self._index[-1][0] or 0
+        path = self._filename(seq)
+        if (os.path.exists(path) and
+            os.path.getsize(path) >= self.MAX_FILE_SIZE):
+            seq += 1
+            path = self._filename(seq)
+            self._rotate(seq)
+
+        data = bytes(self._pending)
+        self._pending = bytearray()
+
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(gzip.compress(data))
+
+        entry = (seq, offset, self._total(), len(data))
+        self._index.append(entry)
+        with open(self._indexpath(), "a") as f:
+            f.write("%d %d %d %d\n" % entry)
+
+    def tail(self, maxbytes):
+        """
+        Return the last maxbytes of logged output, including anything
+        not yet flushed to disk
+        """
+        ret = []
+        start = self._total() - (maxbytes - len(self._pending))
+        for seq, offset, ustart, ulen in self._index:
+            if ustart + ulen <= start:
+                continue
+            try:
+                with open(self._filename(seq), "rb") as f:
+                    f.seek(offset)
+                    with gzip.GzipFile(fileobj=f) as gz:
+                        data = gz.read(ulen)
+            except Exception as e:
+                logging.debug("Error reading console log: %s", e)
+                continue
+            ret.append(data[max(0, start - ustart):])
+
+        ret.append(bytes(self._pending))
+        return b"".join(ret)[-maxbytes:]
+
+
+class vmmConsoleLogger(vmmGObject):
+    """
+    Optional background service that keeps a text console stream open
+    for every running VM that has console logging enabled, and writes
+    the output to rotating compressed logs in the VM cache dir.
+
+    When a text console tab is opened for the same device it takes
+    over the stream, since libvirt only allows one client per console.
+    The tab replays the tail of the log, then passes its data back to
+    us so the log has no gaps.
+    """
+    FLUSH_INTERVAL = 5000
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    @classmethod
+    def get_instance(cls):
+        if not cls._instance:
+            cls._instance = vmmConsoleLogger()
+        return cls._instance
+
+    def __init__(self):
+        vmmGObject.__init__(self)
+        self._cleanup_on_app_close()
+
+        # All of these are keyed by (uri, uuid)
+        self._logs = {}
+        self._streams = {}
+        self._vms = {}
+        self._settings_handles = {}
+        self._taken = set()
+
+        connmanager = vmmConnectionManager.get_instance()
+        connmanager.connect("conn-added", self._conn_added)
+        for conn in connmanager.conns.values():
+            self._conn_added(connmanager, conn)
+
+        self.timeout_add(self.FLUSH_INTERVAL, self._flush_all)
+
+    def _cleanup(self):
+        for key in list(self._streams):
+            self._close_stream(key)
+        self._flush_all()
+        self._logs = {}
+        self._vms = {}
+        self._settings_handles = {}
+        self._taken = set()
+
+
+    ###########################
+    # Object tracking helpers #
+    ###########################
+
+    def _key(self, vm):
+        return (vm.conn.get_uri(), vm.get_uuid())
+
+    def _conn_added(self, _src, conn):
+        conn.connect("vm-added", self._vm_added)
+        conn.connect("vm-removed", self._vm_removed)
+        for vm in conn.list_vms():
+            self._vm_added(conn, vm.get_connkey())
+
+    def _vm_added(self, conn, connkey):
+        vm = conn.get_vm(connkey)
+        if not vm:
+            return
+        key = self._key(vm)
+        if key in self._vms:
+            return
+
+        self._vms[key] = vm
+        vm.connect("state-changed", self._refresh_vm)
+        handle = vm.on_console_log_changed(self._refresh_vm, vm)
+        self.add_gsettings_handle(handle)
+        self._settings_handles[key] = handle
+        self._refresh_vm(vm)
+
+    def _vm_removed(self, conn, connkey):
+        for key, vm in list(self._vms.items()):
+            if key[0] != conn.get_uri() or vm.get_connkey() != connkey:
+                continue
+
+            self._close_stream(key)
+            if key in self._logs:
+                self._logs.pop(key).flush()
+            self.remove_gsettings_handle(self._settings_handles.pop(key))
+            vm.disconnect_by_obj(self)
+            self._vms.pop(key)
+
+    def _get_log(self, vm):
+        key = self._key(vm)
+        if key not in self._logs:
+            logdir = os.path.join(vm.get_cache_dir(), "console-log")
+            self._logs[key] = _ConsoleLog(logdir)
+        return self._logs[key]
+
+    def _console_devname(self, vm):
+        devs = vm.get_serialcon_devices()
+        if not devs:
+            return None
+        return devs[0].alias.name or None
+
+    def _flush_all(self):
+        for log in self._logs.values():
+            try:
+                log.flush()
+            except Exception:
+                logging.debug("Error flushing console log", exc_info=True)
+        return True
+
+
+    ##################
+    # Stream helpers #
+    ##################
+
+    def _refresh_vm(self, vm):
+        key = self._key(vm)
+        want = (vm.get_console_log() and
+                vm.is_active() and
+                key not in self._taken and
+                bool(vm.get_serialcon_devices()))
+
+        if want and key not in self._streams:
+            self._open_stream(vm)
+        elif not want and key in self._streams:
+            self._close_stream(key)
+
+    def _open_stream(self, vm):
+        key = self._key(vm)
+        devname = self._console_devname(vm)
+        logging.debug("Opening background console log stream for "
+                      "vm=%s alias=%s", vm.get_name(), devname)
+
+        try:
+            stream = vm.conn.get_backend().newStream(
+                    libvirt.VIR_STREAM_NONBLOCK)
+            vm.open_console(devname, stream)
+            stream.eventAddCallback((libvirt.VIR_STREAM_EVENT_READABLE |
+                                     libvirt.VIR_STREAM_EVENT_ERROR |
+                                     libvirt.VIR_STREAM_EVENT_HANGUP),
+                                    self._event_on_stream, key)
+        except Exception as e:
+            logging.debug("Error opening console log stream for %s: %s",
+                          vm.get_name(), e)
+            return
+
+        self._streams[key] = stream
+
+    def _close_stream(self, key):
+        stream = self._streams.pop(key, None)
+        if not stream:
+            return
+
+        try:
+            stream.eventRemoveCallback()
+        except Exception:
+            logging.debug("Error removing stream callback", exc_info=True)
+        try:
+            stream.finish()
+        except Exception:
+            logging.debug("Error finishing stream", exc_info=True)
+
+    def _event_on_stream(self, stream, events, key):
+        if (events & libvirt.VIR_EVENT_HANDLE_ERROR or
+            events & libvirt.VIR_EVENT_HANDLE_HANGUP):
+            logging.debug("Console log stream ERROR/HANGUP for %s", key)
+            self._close_stream(key)
+            return
+
+        if not events & libvirt.VIR_EVENT_HANDLE_READABLE:
+            return
+
+        try:
+            got = stream.recv(self.STREAM_CHUNK_SIZE)
+        except Exception:
+            logging.debug("Error receiving console log stream data",
+                          exc_info=True)
+            self._close_stream(key)
+            return
+
+        if got == -2:
+            # This is basically EAGAIN
+            return
+        if len(got) == 0:
+            logging.debug("Console log stream EOF for %s", key)
+            self._close_stream(key)
+            return
+
+        self._get_log(self._vms[key]).append(got)
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def take_console(self, vm, devname):
+        """
+        Called by a text console tab that is about to open a stream.
+        If we are logging that console device, close our stream so the
+        tab can open it.
+
+        :returns: True if the tab should pass its data to append()
+        """
+        if not vm.get_console_log():
+            return False
+        if devname != self._console_devname(vm):
+            return False
+
+        key = self._key(vm)
+        self._taken.add(key)
+        self._close_stream(key)
+        return True
+
+    def release_console(self, vm):
+        """
+        Called by a text console tab when it closes its stream, so we
+        can resume logging
+        """
+        key = self._key(vm)
+        if key not in self._taken:
+            return
+        self._taken.discard(key)
+        self._refresh_vm(vm)
+
+    def append(self, vm, data):
+        self._get_log(vm).append(data)
+
+    def get_replay_data(self, vm, devname):
+        """
+        Return the most recently logged output for the passed console
+        device, or empty bytes if we have nothing
+        """
+        if devname != self._console_devname(vm):
+            return b""
+
+        logdir = os.path.join(vm.get_cache_dir(), "console-log")
+        if self._key(vm) not in self._logs and not os.path.exists(logdir):
+            return b""
+
+        maxbytes = self.config.get_console_log_replay_size() * 1024
+        try:
+            return self._get_log(vm).tail(maxbytes)
+        except Exception:
+            logging.debug("Error reading console log", exc_info=True)
+            return b""
@@ -626,6 +626,8 @@ class vmmDetails(vmmGObjectUI):
                 self.console.details_scaling_ui_changed_cb),
             "on_details_menu_view_resizeguest_toggled": (
                 self.console.details_resizeguest_ui_changed_cb),
+            "on_details_menu_view_console_log_toggled": (
+                self.console.details_console_log_ui_changed_cb),
 
             "on_console_pages_switch_page": (
                 self.console.details_page_changed),
@@ -4,6 +4,7 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import io
 import logging
 import os
 import time
@@ -17,6 +18,7 @@ from virtinst import Guest
 from virtinst import util
 from virtinst import DeviceController
 from virtinst import DeviceDisk
+from virtinst.snapshot import DomainSnapshotSummary
 
 from .libvirtobject import vmmLibvirtObject
 from .libvirtenummap import LibvirtEnumMap
@@ -82,11 +84,17 @@ class vmmInspectionData(object):
 
 class vmmDomainSnapshot(vmmLibvirtObject):
     """
-    Class wrapping a virDomainSnapshot object
+    Class wrapping a virDomainSnapshot object.
+
+    Listing snapshots only needs a DomainSnapshotSummary. The full
+    DomainSnapshot, with its embedded domain XML, is only parsed when
+    get_xmlobj() is first called.
     """
-    def __init__(self, conn, backend):
+    def __init__(self, conn, backend, is_current=None):
         vmmLibvirtObject.__init__(self, conn, backend, backend.getName(),
                                   DomainSnapshot)
+        self._summary = None
+        self._is_current = is_current
 
 
     ##########################
@@ -109,7 +117,7 @@ class vmmDomainSnapshot(vmmLibvirtObject):
     def tick(self, stats_update=True):
         ignore = stats_update
     def _init_libvirt_state(self):
-        self.ensure_latest_xml()
+        self.get_summary()
 
 
     ###########
@@ -120,25 +128,27 @@ class vmmDomainSnapshot(vmmLibvirtObject):
         ignore = force
         self._backend.delete()
 
+    def get_summary(self):
+        if not self._summary:
+            self._summary = DomainSnapshotSummary(self._XMLDesc(0))
+        return self._summary
+
     def run_status(self):
-        status = DomainSnapshot.state_str_to_int(self.get_xmlobj().state)
+        status = DomainSnapshot.state_str_to_int(self.get_summary().state)
         return LibvirtEnumMap.pretty_run_status(status, False)
     def run_status_icon_name(self):
-        status = DomainSnapshot.state_str_to_int(self.get_xmlobj().state)
+        status = DomainSnapshot.state_str_to_int(self.get_summary().state)
         if status not in LibvirtEnumMap.VM_STATUS_ICONS:
             logging.debug("Unknown status %d, using NOSTATE", status)
             status = libvirt.VIR_DOMAIN_NOSTATE
         return LibvirtEnumMap.VM_STATUS_ICONS[status]
 
     def is_current(self):
-        return self._backend.isCurrent()
+        if self._is_current is None:
+            self._is_current = bool(self._backend.isCurrent())
+        return self._is_current
     def is_external(self):
-        if self.get_xmlobj().memory_type == "external":
-            return True
-        for disk in self.get_xmlobj().disks:
-            if disk.snapshot == "external":
-                return True
-        return False
+        return self.get_summary().is_external()
 
 
 class vmmDomain(vmmLibvirtObject):
@@ -993,6 +1003,9 @@ class vmmDomain(vmmLibvirtObject):
         self.conn.define_domain(xml)
     def _XMLDesc(self, flags):
         return self._backend.XMLDesc(flags)
+    def _build_xmlobj(self, xml):
+        return self.conn.get_backend().parse_domain_cached(
+            self.get_connkey(), xml, self._active_xml_flags)
     def _get_backend_status(self):
         return self._backend.info()[0]
 
@@ -1028,15 +1041,71 @@ class vmmDomain(vmmLibvirtObject):
 
         return self._backend.openGraphicsFD(0, flags)
 
+    def _take_screenshot(self):
+        stream = None
+        try:
+            stream = self.conn.get_backend().newStream(0)
+            screen = 0
+            flags = 0
+            mime = self._backend.screenshot(stream, screen, flags)
+
+            ret = io.BytesIO()
+            def _write_cb(_stream, data, userdata):
+                ignore = stream
+                ignore = userdata
+                ret.write(data)
+
+            stream.recvAll(_write_cb, None)
+            return mime, ret.getvalue()
+        finally:
+            try:
+                if stream:
+                    stream.finish()
+            except Exception:
+                pass
+
+    def take_screenshot(self):
+        """
+        Grab the guest's primary screen with virDomainScreenshot.
+        Blocks on the libvirt stream, so call it from a thread.
+
+        :returns: (mimetype, image data)
+        """
+        # qemu + qxl has a bug where screenshot generally only shows
+        # the data from the previous screenshot request, so we need
+        # to take two:
+        # https://bugs.launchpad.net/qemu/+bug/1314293
+        if any([v.model == "qxl" for v in self.xmlobj.devices.video]):
+            self._take_screenshot()
+        return self._take_screenshot()
+
+    def _get_current_snapshot_name(self):
+        try:
+            if not self._backend.hasCurrentSnapshot(0):
+                return None
+            return self._backend.snapshotCurrent(0).getName()
+        except Exception:
+            logging.debug("Error looking up current snapshot",
+                          exc_info=True)
+            return None
+
     def list_snapshots(self):
-        if self._snapshot_list is None:
-            newlist = []
+        """
+        Return the list of vmmDomainSnapshot. This is safe to call from
+        a thread, the first call after refresh_snapshots() fetches every
+        snapshot's XML from libvirt.
+        """
+        snapshot_list = self._snapshot_list
+        if snapshot_list is None:
+            snapshot_list = []
+            currentname = self._get_current_snapshot_name()
             for rawsnap in self._backend.listAllSnapshots():
-                obj = vmmDomainSnapshot(self.conn, rawsnap)
+                obj = vmmDomainSnapshot(self.conn, rawsnap,
+                    is_current=(currentname == rawsnap.getName()))
                 obj.init_libvirt_state()
-                newlist.append(obj)
-            self._snapshot_list = newlist
-        return self._snapshot_list[:]
+                snapshot_list.append(obj)
+            self._snapshot_list = snapshot_list
+        return snapshot_list[:]
 
     @vmmLibvirtObject.lifecycle_action
     def revert_to_snapshot(self, snap):
@@ -1347,44 +1416,6 @@ class vmmDomain(vmmLibvirtObject):
         self._has_managed_save = None
 
 
-    def migrate(self, destconn, dest_uri=None,
-            tunnel=False, unsafe=False, temporary=False, meter=None):
-        self._install_abort = True
-
-        flags = 0
-        flags |= libvirt.VIR_MIGRATE_LIVE
-
-        if not temporary:
-            flags |= libvirt.VIR_MIGRATE_PERSIST_DEST
-            flags |= libvirt.VIR_MIGRATE_UNDEFINE_SOURCE
-
-        if tunnel:
-            flags |= libvirt.VIR_MIGRATE_PEER2PEER
-            flags |= libvirt.VIR_MIGRATE_TUNNELLED
-
-        if unsafe:
-            flags |= libvirt.VIR_MIGRATE_UNSAFE
-
-        libvirt_destconn = destconn.get_backend().get_conn_for_api_arg()
-        logging.debug("Migrating: conn=%s flags=%s uri=%s tunnel=%s "
-            "unsafe=%s temporary=%s",
-            destconn, flags, dest_uri, tunnel, unsafe, temporary)
-
-        if meter:
-            start_job_progress_thread(self, meter, _("Migrating domain"))
-
-        params = {}
-        if dest_uri and not tunnel:
-            params[libvirt.VIR_MIGRATE_PARAM_URI] = dest_uri
-
-        if tunnel:
-            self._backend.migrateToURI3(dest_uri, params, flags)
-        else:
-            self._backend.migrate3(libvirt_destconn, params, flags)
-
-        # Don't schedule any conn update, migrate dialog handles it for us
-
-
     ###################
     # Stats accessors #
     ###################
@@ -1516,6 +1547,14 @@ class vmmDomain(vmmLibvirtObject):
             return self.config.get_console_resizeguest()
         return ret
 
+    def on_console_log_changed(self, *args, **kwargs):
+        return self.config.listen_pervm(self.get_uuid(), "/console-log",
+                                        *args, **kwargs)
+    def set_console_log(self, value):
+        self.config.set_pervm(self.get_uuid(), "/console-log", value)
+    def get_console_log(self):
+        return self.config.get_pervm(self.get_uuid(), "/console-log")
+
     def set_details_window_size(self, w, h):
         self.config.set_pervm(self.get_uuid(), "/vm-window-size", (w, h))
     def get_details_window_size(self):
@@ -1629,6 +1668,10 @@ class vmmDomainVirtinst(vmmDomain):
         ignore = xml
         self.emit("state-changed")
 
+    def _build_xmlobj(self, xml):
+        # Not a real libvirt domain, keep it out of the domain cache
+        return vmmLibvirtObject._build_xmlobj(self, xml)
+
     def _invalidate_xml(self):
         vmmDomain._invalidate_xml(self)
         self._orig_xml = None
@@ -14,9 +14,11 @@ from gi.repository import Gio
 from gi.repository import GLib
 from gi.repository import Gtk
 
+from . import module_trace
 from .baseclass import vmmGObject
 from .connect import vmmConnect
 from .connmanager import vmmConnectionManager
+from .consolelog import vmmConsoleLogger
 from .inspection import vmmInspection
 from .systray import vmmSystray
 
@@ -97,6 +99,7 @@ class vmmEngine(vmmGObject):
         """
         vmmSystray.get_instance()
         vmmInspection.get_instance()
+        vmmConsoleLogger.get_instance()
 
         self.add_gsettings_handle(
             self.config.on_stats_update_interval_changed(
@@ -354,16 +357,24 @@ class vmmEngine(vmmGObject):
         self._add_obj_to_tick_queue(conn, True, **kwargs)
 
     def _tick(self):
-        for conn in self._connobjs.values():
-            self._add_obj_to_tick_queue(conn, False,
-                                        stats_update=True, pollvm=True)
+        # The timer fires at the configured stats interval, but each
+        # connection can back off its own poll rate if it is slow or idle.
+        now = time.time()
+        with module_trace.timed(None, "engine-tick", "schedule"):
+            for conn in self._connobjs.values():
+                if not conn.poll_is_due(now):
+                    continue
+                self._add_obj_to_tick_queue(conn, False,
+                                            stats_update=True, pollvm=True)
         return 1
 
     def _handle_tick_queue(self):
         while True:
             ignore1, ignore2, conn, kwargs = self._tick_queue.get()
             try:
-                conn.tick_from_engine(**kwargs)
+                with module_trace.timed(conn.get_uri(), "engine-tick",
+                                        "tick_from_engine"):
+                    conn.tick_from_engine(**kwargs)
             except Exception:
                 # Don't attempt to show any UI error here, since it
                 # can cause dialogs to appear from nowhere if say
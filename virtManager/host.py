@@ -249,6 +249,12 @@ class vmmHost(vmmGObjectUI):
         self.cpu_usage_graph.set_property("data_array", cpu_vector)
         self.memory_usage_graph.set_property("data_array", memory_vector)
 
+        interval = self.conn.get_poll_interval()
+        text = _("%d seconds") % interval
+        if interval > self.config.get_stats_update_interval():
+            text += " " + _("(backed off, slow or idle connection)")
+        self.widget("overview-poll-interval").set_text(text)
+
     def conn_state_changed(self, ignore1=None):
         conn_active = self.conn.is_active()
 
@@ -0,0 +1,203 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import logging
+
+from gi.repository import Gtk
+
+from virtinst import util
+
+from . import module_trace
+from .baseclass import vmmGObjectUI
+
+(COL_URI,
+ COL_CATEGORY,
+ COL_NAME,
+ COL_COUNT,
+ COL_TOTAL,
+ COL_AVG,
+ COL_MAX,
+ COL_MAINLOOP,
+ COL_HISTOGRAM) = range(9)
+
+(STALL_COL_LOCATION,
+ STALL_COL_COUNT,
+ STALL_COL_TOTAL,
+ STALL_COL_MAX,
+ STALL_COL_STACK) = range(5)
+
+
+class vmmInstrumentation(vmmGObjectUI):
+    """
+    Debug window showing the stats recorded by module_trace when
+    virt-manager is run with --instrument or --detect-stalls
+    """
+    REFRESH_INTERVAL = 2000
+
+    @classmethod
+    def show_instance(cls, parentobj):
+        try:
+            if not cls._instance:
+                cls._instance = vmmInstrumentation()
+            cls._instance.show(parentobj.topwin)
+        except Exception as e:
+            parentobj.err.show_err(
+                    _("Error launching instrumentation: %s") % str(e))
+
+    def __init__(self):
+        vmmGObjectUI.__init__(self, "instrumentation.ui",
+                              "vmm-instrumentation")
+        self._cleanup_on_app_close()
+
+        self.builder.connect_signals({
+            "on_vmm_instrumentation_delete_event": self.close,
+            "on_instrumentation_close_clicked": self.close,
+            "on_instrumentation_reset_clicked": self._reset_clicked,
+            "on_instrumentation_save_clicked": self._save_clicked,
+        })
+        self.bind_escape_key_close()
+
+        self._init_list()
+        self._init_stall_list()
+        self.timeout_add(self.REFRESH_INTERVAL, self._refresh_timer)
+
+    def _cleanup(self):
+        pass
+
+    def show(self, parent):
+        logging.debug("Showing instrumentation")
+        self._refresh()
+        self.topwin.set_transient_for(parent)
+        self.topwin.present()
+
+    def close(self, ignore1=None, ignore2=None):
+        logging.debug("Closing instrumentation")
+        self.topwin.hide()
+        return 1
+
+
+    ###########
+    # UI init #
+    ###########
+
+    @staticmethod
+    def _ms_data_func(column, cell, model, _iter, idx):
+        ignore = column
+        cell.set_property("text", "%.1f" % (model[_iter][idx] * 1000))
+
+    def _init_list(self):
+        statslist = self.widget("instrumentation-list")
+        model = Gtk.ListStore(str, str, str, int,
+                              float, float, float, float, str)
+        statslist.set_model(model)
+
+        for idx, title in [(COL_URI, _("Connection")),
+                           (COL_CATEGORY, _("Category")),
+                           (COL_NAME, _("Name")),
+                           (COL_COUNT, _("Calls")),
+                           (COL_TOTAL, _("Total (ms)")),
+                           (COL_AVG, _("Average (ms)")),
+                           (COL_MAX, _("Max (ms)")),
+                           (COL_MAINLOOP, _("Main loop (ms)")),
+                           (COL_HISTOGRAM, _("Histogram"))]:
+            txt = Gtk.CellRendererText()
+            col = Gtk.TreeViewColumn(title)
+            col.pack_start(txt, True)
+            col.set_sort_column_id(idx)
+            col.set_resizable(True)
+            if idx in [COL_TOTAL, COL_AVG, COL_MAX, COL_MAINLOOP]:
+                col.set_cell_data_func(txt, self._ms_data_func, idx)
+            else:
+                col.add_attribute(txt, "text", idx)
+            statslist.append_column(col)
+
+        model.set_sort_column_id(COL_TOTAL, Gtk.SortType.DESCENDING)
+        histogram = ", ".join(["<%sms" % int(b * 1000)
+                               for b in module_trace.HISTOGRAM_BOUNDS])
+        statslist.set_tooltip_text(
+            _("Histogram buckets: %s, slower") % histogram)
+
+    def _init_stall_list(self):
+        stalllist = self.widget("instrumentation-stall-list")
+        model = Gtk.ListStore(str, int, float, float, str)
+        stalllist.set_model(model)
+        stalllist.set_tooltip_column(STALL_COL_STACK)
+
+        for idx, title in [(STALL_COL_LOCATION, _("Location")),
+                           (STALL_COL_COUNT, _("Stalls")),
+                           (STALL_COL_TOTAL, _("Total (ms)")),
+                           (STALL_COL_MAX, _("Max (ms)"))]:
+            txt = Gtk.CellRendererText()
+            col = Gtk.TreeViewColumn(title)
+            col.pack_start(txt, True)
+            col.set_sort_column_id(idx)
+            col.set_resizable(True)
+            if idx in [STALL_COL_TOTAL, STALL_COL_MAX]:
+                col.set_cell_data_func(txt, self._ms_data_func, idx)
+            else:
+                col.add_attribute(txt, "text", idx)
+            stalllist.append_column(col)
+
+        model.set_sort_column_id(STALL_COL_TOTAL, Gtk.SortType.DESCENDING)
+        if not module_trace.stall_detector_enabled():
+            stalllist.get_parent().hide()
+
+
+    ##################
+    # Refresh / save #
+    ##################
+
+    def _refresh_timer(self):
+        if self.topwin.get_visible():
+            self._refresh()
+        return True
+
+    def _refresh(self):
+        stats = module_trace.get_stats()
+        model = self.widget("instrumentation-list").get_model()
+        model.clear()
+
+        mainloop_total = 0
+        for s in stats:
+            mainloop_total += s["mainloop_time"]
+            model.append([s["uri"], s["category"], s["name"], s["count"],
+                          s["total"], s["total"] / s["count"], s["max"],
+                          s["mainloop_time"],
+                          " ".join([str(c) for c in s["histogram"]])])
+
+        stalls = module_trace.get_stall_report()
+        model = self.widget("instrumentation-stall-list").get_model()
+        model.clear()
+
+        stall_count = 0
+        for s in stalls:
+            stall_count += s["count"]
+            model.append([s["location"], s["count"], s["total"], s["max"],
+                          util.xml_escape(s["stack"])])
+
+        summary = (_("%(count)d entries, %(mainloop).1f ms blocking the "
+                     "main loop") % {"count": len(stats),
+                                     "mainloop": mainloop_total * 1000})
+        if module_trace.stall_detector_enabled():
+            summary += ", " + (_("%d main loop stalls") % stall_count)
+        self.widget("instrumentation-summary").set_text(summary)
+
+    def _reset_clicked(self, _src):
+        module_trace.reset_stats()
+        self._refresh()
+
+    def _save_clicked(self, _src):
+        path = self.err.browse_local(None,
+                _("Save Instrumentation Stats"),
+                _type=("json", _("JSON files")),
+                dialog_type=Gtk.FileChooserAction.SAVE,
+                default_name="virt-manager-stats.json")
+        if not path:
+            return
+
+        try:
+            module_trace.dump_json(path)
+        except Exception as e:
+            self.err.show_err(_("Error saving stats: %s") % str(e))
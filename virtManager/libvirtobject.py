@@ -6,6 +6,7 @@
 
 import logging
 
+from . import module_trace
 from .baseclass import vmmGObject
 
 
@@ -307,9 +308,10 @@ class vmmLibvirtObject(vmmGObject):
             origxml = self._xmlobj.get_xml()
 
         self._invalidate_xml()
-        active_xml = self._XMLDesc(self._active_xml_flags)
-        self._xmlobj = self._parseclass(self.conn.get_backend(),
-            parsexml=active_xml)
+        with module_trace.timed(self.conn.get_uri(), "xml-refresh",
+                                self.class_name()):
+            active_xml = self._XMLDesc(self._active_xml_flags)
+            self._xmlobj = self._build_xmlobj(active_xml)
         self._is_xml_valid = True
 
         if not nosignal and origxml != active_xml:
@@ -333,9 +335,11 @@ class vmmLibvirtObject(vmmGObject):
             # the current object is inactive XML (like when the domain is
             # stopped). Callers that request inactive are basically expecting
             # a new copy.
-            inactive_xml = self._XMLDesc(self._inactive_xml_flags)
-            return self._parseclass(self.conn.get_backend(),
-                parsexml=inactive_xml)
+            with module_trace.timed(self.conn.get_uri(), "xml-refresh",
+                                    self.class_name() + "-inactive"):
+                inactive_xml = self._XMLDesc(self._inactive_xml_flags)
+                return self._parseclass(self.conn.get_backend(),
+                    parsexml=inactive_xml)
 
         if (self._xmlobj is None or
             (refresh_if_nec and not self._is_xml_valid)):
@@ -352,6 +356,13 @@ class vmmLibvirtObject(vmmGObject):
     # Internal XML routines #
     #########################
 
+    def _build_xmlobj(self, xml):
+        """
+        Parse the active XML into our cached xmlobj. vmmDomain extends
+        this to share parsed objects through the connection domain cache
+        """
+        return self._parseclass(self.conn.get_backend(), parsexml=xml)
+
     def _invalidate_xml(self):
         """
         Mark cached XML as invalid. Subclasses may extend this
@@ -15,6 +15,7 @@ import libvirt
 
 from virtinst import util
 
+from . import module_trace
 from . import vmmenu
 from . import uiutil
 from .baseclass import vmmGObjectUI
@@ -137,6 +138,10 @@ class vmmManager(vmmGObjectUI):
 
             "on_menu_edit_preferences_activate": self.show_preferences,
             "on_menu_help_about_activate": self.show_about,
+            "on_menu_help_instrumentation_activate":
+                self.show_instrumentation,
+            "on_menu_view_console_thumbnails_activate":
+                self.show_console_grid,
         })
 
         # There seem to be ref counting issues with calling
@@ -152,6 +157,9 @@ class vmmManager(vmmGObjectUI):
         self.init_stats()
         self.init_toolbar()
         self.init_context_menus()
+        self.widget("menu_help_instrumentation").set_visible(
+                module_trace.INSTRUMENT or
+                module_trace.stall_detector_enabled())
 
         self.update_current_selection()
         self.widget("vm-list").get_selection().connect(
@@ -466,6 +474,14 @@ class vmmManager(vmmGObjectUI):
         from .about import vmmAbout
         vmmAbout.show_instance(self)
 
+    def show_instrumentation(self, _src):
+        from .instrumentation import vmmInstrumentation
+        vmmInstrumentation.show_instance(self)
+
+    def show_console_grid(self, _src):
+        from .consolegrid import vmmConsoleGrid
+        vmmConsoleGrid.show_instance(self)
+
     def show_preferences(self, src_ignore):
         from .preferences import vmmPreferences
         vmmPreferences.show_instance(self)
@@ -592,7 +608,13 @@ class vmmManager(vmmGObjectUI):
         if conn.is_disconnected():
             text += " - " + _("Not Connected")
         elif conn.is_connecting():
-            text += " - " + _("Connecting...")
+            progress = conn.get_init_progress()
+            if progress and progress[1]:
+                text += " - " + (_("Loading %(done)d of %(total)d "
+                                   "objects...") %
+                                 {"done": progress[0], "total": progress[1]})
+            else:
+                text += " - " + _("Connecting...")
 
         markup = "<span size='smaller'>%s</span>" % text
         return markup
@@ -657,6 +679,7 @@ class vmmManager(vmmGObjectUI):
         conn.connect("vm-removed", self.vm_removed)
         conn.connect("resources-sampled", self.conn_row_updated)
         conn.connect("state-changed", self.conn_state_changed)
+        conn.connect("init-progress", self.conn_init_progress)
 
         for vm in conn.list_vms():
             self.vm_added(conn, vm.get_connkey())
@@ -755,6 +778,12 @@ class vmmManager(vmmGObjectUI):
         self.conn_row_updated(conn)
         self.update_current_selection()
 
+    def conn_init_progress(self, conn):
+        row = self.get_row(conn)
+        if not row:
+            return
+        row[ROW_MARKUP] = self._build_conn_markup(conn, row[ROW_SORT_KEY])
+
     def conn_row_updated(self, conn):
         row = self.get_row(conn)
 
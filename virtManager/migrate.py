@@ -12,12 +12,12 @@ from gi.repository import Gtk
 from gi.repository import Pango
 
 from virtinst import util
+from virtinst.migration import MigrationOptions, MigrationQueue
 
 from . import uiutil
 from .asyncjob import vmmAsyncJob
 from .baseclass import vmmGObjectUI
 from .connmanager import vmmConnectionManager
-from .domain import vmmDomain
 
 
 NUM_COLS = 3
@@ -50,6 +50,8 @@ class vmmMigrateDialog(vmmGObjectUI):
             "on_migrate_set_address_toggled": self._set_address_toggled,
             "on_migrate_set_port_toggled": self._set_port_toggled,
             "on_migrate_mode_changed": self._mode_changed,
+            "on_migrate_postcopy_toggled": self._postcopy_toggled,
+            "on_migrate_all_toggled": self._migrate_all_toggled,
         })
         self.bind_escape_key_close()
         self._cleanup_on_app_close()
@@ -151,6 +153,11 @@ class vmmMigrateDialog(vmmGObjectUI):
             self.widget("migrate-unsafe-label").get_tooltip_text())
         self.widget("migrate-temporary").set_tooltip_text(
             self.widget("migrate-temporary-label").get_tooltip_text())
+        for name in ["compressed", "auto-converge", "postcopy",
+                     "postcopy-after", "parallel", "bandwidth", "all",
+                     "max-parallel"]:
+            self.widget("migrate-%s" % name).set_tooltip_text(
+                self.widget("migrate-%s-label" % name).get_tooltip_text())
 
     def _reset_state(self):
         title_str = ("<span size='large' color='white'>%s '%s'</span>" %
@@ -176,6 +183,16 @@ class vmmMigrateDialog(vmmGObjectUI):
         self.widget("migrate-mode").set_active(0)
         self.widget("migrate-unsafe").set_active(False)
         self.widget("migrate-temporary").set_active(False)
+        self.widget("migrate-compressed").set_active(False)
+        self.widget("migrate-auto-converge").set_active(False)
+        self.widget("migrate-postcopy").set_active(False)
+        self.widget("migrate-postcopy").toggled()
+        self.widget("migrate-postcopy-after").set_value(60)
+        self.widget("migrate-parallel").set_value(0)
+        self.widget("migrate-bandwidth").set_value(0)
+        self.widget("migrate-all").set_active(False)
+        self.widget("migrate-all").toggled()
+        self.widget("migrate-max-parallel").set_value(2)
 
         if self.conn.is_xen():
             # Default xen port is 8002
@@ -280,6 +297,21 @@ class vmmMigrateDialog(vmmGObjectUI):
         self.widget("migrate-direct-box").set_visible(not is_tunnel)
         self.widget("migrate-tunnel-box").set_visible(is_tunnel)
 
+    def _postcopy_toggled(self, src):
+        self.widget("migrate-postcopy-after").set_sensitive(src.get_active())
+
+    def _migrate_all_toggled(self, src):
+        migrate_all = src.get_active()
+        self.widget("migrate-max-parallel").set_sensitive(migrate_all)
+
+        # Concurrent migrations can't all listen on one fixed port, let
+        # libvirt pick one for each
+        setport = self.widget("migrate-set-port")
+        if migrate_all:
+            setport.set_active(False)
+        setport.set_sensitive(not migrate_all and
+            self.widget("migrate-set-address").get_active())
+
 
     ###########################
     # destconn combo handling #
@@ -368,20 +400,43 @@ class vmmMigrateDialog(vmmGObjectUI):
             self.conn.schedule_priority_tick(pollvm=True)
             self.close()
 
+    def _build_options(self):
+        options = MigrationOptions()
+        options.tunnel = self._is_tunnel_selected()
+        options.unsafe = self.widget("migrate-unsafe").get_active()
+        options.temporary = self.widget("migrate-temporary").get_active()
+
+        if options.tunnel:
+            options.dest_uri = self.widget("migrate-tunnel-uri").get_text()
+        else:
+            options.dest_uri = self._build_regular_migrate_uri()
+
+        options.compressed = self.widget("migrate-compressed").get_active()
+        options.auto_converge = (
+            self.widget("migrate-auto-converge").get_active())
+        options.postcopy = self.widget("migrate-postcopy").get_active()
+        if options.postcopy:
+            options.postcopy_after = int(
+                self.widget("migrate-postcopy-after").get_value())
+        options.parallel_connections = int(
+            self.widget("migrate-parallel").get_value()) or None
+        options.bandwidth = int(
+            self.widget("migrate-bandwidth").get_value()) or None
+        return options
+
     def _finish(self):
         try:
             row = uiutil.get_list_selected_row(self.widget("migrate-dest"))
             destlabel = row[COL_LABEL]
             destconn = self._connobjs.get(row[COL_URI])
-
-            tunnel = self._is_tunnel_selected()
-            unsafe = self.widget("migrate-unsafe").get_active()
-            temporary = self.widget("migrate-temporary").get_active()
-
-            if tunnel:
-                uri = self.widget("migrate-tunnel-uri").get_text()
-            else:
-                uri = self._build_regular_migrate_uri()
+            options = self._build_options()
+
+            vms = [self.vm]
+            max_parallel = 1
+            if self.widget("migrate-all").get_active():
+                vms = [vm for vm in self.conn.list_vms() if vm.is_active()]
+                max_parallel = int(
+                    self.widget("migrate-max-parallel").get_value())
         except Exception as e:
             details = "".join(traceback.format_exc())
             self.err.show_err((_("Uncaught error validating input: %s") %
@@ -391,50 +446,73 @@ class vmmMigrateDialog(vmmGObjectUI):
 
         self.set_finish_cursor()
 
+        libvirt_destconn = destconn.get_backend().get_conn_for_api_arg()
+        migqueue = MigrationQueue(libvirt_destconn, options, max_parallel)
+        for vm in vms:
+            migqueue.add(vm.get_backend())
+
         cancel_cb = None
         if self.vm.getjobinfo_supported:
-            cancel_cb = (self._cancel_migration, self.vm)
+            cancel_cb = (self._cancel_migration, migqueue)
 
-        if uri:
-            destlabel += " " + uri
+        if options.dest_uri:
+            destlabel += " " + options.dest_uri
+
+        if len(vms) == 1:
+            title = _("Migrating VM '%s'") % self.vm.get_name()
+            text = (_("Migrating VM '%s' to %s. This may take a while.") %
+                    (self.vm.get_name(), destlabel))
+        else:
+            title = _("Migrating %d VMs") % len(vms)
+            text = (_("Migrating %(count)d VMs to %(dest)s. "
+                      "This may take a while.") %
+                    {"count": len(vms), "dest": destlabel})
 
         progWin = vmmAsyncJob(
             self._async_migrate,
-            [self.vm, destconn, uri, tunnel, unsafe, temporary],
+            [migqueue, self.conn, destconn, self.vm.getjobinfo_supported],
             self._finish_cb, [destconn],
-            _("Migrating VM '%s'") % self.vm.get_name(),
-            (_("Migrating VM '%s' to %s. This may take a while.") %
-             (self.vm.get_name(), destlabel)),
-            self.topwin, cancel_cb=cancel_cb)
+            title, text, self.topwin, cancel_cb=cancel_cb)
         progWin.run()
 
-    def _cancel_migration(self, asyncjob, vm):
+    def _cancel_migration(self, asyncjob, migqueue):
         logging.debug("Cancelling migrate job")
-        if not vm:
-            return
-
-        try:
-            vm.abort_job()
-        except Exception as e:
-            logging.exception("Error cancelling migrate job")
-            asyncjob.show_warning(_("Error cancelling migrate job: %s") % e)
+        if not migqueue:
             return
 
+        migqueue.cancel()
         asyncjob.job_canceled = True
         return
 
-    def _async_migrate(self, asyncjob,
-            origvm, origdconn, migrate_uri, tunnel, unsafe, temporary):
+    def _async_migrate(self, asyncjob, migqueue, srcconn, dstconn,
+            jobinfo_supported):
         meter = asyncjob.get_meter()
-
-        srcconn = origvm.conn
-        dstconn = origdconn
-
-        vminst = srcconn.get_backend().lookupByName(origvm.get_name())
-        vm = vmmDomain(srcconn, vminst, vminst.UUID())
-
-        logging.debug("Migrating vm=%s from %s to %s", vm.get_name(),
-                      srcconn.get_uri(), dstconn.get_uri())
-
-        vm.migrate(dstconn, migrate_uri, tunnel, unsafe, temporary,
-            meter=meter)
+        jobcount = len(migqueue.jobs)
+
+        def _progress_cb(q):
+            processed, total, finished = q.get_progress()
+            if not total:
+                return
+            if not meter.started:
+                meter.start(size=total, text=_("Migrating domain"))
+            if jobcount > 1:
+                meter.text = (_("Migrated %(done)d of %(count)d domains") %
+                              {"done": finished, "count": jobcount})
+            # The total estimate grows as libvirt reports real numbers,
+            # so scale to the size the meter was started with
+            meter.update(int(meter.size * processed / total))
+
+        if jobinfo_supported:
+            migqueue.progress_cb = _progress_cb
+
+        logging.debug("Migrating vms=%s from %s to %s max_parallel=%s",
+                      [j.name for j in migqueue.jobs], srcconn.get_uri(),
+                      dstconn.get_uri(), migqueue.max_parallel)
+        migqueue.run()
+
+        failed = migqueue.get_failed()
+        if len(failed) == 1 and jobcount == 1:
+            raise failed[0].error
+        if failed:
+            raise RuntimeError("\n".join(
+                ["%s: %s" % (j.name, j.error) for j in failed]))
@@ -7,9 +7,21 @@
 # This module provides a simple way to trace any activity on a specific
 # python class or module. The trace output is logged using the regular
 # logging infrastructure. Invoke this with virt-manager --trace-libvirt
+#
+# It also provides structured instrumentation: call counts, latency
+# histograms, and main thread blocking time per API and connection.
+# Invoke that with virt-manager --instrument[=FILE]
+#
+# Finally there's a main loop stall detector, which samples the main
+# thread stack while the main loop is blocked. Invoke that with
+# virt-manager --detect-stalls[=MS]
 
+import bisect
+import json
 import logging
+import os
 import re
+import sys
 import threading
 import time
 import traceback
@@ -86,3 +98,334 @@ def wrap_module(module, mainloop, regex):
             wrap_func(module, obj)
         if isinstance(obj, type):
             wrap_class(obj)
+
+
+##############################
+# Structured instrumentation #
+##############################
+
+# Set by instrument_module(). Callers outside this module only time
+# anything when this is set, so there's no cost when it's off.
+INSTRUMENT = False
+
+# Upper bounds in seconds of the latency histogram buckets. There is
+# one extra bucket for anything slower.
+HISTOGRAM_BOUNDS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5]
+
+_stats_lock = threading.Lock()
+_stats = {}
+_conn_uris = {}
+_main_thread = threading.main_thread()
+
+
+class _CallStats(object):
+    """
+    Counters for a single (uri, category, name) key
+    """
+    __slots__ = ["count", "total", "maxtime",
+                 "mainloop_count", "mainloop_time", "buckets"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maxtime = 0.0
+        self.mainloop_count = 0
+        self.mainloop_time = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, elapsed, is_main_thread):
+        self.count += 1
+        self.total += elapsed
+        self.maxtime = max(self.maxtime, elapsed)
+        if is_main_thread:
+            self.mainloop_count += 1
+            self.mainloop_time += elapsed
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, elapsed)] += 1
+
+
+class _Timer(object):
+    def __init__(self, uri, category, name):
+        self._key = (uri, category, name)
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        record(*self._key, elapsed=time.time() - self._start)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+def record(uri, category, name, elapsed):
+    """
+    Record one call that took 'elapsed' seconds. Calls made from the
+    main thread are also counted as main loop blocking time.
+    """
+    is_main_thread = threading.current_thread() is _main_thread
+    key = (uri or "", category, name)
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _CallStats()
+            _stats[key] = stats
+        stats.add(elapsed, is_main_thread)
+
+
+def timed(uri, category, name):
+    """
+    Context manager that records the time spent in its block. Does
+    nothing unless instrumentation is enabled.
+    """
+    if not INSTRUMENT:
+        return _NULL_TIMER
+    return _Timer(uri, category, name)
+
+
+def register_conn(libvirtconn, uri):
+    """
+    Map a raw virConnect to its URI, so calls on it and on objects
+    from it are recorded against that connection
+    """
+    _conn_uris[id(libvirtconn)] = uri
+
+
+def unregister_conn(libvirtconn):
+    _conn_uris.pop(id(libvirtconn), None)
+
+
+def _uri_for_libvirt_obj(obj):
+    # virDomain, virNetwork, virStoragePool etc. keep their parent
+    # virConnect in _conn
+    conn = getattr(obj, "_conn", obj)
+    return _conn_uris.get(id(conn))
+
+
+def generate_stats_wrapper(origfunc, name):
+    def newfunc(*args, **kwargs):
+        start = time.time()
+        try:
+            return origfunc(*args, **kwargs)
+        finally:
+            uri = args and _uri_for_libvirt_obj(args[0]) or None
+            record(uri, "libvirt", name, time.time() - start)
+
+    return newfunc
+
+
+def instrument_module(module):
+    """
+    Wrap every public function and class method in module to record
+    stats, and enable instrumentation for the rest of the app
+    """
+    global INSTRUMENT
+    INSTRUMENT = True
+
+    for name in dir(module):
+        obj = getattr(module, name)
+        if isinstance(obj, FunctionType):
+            setattr(module, name, generate_stats_wrapper(obj, name))
+            continue
+        if not isinstance(obj, type) or issubclass(obj, BaseException):
+            continue
+
+        for methodname in dir(obj):
+            methodobj = getattr(obj, methodname)
+            if (methodname.startswith("_") or
+                not isinstance(methodobj, FunctionType)):
+                continue
+            setattr(obj, methodname, generate_stats_wrapper(methodobj,
+                    obj.__name__ + "." + methodname))
+
+
+def get_stats():
+    """
+    Return a list of dicts with the recorded stats, slowest first
+    """
+    with _stats_lock:
+        items = [(key, stats.count, stats.total, stats.maxtime,
+                  stats.mainloop_count, stats.mainloop_time,
+                  stats.buckets[:]) for key, stats in _stats.items()]
+
+    ret = []
+    for (key, count, total, maxtime,
+         mainloop_count, mainloop_time, buckets) in items:
+        ret.append({
+            "uri": key[0],
+            "category": key[1],
+            "name": key[2],
+            "count": count,
+            "total": total,
+            "max": maxtime,
+            "mainloop_count": mainloop_count,
+            "mainloop_time": mainloop_time,
+            "histogram": buckets,
+        })
+    ret.sort(key=lambda s: s["total"], reverse=True)
+    return ret
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+    if _stall_detector:
+        _stall_detector.reset()
+
+
+def dump_json(path):
+    data = {
+        "timestamp": time.time(),
+        "histogram_bounds": HISTOGRAM_BOUNDS,
+        "stats": get_stats(),
+        "stalls": get_stall_report(),
+    }
+    logging.debug("Writing instrumentation stats to %s", path)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+############################
+# Main loop stall detector #
+############################
+
+_stall_detector = None
+
+
+def _find_culprit(stack):
+    """
+    Return a 'file:line (function)' string for the innermost frame of
+    our own code in the passed traceback.extract_stack() list
+    """
+    ours = [f for f in stack if
+            ("virtManager" + os.sep in f[0] or "virtinst" + os.sep in f[0])
+            and not f[0].endswith("module_trace.py")]
+    frame = (ours or stack)[-1]
+    shortname = os.sep.join(frame[0].split(os.sep)[-2:])
+    return "%s:%d (%s)" % (shortname, frame[1], frame[2])
+
+
+class _StallDetector(object):
+    """
+    A main loop timeout updates a heartbeat every interval. A watchdog
+    thread checks it, and if the main loop hasn't run for longer than
+    threshold it samples the main thread's stack until the heartbeat
+    resumes. Each stall is attributed to the code location seen most
+    often in its samples.
+    """
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.interval = max(threshold / 4.0, 0.01)
+
+        self._last_beat = None
+        self._lock = threading.Lock()
+        # location -> [stall count, total time, max time, stack text]
+        self._offenders = {}
+
+        self._thread = threading.Thread(target=self._watch,
+                                        name="Stall detector")
+        self._thread.daemon = True
+
+    def start(self, timeout_add):
+        timeout_add(int(self.interval * 1000), self._beat)
+        self._thread.start()
+
+    def reset(self):
+        with self._lock:
+            self._offenders = {}
+
+    def _beat(self):
+        self._last_beat = time.time()
+        return True
+
+    def _sample(self):
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(_main_thread.ident)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)
+        return _find_culprit(stack), stack
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            last = self._last_beat
+            if last is None or time.time() - last < self.threshold:
+                # Main loop isn't running yet, or it's healthy
+                continue
+
+            samples = []
+            while self._last_beat == last:
+                sample = self._sample()
+                if sample:
+                    samples.append(sample)
+                time.sleep(self.interval)
+
+            # The heartbeat should have come one interval after 'last'
+            duration = self._last_beat - last - self.interval
+            if samples and duration >= self.threshold:
+                self._record(duration, samples)
+
+    def _record(self, duration, samples):
+        counts = {}
+        for culprit, dummy in samples:
+            counts[culprit] = counts.get(culprit, 0) + 1
+        culprit = max(counts, key=lambda c: counts[c])
+        stack = [s for c, s in samples if c == culprit][0]
+
+        logging.debug("Main loop stalled for %dms in %s",
+                      duration * 1000, culprit)
+        with self._lock:
+            entry = self._offenders.get(culprit)
+            if entry is None:
+                entry = [0, 0.0, 0.0, "".join(traceback.format_list(stack))]
+                self._offenders[culprit] = entry
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+
+    def get_report(self):
+        with self._lock:
+            items = [(k, v[:]) for k, v in self._offenders.items()]
+
+        ret = [{"location": location, "count": entry[0],
+                "total": entry[1], "max": entry[2], "stack": entry[3]}
+               for location, entry in items]
+        ret.sort(key=lambda s: s["total"], reverse=True)
+        return ret
+
+
+def start_stall_detector(threshold, timeout_add):
+    """
+    Start watching for main loop stalls longer than threshold seconds
+
+    :param timeout_add: GLib.timeout_add, used to schedule the heartbeat
+        on the main loop
+    """
+    global _stall_detector
+    if _stall_detector:
+        return
+    _stall_detector = _StallDetector(threshold)
+    _stall_detector.start(timeout_add)
+
+
+def stall_detector_enabled():
+    return bool(_stall_detector)
+
+
+def get_stall_report():
+    """
+    Return a list of dicts describing main loop stalls grouped by code
+    location, worst offenders first
+    """
+    if not _stall_detector:
+        return []
+    return _stall_detector.get_report()
@@ -23,9 +23,78 @@ from gi.repository import Vte
 import libvirt
 
 from .baseclass import vmmGObject
+from .consolelog import vmmConsoleLogger
+
+
+class _RingBuffer(object):
+    """
+    Fixed size byte ring buffer. Data is copied in once on write, and
+    read back out through memoryviews so the buffered data is never
+    copied as a whole when it grows or shrinks.
+    """
+    def __init__(self, size):
+        self._size = size
+        self._buf = bytearray(size)
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def free(self):
+        return self._size - self._len
+
+    def write(self, data):
+        """
+        Copy as much of data into the buffer as fits
+
+        :returns: The number of bytes written
+        """
+        data = memoryview(data)
+        count = min(len(data), self.free())
+        end = (self._start + self._len) % self._size
+        first = min(count, self._size - end)
+        self._buf[end:end + first] = data[:first]
+        self._buf[:count - first] = data[first:count]
+        self._len += count
+        return count
+
+    def peek(self, maxlen):
+        """
+        Return a memoryview of up to maxlen bytes from the front of the
+        buffer. This may return less than is buffered if the data wraps
+        around the end of the buffer.
+        """
+        count = min(maxlen, self._len, self._size - self._start)
+        return memoryview(self._buf)[self._start:self._start + count]
+
+    def consume(self, count):
+        """
+        Drop count bytes from the front of the buffer
+        """
+        count = min(count, self._len)
+        self._len -= count
+        self._start = (self._start + count) % self._size
+        if not self._len:
+            self._start = 0
+
+    def clear(self):
+        self._start = 0
+        self._len = 0
 
 
 class ConsoleConnection(vmmGObject):
+    # Max amount of guest output we buffer before we stop reading from
+    # the stream, and let libvirt/the guest apply backpressure
+    STREAM_BUFFER_SIZE = 1024 * 1024
+    # Max amount of typed input we buffer before dropping keystrokes
+    TERMINAL_BUFFER_SIZE = 64 * 1024
+    # Max amount of data passed to a single recv/send call
+    STREAM_CHUNK_SIZE = 64 * 1024
+    # Max amount of data fed to VTE per main loop iteration, so a guest
+    # spewing output can't starve the UI
+    FEED_CHUNK_SIZE = 16 * 1024
+
     def __init__(self, vm):
         vmmGObject.__init__(self)
 
@@ -34,8 +103,12 @@ class ConsoleConnection(vmmGObject):
 
         self.stream = None
 
-        self.streamToTerminal = b""
-        self.terminalToStream = ""
+        self.streamToTerminal = _RingBuffer(self.STREAM_BUFFER_SIZE)
+        self.terminalToStream = _RingBuffer(self.TERMINAL_BUFFER_SIZE)
+        self._reading_paused = False
+        self._display_scheduled = False
+        self._log_output = False
+        self._replayed = False
 
     def _cleanup(self):
         self.close()
@@ -43,6 +116,15 @@ class ConsoleConnection(vmmGObject):
         self.vm = None
         self.conn = None
 
+    def _update_stream_events(self):
+        events = (libvirt.VIR_STREAM_EVENT_ERROR |
+                  libvirt.VIR_STREAM_EVENT_HANGUP)
+        if not self._reading_paused:
+            events |= libvirt.VIR_STREAM_EVENT_READABLE
+        if self.terminalToStream:
+            events |= libvirt.VIR_STREAM_EVENT_WRITABLE
+        self.stream.eventUpdateCallback(events)
+
     def _event_on_stream(self, stream, events, opaque):
         ignore = stream
         terminal = opaque
@@ -53,9 +135,11 @@ class ConsoleConnection(vmmGObject):
             self.close()
             return
 
-        if events & libvirt.VIR_EVENT_HANDLE_READABLE:
+        if (events & libvirt.VIR_EVENT_HANDLE_READABLE and
+            not self._reading_paused):
             try:
-                got = self.stream.recv(1024 * 100)
+                got = self.stream.recv(min(self.STREAM_CHUNK_SIZE,
+                                           self.streamToTerminal.free()))
             except Exception:
                 logging.exception("Error receiving stream data")
                 self.close()
@@ -69,16 +153,22 @@ class ConsoleConnection(vmmGObject):
                 self.close()
                 return
 
-            queued_text = bool(self.streamToTerminal)
-            self.streamToTerminal += got
-            if not queued_text:
+            self.streamToTerminal.write(got)
+            if self._log_output:
+                vmmConsoleLogger.get_instance().append(self.vm, got)
+            if not self.streamToTerminal.free():
+                # Stop reading until the terminal catches up
+                self._reading_paused = True
+            if not self._display_scheduled:
+                self._display_scheduled = True
                 self.idle_add(self.display_data, terminal)
 
         if (events & libvirt.VIR_EVENT_HANDLE_WRITABLE and
             self.terminalToStream):
 
             try:
-                done = self.stream.send(self.terminalToStream.encode())
+                chunk = self.terminalToStream.peek(self.STREAM_CHUNK_SIZE)
+                done = self.stream.send(bytes(chunk))
             except Exception:
                 logging.exception("Error sending stream data")
                 self.close()
@@ -88,12 +178,9 @@ class ConsoleConnection(vmmGObject):
                 # This is basically EAGAIN
                 return
 
-            self.terminalToStream = self.terminalToStream[done:]
+            self.terminalToStream.consume(done)
 
-        if not self.terminalToStream:
-            self.stream.eventUpdateCallback(libvirt.VIR_STREAM_EVENT_READABLE |
-                                            libvirt.VIR_STREAM_EVENT_ERROR |
-                                            libvirt.VIR_STREAM_EVENT_HANGUP)
+        self._update_stream_events()
 
 
     def is_open(self):
@@ -110,9 +197,25 @@ class ConsoleConnection(vmmGObject):
         # opening the first console device, so don't force prescence of
         # an alias
 
-        stream = self.conn.get_backend().newStream(libvirt.VIR_STREAM_NONBLOCK)
-        self.vm.open_console(name, stream)
+        # If the background console logger has this device open, it
+        # hands the stream over to us, and we pass it our output
+        logger = vmmConsoleLogger.get_instance()
+        if not self._replayed:
+            self._replayed = True
+            replay = logger.get_replay_data(self.vm, name)
+            if replay:
+                terminal.feed(replay)
+        self._log_output = logger.take_console(self.vm, name)
+
+        try:
+            stream = self.conn.get_backend().newStream(
+                    libvirt.VIR_STREAM_NONBLOCK)
+            self.vm.open_console(name, stream)
+        except Exception:
+            self._release_log()
+            raise
         self.stream = stream
+        self._reading_paused = False
 
         self.stream.eventAddCallback((libvirt.VIR_STREAM_EVENT_READABLE |
                                       libvirt.VIR_STREAM_EVENT_ERROR |
@@ -132,6 +235,15 @@ class ConsoleConnection(vmmGObject):
                 logging.exception("Error finishing stream")
 
         self.stream = None
+        self.terminalToStream.clear()
+        self._reading_paused = False
+        self._release_log()
+
+    def _release_log(self):
+        if not self._log_output:
+            return
+        self._log_output = False
+        vmmConsoleLogger.get_instance().release_console(self.vm)
 
     def send_data(self, src, text, length, terminal):
         """
@@ -144,19 +256,34 @@ class ConsoleConnection(vmmGObject):
         if self.stream is None:
             return
 
-        self.terminalToStream += text
+        data = text.encode()
+        written = self.terminalToStream.write(data)
+        if written < len(data):
+            logging.debug("Console input buffer full, dropped %d bytes",
+                          len(data) - written)
         if self.terminalToStream:
-            self.stream.eventUpdateCallback(libvirt.VIR_STREAM_EVENT_READABLE |
-                                            libvirt.VIR_STREAM_EVENT_WRITABLE |
-                                            libvirt.VIR_STREAM_EVENT_ERROR |
-                                            libvirt.VIR_STREAM_EVENT_HANGUP)
+            self._update_stream_events()
 
     def display_data(self, terminal):
-        if not self.streamToTerminal:
-            return
+        """
+        Feed buffered stream output to the terminal, at most
+        FEED_CHUNK_SIZE per call. Returns True to be rescheduled
+        while there is data left.
+        """
+        chunk = self.streamToTerminal.peek(self.FEED_CHUNK_SIZE)
+        if chunk:
+            terminal.feed(bytes(chunk))
+            self.streamToTerminal.consume(len(chunk))
 
-        terminal.feed(self.streamToTerminal)
-        self.streamToTerminal = b""
+        if (self._reading_paused and self.stream and
+            self.streamToTerminal.free() >= self.STREAM_CHUNK_SIZE):
+            self._reading_paused = False
+            self._update_stream_events()
+
+        if self.streamToTerminal:
+            return True
+        self._display_scheduled = False
+        return False
 
 
 class vmmSerialConsole(vmmGObject):
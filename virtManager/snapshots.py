@@ -4,11 +4,14 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import collections
 import datetime
-import glob
-import io
+import hashlib
+import json
 import logging
 import os
+import threading
+import time
 
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
@@ -23,6 +26,9 @@ from .baseclass import vmmGObjectUI
 from .asyncjob import vmmAsyncJob
 
 
+# Longest side of the screenshot thumbnails we show and save
+_SCREENSHOT_SIZE = 450
+
 mimemap = {
     "image/x-portable-pixmap": "ppm",
     "image/png": "png",
@@ -40,6 +46,152 @@ def _mime_to_ext(val, reverse=False):
                   reverse and "mime" or "extension")
 
 
+class _ScreenshotStore(object):
+    """
+    Screenshots saved alongside snapshots of a single VM.
+
+    Only the thumbnail we display is written to disk, as a PNG next to
+    an index file mapping snapshot names to files, so lookups don't need
+    to glob the cache dir. Once the thumbnails take up more than
+    MAX_DISK_SIZE, the oldest are removed. Recently shown thumbnails are
+    kept decoded in memory.
+    """
+    INDEX_NAME = "snap-screenshots.json"
+    MAX_DISK_SIZE = 20 * 1024 * 1024
+    MAX_CACHED_PIXBUFS = 16
+
+    def __init__(self, cachedir):
+        self._dir = cachedir
+        self._lock = threading.Lock()
+        # snapshot name -> {"file": basename, "size": bytes,
+        #                   "created": timestamp}
+        self._index = {}
+        self._pixbufs = collections.OrderedDict()
+        self._load_index()
+
+    def _indexpath(self):
+        return os.path.join(self._dir, self.INDEX_NAME)
+
+    def _filename(self, name):
+        # Snapshot names can contain anything, so don't use them as is
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return "snap-thumb-%s.png" % digest[:16]
+
+    def _load_index(self):
+        try:
+            with open(self._indexpath()) as f:
+                self._index = json.load(f).get("entries", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug("Error reading screenshot index: %s", e)
+
+    def _write_index(self):
+        tmppath = self._indexpath() + ".tmp"
+        with open(tmppath, "w") as f:
+            json.dump({"entries": self._index}, f)
+        os.replace(tmppath, self._indexpath())
+
+    def _remove_entry(self, name):
+        entry = self._index.pop(name, None)
+        self._pixbufs.pop(name, None)
+        if not entry:
+            return
+        try:
+            os.unlink(os.path.join(self._dir, entry["file"]))
+        except OSError as e:
+            logging.debug("Error removing screenshot: %s", e)
+
+    def _evict(self):
+        total = sum(e["size"] for e in self._index.values())
+        byage = sorted(self._index.items(), key=lambda i: i[1]["created"])
+        for name, entry in byage:
+            if total <= self.MAX_DISK_SIZE:
+                break
+            logging.debug("Evicting screenshot for snapshot %s", name)
+            total -= entry["size"]
+            self._remove_entry(name)
+
+    def _migrate_legacy_file(self, name):
+        # Older versions saved the full size screenshot as
+        # snap-screenshot-$NAME.$EXT
+        basename = os.path.join(self._dir, "snap-screenshot-%s" % name)
+        for ext in mimemap.values():
+            path = basename + "." + ext
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    pixbuf = uiutil.make_screenshot_pixbuf(
+                        _mime_to_ext(ext, reverse=True), f.read(),
+                        _SCREENSHOT_SIZE)
+                self.save(name, pixbuf)
+                os.unlink(path)
+                return True
+            except Exception:
+                logging.debug("Error converting old screenshot %s",
+                              path, exc_info=True)
+        return False
+
+    def save(self, name, pixbuf):
+        filename = self._filename(name)
+        path = os.path.join(self._dir, filename)
+        pixbuf.savev(path + ".tmp", "png", [], [])
+        os.replace(path + ".tmp", path)
+
+        with self._lock:
+            self._index[name] = {"file": filename,
+                                 "size": os.path.getsize(path),
+                                 "created": time.time()}
+            self._pixbufs.pop(name, None)
+            self._evict()
+            self._write_index()
+
+    def get_pixbuf(self, name):
+        with self._lock:
+            if name in self._pixbufs:
+                self._pixbufs.move_to_end(name)
+                return self._pixbufs[name]
+            entry = self._index.get(name)
+
+        if not entry:
+            if not self._migrate_legacy_file(name):
+                return None
+            entry = self._index.get(name)
+
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(
+                os.path.join(self._dir, entry["file"]))
+        except Exception as e:
+            logging.debug("Error loading screenshot for %s: %s", name, e)
+            return None
+
+        with self._lock:
+            self._pixbufs[name] = pixbuf
+            while len(self._pixbufs) > self.MAX_CACHED_PIXBUFS:
+                self._pixbufs.popitem(last=False)
+        return pixbuf
+
+    def remove(self, name):
+        with self._lock:
+            if name not in self._index:
+                return
+            self._remove_entry(name)
+            self._write_index()
+
+    def prune(self, names):
+        """
+        Drop screenshots for any snapshot not in the passed list
+        """
+        with self._lock:
+            stale = [n for n in self._index if n not in names]
+            if not stale:
+                return
+            for name in stale:
+                self._remove_entry(name)
+            self._write_index()
+
+
 class vmmSnapshotPage(vmmGObjectUI):
     def __init__(self, vm, builder, topwin):
         vmmGObjectUI.__init__(self, "snapshots.ui",
@@ -49,6 +201,11 @@ class vmmSnapshotPage(vmmGObjectUI):
 
         self._initial_populate = False
         self._unapplied_changes = False
+        self._populate_generation = 0
+        # Snapshots shown in the list, as handed over by the loader
+        # thread, so the main thread never has to fetch them itself
+        self._snapshots = []
+        self._screenshot_store = None
 
         self._snapmenu = None
         self._init_ui()
@@ -89,6 +246,7 @@ class vmmSnapshotPage(vmmGObjectUI):
 
     def _cleanup(self):
         self.vm = None
+        self._snapshots = []
 
         self._snapshot_new.destroy()
         self._snapshot_new = None
@@ -170,21 +328,23 @@ class vmmSnapshotPage(vmmGObjectUI):
     # Functional bits #
     ###################
 
-    def _get_selected_snapshots(self):
+    def _get_selected_names(self):
         selection = self.widget("snapshot-list").get_selection()
-        def add_snap(treemodel, path, it, snaps):
+        def add_name(treemodel, path, it, names):
             ignore = path
-            try:
-                name = treemodel[it][0]
-                for snap in self.vm.list_snapshots():
-                    if name == snap.get_name():
-                        snaps.append(snap)
-            except Exception:
-                pass
+            names.append(treemodel[it][0])
 
-        snaps = []
-        selection.selected_foreach(add_snap, snaps)
-        return snaps
+        names = []
+        selection.selected_foreach(add_name, names)
+        return names
+
+    def _get_selected_snapshots(self):
+        names = self._get_selected_names()
+        if not names:
+            return []
+
+        snapmap = dict((snap.get_name(), snap) for snap in self._snapshots)
+        return [snapmap[name] for name in names if name in snapmap]
 
     def _refresh_snapshots(self, select_name=None):
         self.vm.refresh_snapshots()
@@ -200,25 +360,56 @@ class vmmSnapshotPage(vmmGObjectUI):
         self.widget("snapshot-error-label").set_text(msg)
 
     def _populate_snapshot_list(self, select_name=None):
-        cursnaps = []
-        for i in self._get_selected_snapshots():
-            cursnaps.append(i.get_name())
+        """
+        Fetch the snapshot list in a thread, since it means a round trip
+        to libvirt per snapshot, and fill in the UI once it's done
+        """
+        cursnaps = self._get_selected_names()
 
         model = self.widget("snapshot-list").get_model()
         model.clear()
+        self._snapshots = []
+        self._set_error_page(_("Loading snapshot list..."))
 
+        self._initial_populate = True
+        self._populate_generation += 1
+        self._start_thread(self._load_snapshot_list_thread,
+                "Snapshot list %s" % self.vm.get_name(),
+                args=(self.vm, self._populate_generation,
+                      select_name, cursnaps))
+
+    def _load_snapshot_list_thread(self, vm, generation,
+                                   select_name, cursnaps):
+        snapshots = None
+        error = None
         try:
-            snapshots = self.vm.list_snapshots()
+            snapshots = vm.list_snapshots()
         except Exception as e:
-            logging.exception(e)
+            logging.debug("Error listing snapshots", exc_info=True)
+            error = e
+        self.idle_add(self._fill_snapshot_list, generation,
+                      snapshots, error, select_name, cursnaps)
+
+    def _fill_snapshot_list(self, generation, snapshots, error,
+                            select_name, cursnaps):
+        if not self.vm or generation != self._populate_generation:
+            # Page was closed, or another refresh was started
+            return
+
+        if error:
             self._set_error_page(_("Error refreshing snapshot list: %s") %
-                                str(e))
+                                str(error))
             return
 
+        model = self.widget("snapshot-list").get_model()
+        model.clear()
+        self._snapshots = snapshots
+        self._set_error_page(_("No snapshot selected."))
+
         has_external = False
         has_internal = False
         for snap in snapshots:
-            desc = snap.get_xmlobj().description
+            desc = snap.get_summary().description
             name = snap.get_name()
             state = snap.run_status()
             if snap.is_external():
@@ -239,6 +430,13 @@ class vmmSnapshotPage(vmmGObjectUI):
         if has_internal and has_external:
             model.append([None, None, None, None, "2", False])
 
+        # Drop screenshots of deleted snapshots
+        try:
+            self._get_screenshot_store().prune(
+                [snap.get_name() for snap in snapshots])
+        except Exception:
+            logging.debug("Error pruning screenshots", exc_info=True)
+
 
         def check_selection(treemodel, path, it, snaps):
             if select_name:
@@ -252,46 +450,15 @@ class vmmSnapshotPage(vmmGObjectUI):
         selection.unselect_all()
         model.foreach(check_selection, cursnaps)
 
-        self._initial_populate = True
-
-    def _make_screenshot_pixbuf(self, mime, sdata):
-        loader = GdkPixbuf.PixbufLoader.new_with_mime_type(mime)
-        loader.write(sdata)
-        pixbuf = loader.get_pixbuf()
-        loader.close()
-
-        maxsize = 450
-        def _scale(big, small, maxsize):
-            if big <= maxsize:
-                return big, small
-            factor = float(maxsize) / float(big)
-            return maxsize, int(factor * float(small))
-
-        width = pixbuf.get_width()
-        height = pixbuf.get_height()
-        if width > height:
-            width, height = _scale(width, height, maxsize)
-        else:
-            height, width = _scale(height, width, maxsize)
-
-        return pixbuf.scale_simple(width, height,
-                                   GdkPixbuf.InterpType.BILINEAR)
+    def _get_screenshot_store(self):
+        if not self._screenshot_store:
+            self._screenshot_store = _ScreenshotStore(self.vm.get_cache_dir())
+        return self._screenshot_store
 
     def _read_screenshot_file(self, name):
         if not name:
             return
-
-        cache_dir = self.vm.get_cache_dir()
-        basename = os.path.join(cache_dir, "snap-screenshot-%s" % name)
-        files = glob.glob(basename + ".*")
-        if not files:
-            return
-
-        filename = files[0]
-        mime = _mime_to_ext(os.path.splitext(filename)[1][1:], reverse=True)
-        if not mime:
-            return
-        return self._make_screenshot_pixbuf(mime, open(filename, "rb").read())
+        return self._get_screenshot_store().get_pixbuf(name)
 
     def _set_snapshot_state(self, snap=None):
         self.widget("snapshot-notebook").set_current_page(0)
@@ -373,29 +540,6 @@ class vmmSnapshotPage(vmmGObjectUI):
     # 'New' handling #
     ##################
 
-    def _take_screenshot(self):
-        stream = None
-        try:
-            stream = self.vm.conn.get_backend().newStream(0)
-            screen = 0
-            flags = 0
-            mime = self.vm.get_backend().screenshot(stream, screen, flags)
-
-            ret = io.BytesIO()
-            def _write_cb(_stream, data, userdata):
-                ignore = stream
-                ignore = userdata
-                ret.write(data)
-
-            stream.recvAll(_write_cb, None)
-            return mime, ret.getvalue()
-        finally:
-            try:
-                if stream:
-                    stream.finish()
-            except Exception:
-                pass
-
     def _get_screenshot(self):
         if not self.vm.is_active():
             logging.debug("Skipping screenshot since VM is not active")
@@ -405,12 +549,7 @@ class vmmSnapshotPage(vmmGObjectUI):
             return
 
         try:
-            # Perform two screenshots, because qemu + qxl has a bug where
-            # screenshot generally only shows the data from the previous
-            # screenshot request:
-            # https://bugs.launchpad.net/qemu/+bug/1314293
-            self._take_screenshot()
-            mime, sdata = self._take_screenshot()
+            mime, sdata = self.vm.take_screenshot()
         except Exception:
             logging.exception("Error taking screenshot")
             return
@@ -419,13 +558,12 @@ class vmmSnapshotPage(vmmGObjectUI):
         if not ext:
             return
 
-        newpix = self._make_screenshot_pixbuf(mime, sdata)
-        setattr(newpix, "vmm_mimetype", mime)
-        setattr(newpix, "vmm_sndata", sdata)
-        return newpix
+        return uiutil.make_screenshot_pixbuf(mime, sdata, _SCREENSHOT_SIZE)
 
     def _reset_new_state(self):
-        collidelist = [s.get_xmlobj().name for s in self.vm.list_snapshots()]
+        # find_free_name checks libvirt too, so snapshots that are
+        # still loading can't collide
+        collidelist = [s.get_name() for s in self._snapshots]
         default_name = DomainSnapshot.find_free_name(
             self.vm.get_backend(), collidelist)
 
@@ -471,40 +609,25 @@ class vmmSnapshotPage(vmmGObjectUI):
         except Exception as e:
             return self.err.val_err(_("Error validating snapshot: %s") % e)
 
-    def _get_screenshot_data_for_save(self):
+    def _get_screenshot_for_save(self):
         snwidget = self.widget("snapshot-new-screenshot")
         if not snwidget.is_visible():
-            return None, None
-
-        sn = snwidget.get_pixbuf()
-        if not sn:
-            return None, None
-
-        mime = getattr(sn, "vmm_mimetype", None)
-        sndata = getattr(sn, "vmm_sndata", None)
-        return mime, sndata
+            return None
+        return snwidget.get_pixbuf()
 
-    def _do_create_snapshot(self, asyncjob, xml, name, mime, sndata):
+    def _do_create_snapshot(self, asyncjob, xml, name, pixbuf, store):
         ignore = asyncjob
 
         self.vm.create_snapshot(xml)
 
         try:
-            cachedir = self.vm.get_cache_dir()
-            basesn = os.path.join(cachedir, "snap-screenshot-%s" % name)
-
-            # Remove any pre-existing screenshots so we don't show stale data
-            for ext in list(mimemap.values()):
-                p = basesn + "." + ext
-                if os.path.exists(basesn + "." + ext):
-                    os.unlink(p)
-
-            if not mime or not sndata:
+            # Remove any pre-existing screenshot so we don't show stale data
+            store.remove(name)
+            if not pixbuf:
                 return
 
-            filename = basesn + "." + _mime_to_ext(mime)
-            logging.debug("Writing screenshot to %s", filename)
-            open(filename, "wb").write(sndata)
+            logging.debug("Saving screenshot for snapshot %s", name)
+            store.save(name, pixbuf)
         except Exception:
             logging.exception("Error saving screenshot")
 
@@ -515,12 +638,13 @@ class vmmSnapshotPage(vmmGObjectUI):
 
         xml = snap.get_xml()
         name = snap.name
-        mime, sndata = self._get_screenshot_data_for_save()
+        pixbuf = self._get_screenshot_for_save()
         self._snapshot_new_close()
 
         self.set_finish_cursor()
         progWin = vmmAsyncJob(
-                    self._do_create_snapshot, [xml, name, mime, sndata],
+                    self._do_create_snapshot,
+                    [xml, name, pixbuf, self._get_screenshot_store()],
                     self._new_finish_cb, [name],
                     _("Creating snapshot"),
                     _("Creating virtual machine snapshot"),
@@ -3,17 +3,20 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import atexit
 import functools
+import hashlib
 import logging
 import os
 import queue
+import shutil
 import socket
 import signal
+import subprocess
+import tempfile
 import threading
 import ipaddress
 
-from .baseclass import vmmGObject
-
 
 class ConnectionInfo(object):
     """
@@ -108,6 +111,9 @@ class _TunnelScheduler(object):
 
     It's only instantiated once for the whole app, because we serialize
     independent of connection, vm, etc.
+
+    The ssh process is forked from the scheduler thread too, so neither
+    the wait for the lock nor the fork stall the main loop.
     """
     def __init__(self):
         self._thread = None
@@ -118,7 +124,10 @@ class _TunnelScheduler(object):
         while True:
             lock_cb, cb, args, = self._queue.get()
             lock_cb()
-            vmmGObject.idle_add(cb, *args)
+            try:
+                cb(*args)
+            except Exception:
+                logging.debug("Error opening tunnel", exc_info=True)
 
     def schedule(self, lock_cb, cb, *args):
         if not self._thread:
@@ -139,13 +148,79 @@ class _TunnelScheduler(object):
 _tunnel_scheduler = _TunnelScheduler()
 
 
+class _ControlMasters(object):
+    """
+    Hands out one SSH ControlMaster socket path per (host, user, port).
+    The first tunnel to a host authenticates and becomes the master,
+    every later tunnel to that host, from any console window, only opens
+    a new channel over the existing connection. SPICE opens a channel
+    per main/display/inputs/cursor/usbredir/..., so this saves a full
+    SSH handshake for each of those.
+
+    Masters exit by themselves after CONTROL_PERSIST idle seconds, and
+    we ask any that are still around to exit when the app quits.
+    """
+    CONTROL_PERSIST = 120
+
+    def __init__(self):
+        self._dir = None
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, host, user, port):
+        key = (host, user, port)
+        with self._lock:
+            if key not in self._paths:
+                if not self._dir:
+                    self._dir = tempfile.mkdtemp(prefix="virt-manager-ssh-")
+                # UNIX socket paths are length limited, so keep it short
+                name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+                self._paths[key] = os.path.join(self._dir, name[:16])
+            return self._paths[key]
+
+    def is_running(self, path):
+        return bool(path) and os.path.exists(path)
+
+    def close_all(self):
+        with self._lock:
+            paths = list(self._paths.items())
+            self._paths = {}
+            tmpdir = self._dir
+            self._dir = None
+
+        for key, path in paths:
+            if not self.is_running(path):
+                continue
+            argv = ["ssh", "-o", "ControlPath=%s" % path, "-O", "exit",
+                    key[0]]
+            try:
+                subprocess.call(argv, timeout=5,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+            except Exception:
+                logging.debug("Error stopping ssh master %s", path,
+                              exc_info=True)
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+_control_masters = _ControlMasters()
+atexit.register(_control_masters.close_all)
+
+
 class _Tunnel(object):
     def __init__(self):
         self._pid = None
         self._closed = False
         self._errfd = None
+        # open() runs in the scheduler thread, close() in the main thread
+        self._lock = threading.Lock()
 
     def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
         if self._closed:
             return
         self._closed = True
@@ -178,7 +253,12 @@ class _Tunnel(object):
         return errout
 
     def open(self, argv, sshfd):
+        with self._lock:
+            self._open(argv, sshfd)
+
+    def _open(self, argv, sshfd):
         if self._closed:
+            sshfd.close()
             return
 
         errfds = socket.socketpair()
@@ -203,7 +283,14 @@ class _Tunnel(object):
         self._pid = pid
 
 
-def _make_ssh_command(ginfo):
+def _get_control_path(ginfo):
+    if not ginfo.need_tunnel():
+        return None
+    host, port = ginfo.get_tunnel_host()
+    return _control_masters.get_path(host, ginfo.connuser, port)
+
+
+def _make_ssh_command(ginfo, controlpath):
     if not ginfo.need_tunnel():
         return None
 
@@ -217,6 +304,11 @@ def _make_ssh_command(ginfo):
     if ginfo.connuser:
         argv += ['-l', ginfo.connuser]
 
+    # Share one authenticated connection per host between all tunnels
+    argv += ["-o", "ControlMaster=auto",
+             "-o", "ControlPath=%s" % controlpath,
+             "-o", "ControlPersist=%d" % _control_masters.CONTROL_PERSIST]
+
     argv += [host]
 
     # Build 'nc' command run on the remote host
@@ -256,7 +348,8 @@ def _make_ssh_command(ginfo):
 class SSHTunnels(object):
     def __init__(self, ginfo):
         self._tunnels = []
-        self._sshcommand = _make_ssh_command(ginfo)
+        self._controlpath = _get_control_path(ginfo)
+        self._sshcommand = _make_ssh_command(ginfo, self._controlpath)
         self._locked = False
 
     def open_new(self):
@@ -277,21 +370,30 @@ class SSHTunnels(object):
         return retfd
 
     def close_all(self):
-        for l in self._tunnels:
-            l.close()
+        tunnels = self._tunnels
         self._tunnels = []
+        for l in tunnels:
+            l.close()
         self.unlock()
 
     def get_err_output(self):
         errstrings = []
-        for l in self._tunnels:
+        for l in self._tunnels[:]:
             e = l.get_err_output().strip()
             if e and e not in errstrings:
                 errstrings.append(e)
         return "\n".join(errstrings)
 
     def _lock(self):
+        if _control_masters.is_running(self._controlpath):
+            # We are only opening a channel over an already authenticated
+            # master, there's no password prompt to serialize
+            return
         _tunnel_scheduler.lock()
+        if _control_masters.is_running(self._controlpath):
+            # Another tunnel brought the master up while we waited
+            _tunnel_scheduler.unlock()
+            return
         self._locked = True
 
     def unlock(self, *args, **kwargs):
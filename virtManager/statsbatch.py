@@ -0,0 +1,86 @@
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import concurrent.futures
+import logging
+
+
+class StatsBatcher(object):
+    """
+    Runs a per VM stats fetch function concurrently on a bounded thread
+    pool. On remote connections each of the old style stats calls is a
+    full round trip, so doing them serially can stall the tick.
+
+    VMs whose stats don't come back within the timeout are recorded in
+    skipped and are not sampled this tick. Their requests are left
+    running, and no new request is issued for them until the old one
+    completes.
+
+    This doesn't touch GTK, so it can be tested on its own.
+    """
+    def __init__(self, workers, thread_name_prefix):
+        self._workers = workers
+        self._thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._pending = {}
+        self.skipped = set()
+
+    def cleanup(self):
+        self._pending = {}
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def get_pending(self, uuid):
+        return self._pending.get(uuid)
+
+    def run(self, vms, fetchfunc, timeout):
+        """
+        Call fetchfunc(vm) for every VM in vms
+
+        :returns: dict of VM uuid -> fetchfunc result, for every VM that
+            wasn't skipped
+        """
+        self.skipped = set()
+        if not vms:
+            return {}
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._workers,
+                thread_name_prefix=self._thread_name_prefix)
+
+        futures = {}
+        stillpending = {}
+        for vm in vms:
+            uuid = vm.get_uuid()
+            pending = self._pending.get(uuid)
+            if pending and not pending.done():
+                # Keep tracking the old request, so we don't issue
+                # another one until it completes
+                stillpending[uuid] = pending
+                self.skipped.add(uuid)
+                continue
+            futures[uuid] = self._executor.submit(fetchfunc, vm)
+        self._pending = futures.copy()
+        self._pending.update(stillpending)
+
+        concurrent.futures.wait(list(futures.values()), timeout=timeout)
+
+        ret = {}
+        for uuid, future in futures.items():
+            if not future.done():
+                logging.debug("Stats for VM uuid=%s timed out, "
+                    "skipping this tick", uuid)
+                self.skipped.add(uuid)
+                continue
+            try:
+                ret[uuid] = future.result()
+            except Exception as e:
+                logging.debug("Error fetching stats for VM uuid=%s: %s",
+                    uuid, e)
+                self.skipped.add(uuid)
+
+        return ret
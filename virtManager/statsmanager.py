@@ -12,6 +12,7 @@ import libvirt
 from virtinst import util
 
 from .baseclass import vmmGObject
+from .statsbatch import StatsBatcher
 
 
 class _VMStatsRecord(object):
@@ -131,9 +132,14 @@ class vmmStatsManager(vmmGObject):
         self._disk_stats_lxc_supported = True
         self._mem_stats_supported = True
 
+        self._batcher = None
+
 
     def _cleanup(self):
         self._latest_all_stats = None
+        if self._batcher:
+            self._batcher.cleanup()
+            self._batcher = None
 
 
     ######################
@@ -237,6 +243,12 @@ class vmmStatsManager(vmmGObject):
                     tx += allstats[key]
             return rx, tx
 
+        return self._old_net_stats_all(vm)
+
+    def _old_net_stats_all(self, vm):
+        rx = 0
+        tx = 0
+        statslist = self.get_vm_statslist(vm)
         for iface in vm.get_interface_devices_norefresh():
             dev = iface.target_dev
             if not dev:
@@ -297,6 +309,13 @@ class vmmStatsManager(vmmGObject):
                     wr += allstats[key]
             return rd, wr
 
+        return self._old_disk_stats_all(vm)
+
+    def _old_disk_stats_all(self, vm):
+        rd = 0
+        wr = 0
+        statslist = self.get_vm_statslist(vm)
+
         # LXC has a special blockStats method
         if vm.conn.is_lxc() and self._disk_stats_lxc_supported:
             try:
@@ -387,6 +406,76 @@ class vmmStatsManager(vmmGObject):
         return currMemPercent, curmem
 
 
+    ##########################
+    # batched stats handling #
+    ##########################
+
+    # Max number of VMs we query in parallel with the old style APIs
+    _BATCH_WORKERS = 8
+
+    def _old_stats_for_vm(self, vm):
+        """
+        Fetch stats for a single VM with the old per-VM and per-device
+        APIs, and return them in the same format that getAllDomainStats
+        uses. Run from the batch thread pool.
+        """
+        ret = {"virt-manager.timestamp": time.time()}
+
+        if self.config.get_stats_enable_cpu_poll():
+            state, guestcpus, cpuTimeAbs = self._old_cpu_stats_helper(vm)
+            ret["state.state"] = state
+            ret["vcpu.current"] = guestcpus
+            ret["cpu.time"] = cpuTimeAbs
+
+        if (self._mem_stats_supported and
+            self.config.get_stats_enable_memory_poll()):
+            totalmem, curmem = self._old_mem_stats_helper(vm)
+            ret["balloon.current"] = totalmem
+            ret["balloon.unused"] = totalmem - curmem
+
+        if (self._disk_stats_supported and
+            self.config.get_stats_enable_disk_poll()):
+            rd, wr = self._old_disk_stats_all(vm)
+            ret["block.0.rd.bytes"] = rd
+            ret["block.0.wr.bytes"] = wr
+
+        if (self._net_stats_supported and
+            self.config.get_stats_enable_net_poll()):
+            rx, tx = self._old_net_stats_all(vm)
+            ret["net.0.rx.bytes"] = rx
+            ret["net.0.tx.bytes"] = tx
+
+        return ret
+
+    def _get_batched_stats(self, conn, allstats):
+        """
+        For every running VM that getAllDomainStats didn't give us data
+        for, run the old style stats APIs concurrently with a
+        StatsBatcher. VMs whose stats don't come back within half the
+        poll interval are skipped this tick.
+
+        :returns: allstats, extended with the batched results
+        """
+        if self._batcher is None:
+            self._batcher = StatsBatcher(self._BATCH_WORKERS,
+                "Stats batch %s" % conn.get_uri())
+
+        if not (self.config.get_stats_enable_cpu_poll() or
+                self.config.get_stats_enable_memory_poll() or
+                self.config.get_stats_enable_disk_poll() or
+                self.config.get_stats_enable_net_poll()):
+            self._batcher.skipped = set()
+            return allstats
+
+        vms = [vm for vm in conn.list_vms() if
+               vm.is_active() and vm.get_uuid() not in allstats]
+        timeout = max(1, conn.get_poll_interval() / 2.0)
+
+        ret = allstats.copy()
+        ret.update(self._batcher.run(vms, self._old_stats_for_vm, timeout))
+        return ret
+
+
     ####################
     # alltats handling #
     ####################
@@ -432,6 +521,8 @@ class vmmStatsManager(vmmGObject):
     ##############
 
     def refresh_vm_stats(self, vm):
+        if self._batcher and vm.get_uuid() in self._batcher.skipped:
+            return
         domallstats = self._latest_all_stats.get(vm.get_uuid(), None)
 
         (cpuTime, cpuTimeAbs, cpuHostPercent, cpuGuestPercent, timestamp) = \
@@ -449,7 +540,8 @@ class vmmStatsManager(vmmGObject):
         self.get_vm_statslist(vm).append_stats(newstats)
 
     def cache_all_stats(self, conn):
-        self._latest_all_stats = self._get_all_stats(conn)
+        self._latest_all_stats = self._get_batched_stats(conn,
+                self._get_all_stats(conn))
 
     def get_vm_statslist(self, vm):
         if vm.get_connkey() not in self._vm_stats:
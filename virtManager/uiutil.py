@@ -4,6 +4,7 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+from gi.repository import GdkPixbuf
 from gi.repository import GObject
 from gi.repository import Gtk
 
@@ -167,3 +168,31 @@ def init_combo_text_column(combo, col):
         combo.add_attribute(text, 'text', col)
         return text
     return None
+
+
+def make_screenshot_pixbuf(mime, sdata, maxsize):
+    """
+    Decode screenshot data and scale it down so its longest side is
+    at most maxsize. Doesn't touch any widgets, so it's safe to call
+    from a thread.
+    """
+    loader = GdkPixbuf.PixbufLoader.new_with_mime_type(mime)
+    loader.write(sdata)
+    pixbuf = loader.get_pixbuf()
+    loader.close()
+
+    def _scale(big, small, maxsize):
+        if big <= maxsize:
+            return big, small
+        factor = float(maxsize) / float(big)
+        return maxsize, int(factor * float(small))
+
+    width = pixbuf.get_width()
+    height = pixbuf.get_height()
+    if width > height:
+        width, height = _scale(width, height, maxsize)
+    else:
+        height, width = _scale(height, width, maxsize)
+
+    return pixbuf.scale_simple(width, height,
+                               GdkPixbuf.InterpType.BILINEAR)
@@ -6,6 +6,7 @@
 # See the COPYING file in the top-level directory.
 
 import logging
+import os
 import socket
 
 from gi.repository import Gdk
@@ -33,6 +34,12 @@ from .sshtunnels import SSHTunnels
 class Viewer(vmmGObject):
     """
     Base class for viewer abstraction
+
+    Opening is asynchronous: the fd lookup (open_graphics_fd, the unix
+    socket connect, SSH tunnel creation) runs in a worker thread, and
+    the result is handed to spice/gtk-vnc from the main loop, which do
+    their protocol negotiation asynchronously themselves. close()
+    cancels any lookup still in flight.
     """
     __gsignals__ = {
         "add-display-widget": (vmmGObject.RUN_FIRST, None, [object]),
@@ -57,6 +64,10 @@ class Viewer(vmmGObject):
         self._ginfo = ginfo
         self._tunnels = SSHTunnels(self._ginfo)
 
+        # Bumped on every close(), so fd lookups that were started
+        # before it know that their result is unwanted
+        self._open_generation = 0
+
         self.add_gsettings_handle(
             self.config.on_keys_combination_changed(self._refresh_grab_keys))
         self.add_gsettings_handle(
@@ -122,7 +133,46 @@ class Viewer(vmmGObject):
     def _get_pixbuf(self):
         return self._display.get_pixbuf()
 
+    def _cancel_open(self):
+        """
+        Drop the result of any in flight fd lookup
+        """
+        self._open_generation += 1
+
+    def _fetch_fd_thread(self, generation, cb, args):
+        fd = None
+        err = None
+        try:
+            fd = self._get_fd_for_open()
+        except Exception as e:
+            logging.debug("Error fetching viewer fd", exc_info=True)
+            err = e
+        self.idle_add(self._fetch_fd_finish, generation, fd, err, cb, args)
+
+    def _fetch_fd_finish(self, generation, fd, err, cb, args):
+        if generation != self._open_generation or self._vm is None:
+            logging.debug("Viewer was closed while fetching fd=%s, "
+                          "dropping it", fd)
+            if fd is not None:
+                os.close(fd)
+            return
+        cb(fd, err, *args)
+
+    def _fetch_fd_async(self, cb, *args):
+        """
+        Run _get_fd_for_open in a thread, since it can involve libvirt
+        and socket round trips, then call cb(fd, err, *args) from the
+        main loop. cb is not called if the viewer was closed meanwhile.
+        """
+        self._start_thread(self._fetch_fd_thread,
+                "Viewer fd lookup %s" % self._vm.get_name(),
+                args=(self._open_generation, cb, args))
+
     def _get_fd_for_open(self):
+        """
+        Return a connected fd for the viewer, or None if it should
+        connect to the host itself. Called from a worker thread.
+        """
         if self._ginfo.need_tunnel():
             return self._tunnels.open_new()
 
@@ -145,11 +195,20 @@ class Viewer(vmmGObject):
         if self._ginfo.bad_config():
             raise RuntimeError(self._ginfo.bad_config())
 
-        fd = self._get_fd_for_open()
-        if fd is not None:
-            self._open_fd(fd)
-        else:
-            self._open_host()
+        self._fetch_fd_async(self._open_fd_ready)
+
+    def _open_fd_ready(self, fd, err):
+        try:
+            if err:
+                raise err
+            if fd is not None:
+                self._open_fd(fd)
+            else:
+                self._open_host()
+        except Exception as e:
+            logging.debug("Error opening viewer", exc_info=True)
+            self._emit_disconnected(
+                _("Error connecting to graphical console") + ":\n%s" % e)
 
     def _get_grab_keys(self):
         return self._display.get_grab_keys().as_string()
@@ -285,7 +344,6 @@ class VNCViewer(Viewer):
     def __init__(self, *args, **kwargs):
         Viewer.__init__(self, *args, **kwargs)
         self._display = None
-        self._sockfd = None
         self._desktop_resolution = None
 
 
@@ -371,10 +429,8 @@ class VNCViewer(Viewer):
     ###############################
 
     def close(self):
+        self._cancel_open()
         self._display.close()
-        if self._sockfd:
-            self._sockfd.close()
-            self._sockfd = None
 
     def _is_open(self):
         return self._display.is_open()
@@ -446,28 +502,29 @@ class VNCViewer(Viewer):
         self._init_widget()
         return Viewer._open(self)
 
-    def _open_host(self):
-        host, port, ignore = self._ginfo.get_conn_host()
-
-        if not self._ginfo.gsocket:
-            logging.debug("VNC connecting to host=%s port=%s", host, port)
-            self._display.open_host(host, port)
-            return
+    def _get_fd_for_open(self):
+        fd = Viewer._get_fd_for_open(self)
+        if fd is not None or not self._ginfo.gsocket:
+            return fd
 
         logging.debug("VNC connecting to socket=%s", self._ginfo.gsocket)
         try:
             sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             sock.connect(self._ginfo.gsocket)
-            self._sockfd = sock
         except Exception as e:
             raise RuntimeError(_("Error opening socket path '%s': %s") %
                                (self._ginfo.gsocket, e))
 
-        fd = self._sockfd.fileno()
-        if fd < 0:
-            raise RuntimeError((_("Error opening socket path '%s'") %
-                                self._ginfo.gsocket) + " fd=%s" % fd)
-        self._open_fd(fd)
+        # Same as the SSH tunnel fds: hand gtk-vnc a bare dup, so the
+        # socket object being garbage collected can't close it
+        fd = os.dup(sock.fileno())
+        sock.close()
+        return fd
+
+    def _open_host(self):
+        host, port, ignore = self._ginfo.get_conn_host()
+        logging.debug("VNC connecting to host=%s port=%s", host, port)
+        self._display.open_host(host, port)
 
     def _open_fd(self, fd):
         self._display.open_fd(fd)
@@ -592,8 +649,12 @@ class SpiceViewer(Viewer):
 
         logging.debug("Requesting fd for channel: %s", channel)
         channel.connect_after("channel-event", self._fd_channel_event_cb)
+        self._fetch_fd_async(self._channel_open_fd, channel)
 
-        fd = self._get_fd_for_open()
+    def _channel_open_fd(self, fd, err, channel):
+        if err:
+            self._emit_disconnected(str(err))
+            return
         channel.open_fd(fd)
 
     def _channel_new_cb(self, session, channel):
@@ -638,6 +699,7 @@ class SpiceViewer(Viewer):
     ################################
 
     def close(self):
+        self._cancel_open()
         if self._spice_session is not None:
             self._spice_session.disconnect()
         self._spice_session = None
@@ -717,8 +779,12 @@ class SpiceViewer(Viewer):
         ignore = cred
     def _set_password(self, cred):
         self._spice_session.set_property("password", cred)
-        fd = self._get_fd_for_open()
-        if fd is not None:
+        self._fetch_fd_async(self._reconnect_with_fd)
+
+    def _reconnect_with_fd(self, fd, err):
+        if err:
+            self._emit_disconnected(str(err))
+        elif fd is not None:
             self._spice_session.open_fd(fd)
         else:
             self._spice_session.connect()
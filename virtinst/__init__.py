@@ -3,10 +3,11 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
-from virtcli import CLIConfig as _CLIConfig
+import importlib
+import sys
 
+from virtcli import CLIConfig as _CLIConfig
 
-# pylint: disable=wrong-import-position
 
 def _setup_i18n():
     import gettext
@@ -23,25 +24,73 @@ def _setup_i18n():
 
 _setup_i18n()
 
-from virtinst import util
-from virtinst.uri import URI
-from virtinst.osdict import OSDB
 
-from virtinst.domain import *  # pylint: disable=wildcard-import
+# Map of public attribute name -> module that provides it. Nothing here
+# is imported until it's first accessed, so a plain 'import virtinst'
+# doesn't pay for loading every XMLBuilder class in the package.
+_LAZY_ATTRS = {
+    "util": None,
+    "URI": "virtinst.uri",
+    "OSDB": "virtinst.osdict",
+    "Capabilities": "virtinst.capabilities",
+    "DomainCapabilities": "virtinst.domcapabilities",
+    "Interface": "virtinst.interface",
+    "InterfaceProtocol": "virtinst.interface",
+    "Network": "virtinst.network",
+    "NodeDevice": "virtinst.nodedev",
+    "StoragePool": "virtinst.storage",
+    "StorageVolume": "virtinst.storage",
+    "Installer": "virtinst.installer",
+    "Guest": "virtinst.guest",
+    "Cloner": "virtinst.cloner",
+    "DomainSnapshot": "virtinst.snapshot",
+    "VirtinstConnection": "virtinst.connection",
+}
+
+# Names from the 'from virtinst.X import *' imports we used to do
+for _name in ["DomainBlkiotune", "DomainClock", "DomainCpu",
+        "DomainCputune", "DomainFeatures", "DomainIdmap", "DomainMetadata",
+        "DomainMemoryBacking", "DomainMemtune", "DomainNumatune",
+        "DomainOs", "DomainPm", "DomainResource", "DomainSeclabel",
+        "DomainSysinfo", "DomainXMLNSQemu"]:
+    _LAZY_ATTRS[_name] = "virtinst.domain"
+for _name in ["DeviceChannel", "DeviceConsole", "DeviceParallel",
+        "DeviceSerial", "DeviceController", "Device", "DeviceDisk",
+        "DeviceFilesystem", "DeviceGraphics", "DeviceHostdev",
+        "DeviceInput", "DeviceInterface", "DeviceMemballoon",
+        "DeviceMemory", "DevicePanic", "DeviceSmartcard", "DeviceSound",
+        "DeviceRedirdev", "DeviceRng", "DeviceTpm", "DeviceVideo",
+        "DeviceVsock", "DeviceWatchdog"]:
+    _LAZY_ATTRS[_name] = "virtinst.devices"
+del(_name)
+
+__all__ = sorted(_LAZY_ATTRS)
+
+
+def _load_attr(name):
+    modname = _LAZY_ATTRS[name]
+    if modname is None:
+        value = importlib.import_module("virtinst." + name)
+    else:
+        value = getattr(importlib.import_module(modname), name)
+    globals()[name] = value
+    return value
+
 
-from virtinst.capabilities import Capabilities
-from virtinst.domcapabilities import DomainCapabilities
-from virtinst.interface import Interface, InterfaceProtocol
-from virtinst.network import Network
-from virtinst.nodedev import NodeDevice
-from virtinst.storage import StoragePool, StorageVolume
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+    return _load_attr(name)
 
-from virtinst.devices import *  # pylint: disable=wildcard-import
 
-from virtinst.installer import Installer
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
 
-from virtinst.guest import Guest
-from virtinst.cloner import Cloner
-from virtinst.snapshot import DomainSnapshot
 
-from virtinst.connection import VirtinstConnection
+# Module __getattr__ is only supported from python 3.7 (PEP 562), so
+# fall back to importing everything up front on older versions
+if sys.version_info < (3, 7):
+    for _name in __all__:
+        _load_attr(_name)
+    del(_name)
@@ -215,6 +215,7 @@ class Capabilities(XMLBuilder):
         self._cpu_models_cache = {}
 
     XML_NAME = "capabilities"
+    _XML_READONLY_PARSE = True
 
     host = XMLChildProperty(_CapsHost, is_single=True)
     guests = XMLChildProperty(_CapsGuest)
@@ -0,0 +1,203 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import weakref
+
+from virtcli import CLIConfig
+
+from . import util
+
+# Bump this if the layout of the cache file changes
+_FORMAT_VERSION = 1
+
+_open_caches = weakref.WeakSet()
+
+
+def _save_open_caches():
+    for cache in list(_open_caches):
+        cache.save()
+
+atexit.register(_save_open_caches)
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return -1
+
+
+class CapsCache(object):
+    """
+    On disk cache of host capabilities XML, domain capabilities XML,
+    and connection level support check results. It is shared by
+    virt-install, virt-clone, virt-xml and virt-manager, so each run
+    doesn't need to repeat those round trips to the daemon.
+
+    There is one cache file per URI. The contents are only used if the
+    virtinst version, local libvirt version, libvirt daemon version and
+    hypervisor version all still match what they were when the file was
+    written. For local connections, the mtime of every emulator binary
+    we cached data for must match too.
+    """
+    def __init__(self, path, key, is_remote):
+        self._path = path
+        self._key = key
+        self._is_remote = is_remote
+
+        self._emulators = {}
+        self._caps = None
+        self._domcaps = {}
+        self._support = {}
+        self._dirty = False
+
+    @staticmethod
+    def get_cache_path(uri):
+        name = hashlib.sha256(uri.encode("utf-8")).hexdigest()
+        return os.path.join(util.get_cache_dir(), "capscache",
+                            name + ".json")
+
+    @staticmethod
+    def build_key(conn):
+        return {
+            "uri": conn.uri,
+            "virtinst_version": CLIConfig.version,
+            "local_version": conn.local_libvirt_version(),
+            "daemon_version": conn.daemon_version(),
+            "conn_version": conn.conn_version(),
+        }
+
+    @classmethod
+    def load(cls, conn):
+        """
+        Return a CapsCache for the passed open connection, filled in from
+        disk if the cache file is still valid
+        """
+        path = cls.get_cache_path(conn.uri)
+        cache = cls(path, cls.build_key(conn), bool(conn.is_remote()))
+        _open_caches.add(cache)
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cache
+        except Exception as e:
+            logging.debug("Error reading capabilities cache %s: %s", path, e)
+            return cache
+
+        if (data.get("format") != _FORMAT_VERSION or
+            data.get("key") != cache._key):
+            logging.debug("Capabilities cache %s is stale", path)
+            return cache
+
+        emulators = data.get("emulators", {})
+        for emulator, mtime in emulators.items():
+            if _get_mtime(emulator) != mtime:
+                logging.debug("Emulator %s changed, capabilities cache %s "
+                              "is stale", emulator, path)
+                return cache
+
+        cache._emulators = emulators
+        cache._caps = data.get("caps")
+        cache._domcaps = data.get("domcaps", {})
+        cache._support = data.get("support", {})
+        logging.debug("Using capabilities cache %s", path)
+        return cache
+
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _domcaps_key(self, emulator, arch, machine, hvtype):
+        return "|".join([str(emulator), str(arch), str(machine), str(hvtype)])
+
+    def _track_emulators(self, emulators):
+        if self._is_remote:
+            # We can't stat remote binaries, we rely on the hypervisor
+            # version for those
+            return
+        for emulator in emulators:
+            if emulator and emulator not in self._emulators:
+                self._emulators[emulator] = _get_mtime(emulator)
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def get_caps(self):
+        return self._caps
+
+    def set_caps(self, xml, emulators):
+        self._caps = xml
+        self._track_emulators(emulators)
+        self._dirty = True
+        self.save()
+
+    def get_domcaps(self, emulator, arch, machine, hvtype):
+        return self._domcaps.get(
+            self._domcaps_key(emulator, arch, machine, hvtype))
+
+    def set_domcaps(self, emulator, arch, machine, hvtype, xml):
+        key = self._domcaps_key(emulator, arch, machine, hvtype)
+        self._domcaps[key] = xml
+        self._track_emulators([emulator])
+        self._dirty = True
+        self.save()
+
+    def get_support(self, feature):
+        return self._support.get(str(feature))
+
+    def set_support(self, feature, value):
+        # These are cheap to recompute, so we wait for the next save()
+        # rather than writing the file for each one
+        self._support[str(feature)] = bool(value)
+        self._dirty = True
+
+    def invalidate(self):
+        """
+        Drop cached capabilities and domcapabilities, for when the
+        caller knows they are out of date
+        """
+        self._caps = None
+        self._domcaps = {}
+        self._emulators = {}
+        self._dirty = True
+        self.save()
+
+    def save(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        data = {
+            "format": _FORMAT_VERSION,
+            "key": self._key,
+            "emulators": self._emulators,
+            "caps": self._caps,
+            "domcaps": self._domcaps,
+            "support": self._support,
+        }
+
+        dirname = os.path.dirname(self._path)
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname, 0o700)
+            fd, tmppath = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmppath, self._path)
+        except Exception as e:
+            logging.debug("Error writing capabilities cache %s: %s",
+                          self._path, e)
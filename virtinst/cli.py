@@ -15,6 +15,7 @@ import re
 import shlex
 import subprocess
 import sys
+import threading
 import traceback
 import types
 
@@ -44,6 +45,10 @@ class _GlobalState(object):
     def set_validation_check(self, checkname, val):
         self._validation_checks[checkname] = val
 
+    def reset_validation_checks(self):
+        self.all_checks = None
+        self._validation_checks = {}
+
     def get_validation_check(self, checkname):
         if self.all_checks is not None:
             return self.all_checks
@@ -275,6 +280,33 @@ def _fail_exit():
     sys.exit(1)
 
 
+class ErrorCapture(logging.Handler):
+    """
+    Remember the last error logged by each thread. fail() logs the
+    message and then raises SystemExit, so code that runs cli helpers
+    without exiting, on worker threads for example, can use pop() to
+    report the message.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self._errors = {}
+
+    def emit(self, record):
+        self._errors[threading.get_ident()] = record.getMessage()
+
+    def clear(self):
+        self._errors.pop(threading.get_ident(), None)
+
+    def pop(self, e):
+        """
+        Return the error message for exception e raised on this thread
+        """
+        msg = self._errors.pop(threading.get_ident(), None)
+        if isinstance(e, SystemExit):
+            return msg or _("Unknown error")
+        return str(e)
+
+
 def nice_exit():
     print_stdout(_("Exiting at user request."))
     sys.exit(0)
@@ -952,11 +984,64 @@ class _VirtCLIArgumentStatic(object):
         VirtCLIArgument. So for an option like --foo bar=X, this
         checks if we are the parser for 'bar'
         """
-        for argname in [self.cliname] + util.listify(self.aliases):
+        for argname in self.get_names():
             if re.match("^%s$" % argname, cliname):
                 return True
         return False
 
+    def get_names(self):
+        return [self.cliname] + util.listify(self.aliases)
+
+
+class _VirtCLIArgumentIndex(object):
+    """
+    Lookup table for a parser's list of _VirtCLIArgumentStatic.
+
+    Most argument names are plain strings, and go in a dict. The rest
+    are regex patterns like vcpupin[0-9]*.vcpu, and they are compiled
+    into one alternation with a named group per pattern. Both give the
+    position of the first matching virtarg in the list, so lookups
+    return the same virtarg as calling match_name on each in turn.
+    """
+    _REGEX_CHARS = set(".^$*+?{}[]\\|()")
+
+    def __init__(self, virtargs):
+        self.virtargs = virtargs
+        self.count = len(virtargs)
+        self._exact = {}
+        patterns = []
+
+        for idx, virtarg in enumerate(virtargs):
+            for argname in virtarg.get_names():
+                if self._REGEX_CHARS.intersection(argname):
+                    patterns.append("(?P<arg%d>%s)" % (idx, argname))
+                elif argname not in self._exact:
+                    self._exact[argname] = idx
+
+        self._regex = None
+        if patterns:
+            self._regex = re.compile("^(?:%s)$" % "|".join(patterns))
+
+    def lookup_index(self, cliname):
+        """
+        Return the list position of the virtarg matching cliname,
+        or None
+        """
+        ret = self._exact.get(cliname)
+        if self._regex:
+            match = self._regex.match(cliname)
+            if match:
+                idx = int(match.lastgroup[3:])
+                if ret is None or idx < ret:
+                    ret = idx
+        return ret
+
+    def lookup(self, cliname):
+        idx = self.lookup_index(cliname)
+        if idx is None:
+            return None
+        return self.virtargs[idx]
+
 
 class _VirtCLIArgument(object):
     """
@@ -1073,10 +1158,10 @@ def parse_optstr_tuples(optstr):
     return ret
 
 
-def _parse_optstr_to_dict(optstr, virtargs, remove_first):
+def _parse_optstr_to_dict(optstr, virtargindex, remove_first):
     """
     Parse the passed argument string into an OrderedDict WRT
-    the passed list of VirtCLIArguments and their special handling.
+    the passed _VirtCLIArgumentIndex and its special handling.
 
     So for --disk path=foo,size=5, optstr is 'path=foo,size=5', and
     we return {"path": "foo", "size": "5"}
@@ -1094,21 +1179,16 @@ def _parse_optstr_to_dict(optstr, virtargs, remove_first):
         else:
             optdict[cliname] = val
 
-    def _lookup_virtarg(cliname):
-        for virtarg in virtargs:
-            if virtarg.match_name(cliname):
-                return virtarg
-
     def _consume_comma_arg(commaopt):
         while opttuples:
             cliname, val = opttuples[0]
-            if _lookup_virtarg(cliname):
+            if virtargindex.lookup(cliname):
                 # Next tuple is for an actual virtarg
                 break
 
             # Next tuple is a continuation of the comma argument,
             # sum it up
-            opttuples.pop(0)
+            opttuples.popleft()
             commaopt[1] += "," + cliname
             if val:
                 commaopt[1] += "=" + val
@@ -1121,9 +1201,10 @@ def _parse_optstr_to_dict(optstr, virtargs, remove_first):
             break
         opttuples[idx] = (remove_first.pop(0), cliname)
 
+    opttuples = collections.deque(opttuples)
     while opttuples:
-        cliname, val = opttuples.pop(0)
-        virtarg = _lookup_virtarg(cliname)
+        cliname, val = opttuples.popleft()
+        virtarg = virtargindex.lookup(cliname)
         if not virtarg:
             optdict[cliname] = val
             continue
@@ -1190,6 +1271,7 @@ class VirtCLIParser(metaclass=InitClass):
     support_cb = None
     cli_arg_name = None
     _virtargs = []
+    _virtargindex = None
 
     @classmethod
     def add_arg(cls, *args, **kwargs):
@@ -1201,6 +1283,16 @@ class VirtCLIParser(metaclass=InitClass):
                 None, "clearxml", cb=cls._clearxml_cb, is_onoff=True)]
         cls._virtargs.append(_VirtCLIArgumentStatic(*args, **kwargs))
 
+    @classmethod
+    def _get_virtarg_index(cls):
+        index = cls._virtargindex
+        if (not index or
+            index.virtargs is not cls._virtargs or
+            index.count != len(cls._virtargs)):
+            index = _VirtCLIArgumentIndex(cls._virtargs)
+            cls._virtargindex = index
+        return index
+
     @classmethod
     def cli_flag_name(cls):
         return "--" + cls.cli_arg_name.replace("_", "-")
@@ -1249,7 +1341,8 @@ class VirtCLIParser(metaclass=InitClass):
         self.guest = guest
         self.optstr = optstr
         self.optdict = _parse_optstr_to_dict(self.optstr,
-                self._virtargs, util.listify(self.remove_first)[:])
+                self._get_virtarg_index(),
+                util.listify(self.remove_first)[:])
 
     def _clearxml_cb(self, inst, val, virtarg):
         """
@@ -1305,13 +1398,19 @@ class VirtCLIParser(metaclass=InitClass):
         Convert the passed optdict to a list of instantiated
         VirtCLIArguments to actually interact with
         """
+        # Params are processed in the order the virtargs were added,
+        # and for the same virtarg, in the order they were passed
+        index = self._get_virtarg_index()
+        found = []
+        for pos, key in enumerate(list(optdict.keys())):
+            idx = index.lookup_index(key)
+            if idx is not None:
+                found.append((idx, pos, key))
+
         ret = []
-        for virtargstatic in self._virtargs:
-            for key in list(optdict.keys()):
-                if virtargstatic.match_name(key):
-                    arginst = _VirtCLIArgument(virtargstatic,
-                                               key, optdict.pop(key))
-                    ret.append(arginst)
+        for idx, dummy, key in sorted(found):
+            ret.append(_VirtCLIArgument(self._virtargs[idx],
+                                        key, optdict.pop(key)))
         return ret
 
     def _check_leftover_opts(self, optdict):
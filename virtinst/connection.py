@@ -4,7 +4,10 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import collections
 import logging
+import os
+import threading
 import weakref
 
 import libvirt
@@ -13,12 +16,109 @@ from . import pollhelpers
 from . import support
 from . import util
 from . import Capabilities
+from .capscache import CapsCache
 from .guest import Guest
 from .nodedev import NodeDevice
 from .storage import StoragePool, StorageVolume
 from .uri import URI, MagicURI
 
 
+class _DomainCache(object):
+    """
+    Cache of parsed domain XML for a single connection, shared by
+    virtinst and virt-manager.
+
+    Entries are keyed by (domain name, XMLDesc flags) and store the raw
+    XML next to the parsed object. Handing in freshly fetched XML that
+    matches the cached string returns the existing parsed object rather
+    than parsing it again, so an entry is never served for XML it
+    wasn't parsed from.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def lookup(self, name, xml, parsefunc, flags=0):
+        """
+        Return the parsed object for the passed XML, reusing the cached
+        object if the XML hasn't changed.
+
+        :param parsefunc: Called with the XML string if we need to parse
+        """
+        key = (name, flags)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] == xml:
+            return entry[1]
+
+        xmlobj = parsefunc(xml)
+        with self._lock:
+            self._entries[key] = (xml, xmlobj)
+        return xmlobj
+
+    def remove(self, name=None):
+        """
+        Drop cached entries for the passed domain name, or everything
+        if name is None
+        """
+        with self._lock:
+            if name is None:
+                self._entries = {}
+                return
+            for key in list(self._entries):
+                if key[0] == name:
+                    self._entries.pop(key)
+
+    def prune(self, names):
+        """
+        Drop entries for any domain that isn't in the passed list
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] not in names:
+                    self._entries.pop(key)
+
+
+class _DomcapsCache(object):
+    """
+    Small LRU cache of parsed DomainCapabilities for a single connection,
+    keyed by the (emulator, arch, machine, hvtype) tuple they were
+    requested with. The objects are shared between every caller asking
+    for the same tuple, so they must be treated as read only.
+    """
+    MAX_ENTRIES = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def lookup(self, key, buildfunc):
+        """
+        Return the cached object for key, or call buildfunc to create it
+
+        :param buildfunc: Called with no arguments on cache miss
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        obj = buildfunc()
+        with self._lock:
+            self._entries[key] = obj
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.MAX_ENTRIES:
+                self._entries.popitem(last=False)
+        return obj
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class VirtinstConnection(object):
     """
     Wrapper for libvirt connection that provides various bits like
@@ -56,9 +156,13 @@ class VirtinstConnection(object):
         self._libvirtconn = None
         self._uriobj = URI(self._uri)
         self._caps = None
+        self._caps_cache = None
+        self._domcaps_cache = _DomcapsCache()
 
         self._support_cache = {}
         self._fetch_cache = {}
+        self._domain_cache = _DomainCache()
+        self._domain_cache_cb_ids = []
 
         # These let virt-manager register a callback which provides its
         # own cached object lists, rather than doing fresh calls
@@ -87,8 +191,18 @@ class VirtinstConnection(object):
 
     def _get_caps(self):
         if not self._caps:
-            self._caps = Capabilities(self,
-                self._libvirtconn.getCapabilities())
+            xml = self._caps_cache and self._caps_cache.get_caps()
+            if xml:
+                self._caps = Capabilities(self, xml)
+            else:
+                xml = self._libvirtconn.getCapabilities()
+                self._caps = Capabilities(self, xml)
+                if self._caps_cache:
+                    emulators = []
+                    for guest in self._caps.guests:
+                        emulators.append(guest.emulator)
+                        emulators.extend([d.emulator for d in guest.domains])
+                    self._caps_cache.set_caps(xml, emulators)
         return self._caps
     caps = property(_get_caps)
 
@@ -106,10 +220,22 @@ class VirtinstConnection(object):
     def close(self):
         ret = 0
         if self._libvirtconn:
+            for eid in self._domain_cache_cb_ids:
+                try:
+                    self._libvirtconn.domainEventDeregisterAny(eid)
+                except Exception:
+                    logging.debug("Error deregistering domain cache event",
+                        exc_info=True)
             ret = self._libvirtconn.close()
+        if self._caps_cache:
+            self._caps_cache.save()
+        self._caps_cache = None
         self._libvirtconn = None
         self._uri = None
         self._fetch_cache = {}
+        self._domain_cache_cb_ids = []
+        self._domain_cache.remove()
+        self._domcaps_cache.clear()
         return ret
 
     def fake_conn_predictable(self):
@@ -117,6 +243,9 @@ class VirtinstConnection(object):
 
     def invalidate_caps(self):
         self._caps = None
+        self._domcaps_cache.clear()
+        if self._caps_cache:
+            self._caps_cache.invalidate()
 
     def is_open(self):
         return bool(self._libvirtconn)
@@ -141,10 +270,14 @@ class VirtinstConnection(object):
             self._magic_uri.overwrite_conn_functions(conn)
 
         self._libvirtconn = conn
+        self._domcaps_cache.clear()
         if not self._open_uri:
             self._uri = self._libvirtconn.getURI()
             self._uriobj = URI(self._uri)
 
+        if self._can_use_caps_cache():
+            self._caps_cache = CapsCache.load(self)
+
     def set_keep_alive(self, interval, count):
         if hasattr(self._libvirtconn, "setKeepAlive"):
             self._libvirtconn.setKeepAlive(interval, count)
@@ -159,11 +292,76 @@ class VirtinstConnection(object):
     _FETCH_KEY_VOLS = "vols"
     _FETCH_KEY_NODEDEVS = "nodedevs"
 
+    def parse_domain_cached(self, name, xml, flags=0):
+        """
+        Return a Guest for the passed domain XML, reusing a previously
+        parsed object from the shared domain cache if the XML is
+        unchanged. The returned object is shared, callers must not
+        alter it.
+
+        :param flags: The XMLDesc flags used to fetch the XML
+        """
+        return self._domain_cache.lookup(name, xml,
+            lambda x: Guest(weakref.ref(self), parsexml=x), flags)
+
+    def invalidate_domain_cache(self):
+        """
+        Signal that domains have changed, so the next fetch_all_domains
+        refetches XML. Parsed objects are kept and reused for any domain
+        whose XML turns out to be unchanged.
+        """
+        self._fetch_cache.pop(self._FETCH_KEY_DOMAINS, None)
+
+    def remove_cached_domain(self, name):
+        """
+        Drop all cached XML for the passed domain name, for example
+        when it is undefined or renamed
+        """
+        self._domain_cache.remove(name)
+        self._fetch_cache.pop(self._FETCH_KEY_DOMAINS, None)
+
+    def _domain_cache_event(self, conn, domain, *args):
+        ignore = conn
+        ignore = domain
+        ignore = args
+        self.invalidate_domain_cache()
+
+    def _register_domain_cache_events(self):
+        """
+        Register for domain events so the fetch_all_domains cache is
+        invalidated when domains change. This only works if the app
+        has registered a libvirt event loop implementation. Without
+        one, registration fails and the cache stays valid for the life
+        of the connection, which is fine for one-shot CLI tools.
+        """
+        if self._domain_cache_cb_ids:
+            return
+
+        eventids = [
+            (libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+             lambda c, d, e, det, o: self._domain_cache_event(c, d)),
+            (getattr(libvirt, "VIR_DOMAIN_EVENT_ID_DEVICE_ADDED", 19),
+             lambda c, d, dev, o: self._domain_cache_event(c, d)),
+            (getattr(libvirt, "VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED", 15),
+             lambda c, d, dev, o: self._domain_cache_event(c, d)),
+        ]
+        for eventid, cb in eventids:
+            try:
+                self._domain_cache_cb_ids.append(
+                    self._libvirtconn.domainEventRegisterAny(
+                        None, eventid, cb, None))
+            except Exception as e:
+                logging.debug("Not using events for domain cache "
+                    "invalidation: %s", e)
+                break
+
     def _fetch_all_domains_raw(self):
         ignore, ignore, ret = pollhelpers.fetch_vms(
             self, {}, lambda obj, ignore: obj)
-        return [Guest(weakref.ref(self), parsexml=obj.XMLDesc(0))
-                for obj in ret]
+        names = [obj.name() for obj in ret]
+        self._domain_cache.prune(names)
+        return [self.parse_domain_cached(name, obj.XMLDesc(0))
+                for name, obj in zip(names, ret)]
 
     def fetch_all_domains(self):
         """
@@ -174,6 +372,7 @@ class VirtinstConnection(object):
 
         key = self._FETCH_KEY_DOMAINS
         if key not in self._fetch_cache:
+            self._register_domain_cache_events()
             self._fetch_cache[key] = self._fetch_all_domains_raw()
         return self._fetch_cache[key][:]
 
@@ -386,8 +585,16 @@ class VirtinstConnection(object):
     def check_support(self, features, data=None):
         def _check_support(key):
             if key not in self._support_cache:
-                self._support_cache[key] = support.check_support(
-                    self, key, data or self)
+                # Only checks against the connection itself are
+                # persisted, anything else depends on the passed object
+                ret = None
+                if data is None and self._caps_cache:
+                    ret = self._caps_cache.get_support(key)
+                if ret is None:
+                    ret = support.check_support(self, key, data or self)
+                    if data is None and self._caps_cache:
+                        self._caps_cache.set_support(key, ret)
+                self._support_cache[key] = ret
             return self._support_cache[key]
 
         for f in util.listify(features):
@@ -396,6 +603,39 @@ class VirtinstConnection(object):
                 return False
         return True
 
+    def _can_use_caps_cache(self):
+        # The test suite and test driver need fresh results, and magic
+        # URIs fake version info that the cache would be keyed on
+        if "VIRTINST_TEST_SUITE" in os.environ:
+            return False
+        return not (self._magic_uri or self.is_really_test())
+
+    def lookup_domcaps_cached(self, emulator, arch, machine, hvtype,
+                              buildfunc):
+        """
+        Return the DomainCapabilities for the passed parameters from the
+        connection's in memory cache, calling buildfunc on cache miss.
+        The returned object is shared, callers must not alter it.
+        """
+        key = (emulator, arch, machine, hvtype)
+        return self._domcaps_cache.lookup(key, buildfunc)
+
+    def get_domain_capabilities_xml(self, emulator, arch, machine, hvtype):
+        """
+        Return the getDomainCapabilities XML for the passed parameters,
+        using the on disk cache if possible
+        """
+        if self._caps_cache:
+            xml = self._caps_cache.get_domcaps(emulator, arch, machine, hvtype)
+            if xml:
+                return xml
+
+        xml = self._libvirtconn.getDomainCapabilities(
+            emulator, arch, machine, hvtype)
+        if self._caps_cache:
+            self._caps_cache.set_domcaps(emulator, arch, machine, hvtype, xml)
+        return xml
+
     def _check_version(self, version):
         # Entry point for the test suite to do simple version checks,
         # actual code should only use check_support
@@ -136,11 +136,24 @@ class _CPU(XMLBuilder):
 class DomainCapabilities(XMLBuilder):
     @staticmethod
     def build_from_params(conn, emulator, arch, machine, hvtype):
+        """
+        Return the DomainCapabilities for the passed parameters. Results
+        are cached per connection and shared between callers, so they
+        must be treated as read only.
+        """
+        def _build():
+            return DomainCapabilities._build_uncached(conn,
+                emulator, arch, machine, hvtype)
+        return conn.lookup_domcaps_cached(emulator, arch, machine, hvtype,
+                                          _build)
+
+    @staticmethod
+    def _build_uncached(conn, emulator, arch, machine, hvtype):
         xml = None
         if conn.check_support(
                 conn.SUPPORT_CONN_DOMAIN_CAPABILITIES):
             try:
-                xml = conn.getDomainCapabilities(emulator, arch,
+                xml = conn.get_domain_capabilities_xml(emulator, arch,
                     machine, hvtype)
             except Exception:
                 logging.debug("Error fetching domcapabilities XML",
@@ -234,6 +247,7 @@ class DomainCapabilities(XMLBuilder):
 
 
     XML_NAME = "domainCapabilities"
+    _XML_READONLY_PARSE = True
     os = XMLChildProperty(_OS, is_single=True)
     cpu = XMLChildProperty(_CPU, is_single=True)
     devices = XMLChildProperty(_Devices, is_single=True)
@@ -0,0 +1,317 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import logging
+import queue
+import threading
+import time
+
+import libvirt
+
+
+# Only available with newer libvirt-python
+_VIR_MIGRATE_PARALLEL = getattr(libvirt, "VIR_MIGRATE_PARALLEL", 131072)
+_VIR_MIGRATE_PARAM_PARALLEL_CONNECTIONS = getattr(libvirt,
+        "VIR_MIGRATE_PARAM_PARALLEL_CONNECTIONS", "parallel.connections")
+
+
+class MigrationOptions(object):
+    """
+    Tunables for a migration, translated into migrate3/migrateToURI3
+    flags and params.
+    """
+    def __init__(self):
+        self.dest_uri = None
+        self.tunnel = False
+        self.unsafe = False
+        self.temporary = False
+
+        # Performance knobs
+        self.compressed = False
+        self.auto_converge = False
+        self.postcopy = False
+        # Switch a post-copy capable migration over to post-copy after
+        # this many seconds of pre-copy. None means never switch
+        self.postcopy_after = None
+        self.parallel_connections = None
+        # Bandwidth limit in MiB/s
+        self.bandwidth = None
+
+    def get_flags(self):
+        flags = libvirt.VIR_MIGRATE_LIVE
+
+        if not self.temporary:
+            flags |= libvirt.VIR_MIGRATE_PERSIST_DEST
+            flags |= libvirt.VIR_MIGRATE_UNDEFINE_SOURCE
+
+        if self.tunnel:
+            flags |= libvirt.VIR_MIGRATE_PEER2PEER
+            flags |= libvirt.VIR_MIGRATE_TUNNELLED
+
+        if self.unsafe:
+            flags |= libvirt.VIR_MIGRATE_UNSAFE
+        if self.compressed:
+            flags |= libvirt.VIR_MIGRATE_COMPRESSED
+        if self.auto_converge:
+            flags |= libvirt.VIR_MIGRATE_AUTO_CONVERGE
+        if self.postcopy:
+            flags |= libvirt.VIR_MIGRATE_POSTCOPY
+        if self.parallel_connections:
+            flags |= _VIR_MIGRATE_PARALLEL
+        return flags
+
+    def get_params(self):
+        params = {}
+        if self.dest_uri and not self.tunnel:
+            params[libvirt.VIR_MIGRATE_PARAM_URI] = self.dest_uri
+        if self.bandwidth:
+            params[libvirt.VIR_MIGRATE_PARAM_BANDWIDTH] = int(self.bandwidth)
+        if self.parallel_connections:
+            params[_VIR_MIGRATE_PARAM_PARALLEL_CONNECTIONS] = int(
+                self.parallel_connections)
+        return params
+
+    def migrate(self, domain, destconn):
+        """
+        Migrate the passed libvirt domain. Blocks until the migration
+        has finished.
+
+        :param destconn: libvirt connection for the destination. Unused
+            for tunnelled migration, which goes to dest_uri instead
+        """
+        flags = self.get_flags()
+        params = self.get_params()
+        logging.debug("Migrating %s: flags=%s params=%s tunnel=%s",
+                      domain.name(), flags, params, self.tunnel)
+
+        if self.tunnel:
+            domain.migrateToURI3(self.dest_uri, params, flags)
+        else:
+            domain.migrate3(destconn, params, flags)
+
+
+class MigrationJob(object):
+    """
+    State of a single domain in a MigrationQueue
+    """
+    STATE_QUEUED = "queued"
+    STATE_RUNNING = "running"
+    STATE_DONE = "done"
+    STATE_FAILED = "failed"
+    STATE_CANCELLED = "cancelled"
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.name = domain.name()
+        self.state = self.STATE_QUEUED
+        self.error = None
+        self.started = None
+        self.postcopy_started = False
+
+        # Until the job reports real numbers, guess that we need to
+        # copy the domain's whole memory
+        self.data_total = 0
+        self.data_remaining = 0
+        try:
+            self.data_total = domain.maxMemory() * 1024
+            self.data_remaining = self.data_total
+        except Exception:
+            logging.debug("Error fetching memory size for %s",
+                          self.name, exc_info=True)
+
+    def is_finished(self):
+        return self.state in [self.STATE_DONE, self.STATE_FAILED,
+                              self.STATE_CANCELLED]
+
+    def get_processed(self):
+        if self.state == self.STATE_DONE:
+            return self.data_total
+        return max(self.data_total - self.data_remaining, 0)
+
+    def update_from_job_info(self, jobinfo):
+        # jobinfo[3] is data_total, jobinfo[5] data_remaining. data_total
+        # is 0 until the job has really started
+        if jobinfo[3]:
+            self.data_total = jobinfo[3]
+            self.data_remaining = jobinfo[5]
+
+
+class MigrationQueue(object):
+    """
+    Migrate a list of domains to one destination, running at most
+    max_parallel migrations at a time.
+
+    Progress for the whole queue is collected by polling jobInfo() on
+    every running domain, and reported through progress_cb.
+    """
+    POLL_INTERVAL = .5
+
+    def __init__(self, destconn, options, max_parallel=2, progress_cb=None):
+        """
+        :param destconn: libvirt connection for the destination
+        :param options: MigrationOptions shared by every migration
+        :param progress_cb: Called with the queue from the polling
+            thread whenever progress was updated
+        """
+        self.destconn = destconn
+        self.options = options
+        self.max_parallel = max(int(max_parallel), 1)
+        self.progress_cb = progress_cb
+
+        self.jobs = []
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._threads = []
+        self._poll_thread = None
+        self._finished = threading.Event()
+
+    def add(self, domain):
+        job = MigrationJob(domain)
+        self.jobs.append(job)
+        return job
+
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _migrate_job(self, job):
+        with self._lock:
+            if self._cancelled:
+                job.state = job.STATE_CANCELLED
+                return
+            job.state = job.STATE_RUNNING
+            job.started = time.time()
+
+        try:
+            self.options.migrate(job.domain, self.destconn)
+            newstate = job.STATE_DONE
+        except Exception as e:
+            logging.debug("Migrating %s failed", job.name, exc_info=True)
+            job.error = e
+            newstate = job.STATE_FAILED
+
+        with self._lock:
+            if newstate == job.STATE_FAILED and self._cancelled:
+                newstate = job.STATE_CANCELLED
+            job.state = newstate
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            self._migrate_job(job)
+
+    def _maybe_start_postcopy(self, job):
+        if (not self.options.postcopy or
+            self.options.postcopy_after is None or
+            job.postcopy_started):
+            return
+        if time.time() - job.started < self.options.postcopy_after:
+            return
+
+        logging.debug("Switching %s migration to post-copy", job.name)
+        job.postcopy_started = True
+        try:
+            job.domain.migrateStartPostCopy(0)
+        except Exception:
+            logging.debug("Error starting post-copy for %s",
+                          job.name, exc_info=True)
+
+    def _poll(self):
+        for job in self.jobs:
+            if job.state != job.STATE_RUNNING:
+                continue
+            try:
+                job.update_from_job_info(job.domain.jobInfo())
+            except Exception:
+                logging.debug("Error fetching job info for %s",
+                              job.name, exc_info=True)
+                continue
+            self._maybe_start_postcopy(job)
+
+        if self.progress_cb:
+            self.progress_cb(self)
+
+    def _poll_loop(self):
+        while not self._finished.wait(self.POLL_INTERVAL):
+            self._poll()
+        if self.progress_cb:
+            self.progress_cb(self)
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def start(self):
+        for job in self.jobs:
+            self._pending.put(job)
+
+        for idx in range(min(self.max_parallel, len(self.jobs))):
+            t = threading.Thread(target=self._worker,
+                                 name="migration worker %d" % idx)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+        self._poll_thread = threading.Thread(target=self._poll_loop,
+                                             name="migration progress")
+        self._poll_thread.daemon = True
+        self._poll_thread.start()
+
+    def wait(self):
+        """
+        Block until every job has finished, failed, or was cancelled
+        """
+        for t in self._threads:
+            t.join()
+        self._finished.set()
+        if self._poll_thread:
+            self._poll_thread.join()
+
+    def run(self):
+        self.start()
+        self.wait()
+
+    def cancel(self):
+        """
+        Drop every queued job and abort the running ones
+        """
+        with self._lock:
+            self._cancelled = True
+            running = [j for j in self.jobs if j.state == j.STATE_RUNNING]
+
+        for job in running:
+            try:
+                job.domain.abortJob()
+            except Exception:
+                logging.debug("Error aborting migration of %s",
+                              job.name, exc_info=True)
+
+    def get_progress(self):
+        """
+        Return (bytes processed, estimated bytes total, finished job count)
+        summed over every job in the queue
+        """
+        processed = 0
+        total = 0
+        finished = 0
+        for job in self.jobs:
+            if job.state in [job.STATE_FAILED, job.STATE_CANCELLED]:
+                finished += 1
+                continue
+            if job.state == job.STATE_DONE:
+                finished += 1
+            processed += job.get_processed()
+            total += job.data_total
+        return processed, total, finished
+
+    def get_failed(self):
+        return [j for j in self.jobs if j.state == j.STATE_FAILED]
@@ -95,6 +95,7 @@ class NodeDevice(XMLBuilder):
     # Libvirt can generate bogus 'system' XML:
     # https://bugzilla.redhat.com/show_bug.cgi?id=1184131
     _XML_SANITIZE = True
+    _XML_READONLY_PARSE = True
 
     name = XMLProperty("./name")
     parent = XMLProperty("./parent")
@@ -0,0 +1,482 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+Optional long running virtinst service.
+
+Listens on a UNIX socket and accepts newline delimited JSON-RPC 2.0
+requests for install, clone and XML edit operations. Connections, the
+OS database and capabilities caches stay warm between requests, so
+scripts that create or change many VMs don't pay python startup and
+connection setup costs for each one. Start it with:
+
+    python3 -m virtinst.service --socket PATH [--connect URI]
+
+Each client gets its own thread, requests are run on a shared worker
+pool, and responses carry the id of the request they answer, so a
+client can have several requests in flight at once.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+
+from . import cli
+from . import util
+from . import virtclone
+from . import virtinstall
+from . import virtxml
+from .connection import VirtinstConnection
+
+
+# Standard JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# Implementation defined: the requested operation failed
+OPERATION_FAILED = -32000
+
+
+class ServiceError(Exception):
+    """
+    Error reported back to the client as a JSON-RPC error object
+    """
+    def __init__(self, code, msg):
+        Exception.__init__(self, msg)
+        self.code = code
+
+
+def _build_option_parser(build_parser):
+    """
+    Build the parser of one of the tools with build_parser, reporting
+    bad 'args' back to the client instead of exiting
+    """
+    def _error(message):
+        raise ServiceError(INVALID_PARAMS, message)
+
+    def _exit(status=0, message=None):
+        ignore = status
+        raise ServiceError(INVALID_PARAMS,
+            message or _("Option not supported by the service"))
+
+    parser = build_parser()
+    parser.error = _error
+    parser.exit = _exit
+    return parser
+
+
+class VirtinstService(object):
+    """
+    The request handling side of the service, independent of the
+    socket transport so it can be driven directly.
+
+    :param default_uri: URI used by requests that don't pass one
+    :param workers: Size of the request worker pool
+    """
+    def __init__(self, default_uri=None, workers=4):
+        self._default_uri = default_uri
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        # Dict of uri -> VirtinstConnection, plus a lock per uri that
+        # serializes requests' use of the connection, since its caches
+        # aren't thread safe
+        self._conns = {}
+        self._conn_locks = {}
+        self._conns_lock = threading.Lock()
+
+        # argparse and the VIRT_PARSERS registration aren't safe to
+        # run concurrently, so the parsers are shared behind a lock
+        self._parsers = {
+            "install": _build_option_parser(virtinstall.build_parser),
+            "clone": _build_option_parser(virtclone.build_parser),
+            "xml": _build_option_parser(virtxml.build_parser),
+        }
+        self._parser_lock = threading.Lock()
+
+        self._errors = cli.ErrorCapture()
+        logging.getLogger().addHandler(self._errors)
+
+        # The shared tool code reads cli's global state, and reports
+        # progress with print_stdout. Keep that off the service's stdout,
+        # results go back to the client.
+        cli._reset_global_state()
+        cli.get_global_state().quiet = True
+
+        self._methods = {
+            "ping": self._ping,
+            "install": self._install,
+            "clone": self._clone,
+            "xml": self._xml,
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        logging.getLogger().removeHandler(self._errors)
+        with self._conns_lock:
+            for conn in self._conns.values():
+                try:
+                    conn.close()
+                except Exception:
+                    logging.debug("Error closing connection", exc_info=True)
+            self._conns = {}
+
+
+    ###########################
+    # Warm connection helpers #
+    ###########################
+
+    def _get_conn(self, params):
+        uri = params.get("uri", self._default_uri)
+        with self._conns_lock:
+            conn = self._conns.get(uri)
+            if conn and conn.is_closed():
+                conn = None
+            if not conn:
+                logging.debug("service: opening connection to %s",
+                              uri or "default")
+                conn = VirtinstConnection(uri)
+                # There's no terminal to prompt on, so no auth callback
+                conn.open(None, None)
+                self._conns[uri] = conn
+                self._conn_locks[uri] = threading.Lock()
+            return conn, self._conn_locks[uri]
+
+    def _parse_args(self, method, args):
+        if (not isinstance(args, list) or
+            not all(isinstance(a, str) for a in args)):
+            raise ServiceError(INVALID_PARAMS,
+                               _("'args' must be a list of strings"))
+
+        with self._parser_lock:
+            options = self._parsers[method].parse_args(args)
+
+        # Other code in the process may have registered more parsers
+        for parserclass in cli.VIRT_PARSERS:
+            if not hasattr(options, parserclass.cli_arg_name):
+                setattr(options, parserclass.cli_arg_name, None)
+        return options
+
+
+    ###################
+    # Request methods #
+    ###################
+
+    def _ping(self, params):
+        ignore = params
+        return {"pid": os.getpid(), "uris": sorted(
+            [u or "" for u in self._conns])}
+
+    def _install(self, params):
+        """
+        Create a guest. 'args' takes virt-install options, and is
+        validated and turned into a guest the same way virt-install
+        does it. Returns the guest name. With --print-xml nothing is
+        created, and the XML of the first install step is returned as
+        'xml' and the XML of the second step, if the install has one,
+        as 'final_xml'.
+
+        --check, --force and --prompt aren't accepted, since they change
+        process wide state that every later request would inherit.
+        """
+        conn, connlock = self._get_conn(params)
+        options = self._parse_args("install", params.get("args", []))
+        if not options.name:
+            raise ServiceError(INVALID_PARAMS, _("--name is required"))
+        if (options.batch or options.test_media_detection or
+            options.check or options.force or options.prompt):
+            raise ServiceError(INVALID_PARAMS,
+                _("Option not supported by the service"))
+
+        virtinstall.convert_old_printxml(options)
+        virtinstall.process_options(options)
+
+        meter = util.make_meter(quiet=True)
+        with connlock:
+            guest, installer = virtinstall.build_guest_instance(
+                    conn, options)
+
+            if options.xmlonly:
+                start_xml, final_xml = virtinstall.get_install_xml(
+                        guest, installer, False)
+                return {"name": guest.name, "xml": start_xml,
+                        "final_xml": final_xml}
+
+            try:
+                installer.start_install(guest, meter=meter,
+                        dry=options.dry,
+                        doboot=not options.noreboot,
+                        transient=options.transient)
+            except Exception:
+                if not options.dry:
+                    installer.cleanup_created_disks(guest, meter)
+                raise
+
+        return {"name": guest.name, "dry_run": bool(options.dry)}
+
+    def _clone(self, params):
+        """
+        Clone a guest like virt-clone. Takes 'original', and either
+        'name' or 'auto_clone'. 'files' lists new disk paths, 'preserve'
+        false skips copying storage, and 'print_xml' returns the clone
+        XML without creating anything.
+        """
+        conn, connlock = self._get_conn(params)
+        original = params.get("original")
+        if not original:
+            raise ServiceError(INVALID_PARAMS,
+                               _("An original machine name is required"))
+
+        args = ["--original", original]
+        if params.get("name"):
+            args += ["--name", params["name"]]
+        for path in params.get("files") or []:
+            args += ["--file", path]
+        for param, arg in [("auto_clone", "--auto-clone"),
+                           ("replace", "--replace"),
+                           ("clone_running", "--clone-running"),
+                           ("print_xml", "--print-xml")]:
+            if params.get(param):
+                args.append(arg)
+        if not params.get("preserve", True):
+            args.append("--preserve-data")
+        options = self._parse_args("clone", args)
+
+        with connlock:
+            design = virtclone.build_clone_design(conn, options)
+            if options.xmlonly:
+                return {"name": design.clone_name, "xml": design.clone_xml}
+            design.start_duplicate(util.make_meter(quiet=True))
+        return {"name": design.clone_name}
+
+    def _xml(self, params):
+        """
+        Change an existing domain like virt-xml. 'action' is one of
+        edit, add-device, remove-device. 'args' holds the single
+        virt-xml style option to apply. 'select' picks the object for
+        edit, remove-device takes it from the option value like
+        virt-xml does. 'define' defaults to true, 'update' applies
+        device changes to the running guest.
+        """
+        conn, connlock = self._get_conn(params)
+        domname = params.get("domain")
+        action = params.get("action", "edit")
+        select = params.get("select")
+        define = params.get("define", True)
+        update = bool(params.get("update"))
+        if not domname:
+            raise ServiceError(INVALID_PARAMS, _("'domain' is required"))
+        if action not in ["edit", "add-device", "remove-device"]:
+            raise ServiceError(INVALID_PARAMS,
+                               _("Unknown action '%s'") % action)
+
+        args = params.get("args", [])
+        if not isinstance(args, list):
+            raise ServiceError(INVALID_PARAMS,
+                               _("'args' must be a list of strings"))
+        actionarg = "--" + action
+        if action == "edit" and select is not None:
+            actionarg += "=" + str(select)
+        args = [actionarg] + args
+        if update:
+            args.append("--update")
+        options = self._parse_args("xml", args)
+        parserclass = virtxml.get_parserclass(options)
+
+        with connlock:
+            domain, inactive_xmlobj, active_xmlobj = (
+                virtxml.get_domain_and_guest(conn, domname, "name"))
+            origxml = inactive_xmlobj.get_xml()
+            devs, devaction = virtxml.apply_changes(inactive_xmlobj, options,
+                                                    parserclass)
+            newxml = inactive_xmlobj.get_xml()
+            ret = {"diff": virtxml.get_diff(origxml, newxml),
+                   "defined": False, "updated": False}
+            if params.get("print_xml"):
+                ret["xml"] = newxml
+                return ret
+
+            if update and active_xmlobj:
+                livedevs, liveaction = virtxml.apply_changes(
+                    active_xmlobj, options, parserclass)
+                virtxml.update_changes(domain, livedevs, liveaction, False)
+                ret["updated"] = True
+            if define:
+                virtxml.define_changes(conn, inactive_xmlobj,
+                                       devs, devaction, False)
+                ret["defined"] = True
+        return ret
+
+
+    ####################
+    # Request dispatch #
+    ####################
+
+    def _run_method(self, method, params):
+        self._errors.clear()
+        try:
+            return self._methods[method](params)
+        except ServiceError:
+            raise
+        except (Exception, SystemExit) as e:
+            # SystemExit comes from cli.fail() in shared validation code
+            logging.debug("service: %s failed", method, exc_info=True)
+            raise ServiceError(OPERATION_FAILED, self._errors.pop(e))
+
+    def submit(self, request):
+        """
+        Validate a decoded JSON-RPC request and queue it on the worker
+        pool.
+
+        :returns: A Future for the response dict, or None for
+            notifications, which get no response
+        """
+        reqid = None
+        if isinstance(request, dict):
+            reqid = request.get("id")
+        is_notification = isinstance(request, dict) and "id" not in request
+
+        def _error(code, msg):
+            return {"jsonrpc": "2.0", "id": reqid,
+                    "error": {"code": code, "message": msg}}
+
+        def _run(method, params):
+            try:
+                result = self._run_method(method, params)
+            except ServiceError as e:
+                return _error(e.code, str(e))
+            return {"jsonrpc": "2.0", "id": reqid, "result": result}
+
+        future = concurrent.futures.Future()
+        if (not isinstance(request, dict) or
+            request.get("jsonrpc") != "2.0" or
+            not isinstance(request.get("method"), str)):
+            future.set_result(_error(INVALID_REQUEST, "Invalid Request"))
+            return future
+
+        method = request["method"]
+        params = request.get("params", {})
+        if method not in self._methods:
+            future.set_result(_error(METHOD_NOT_FOUND,
+                                     "Method not found: %s" % method))
+        elif not isinstance(params, dict):
+            future.set_result(_error(INVALID_PARAMS,
+                                     "params must be an object"))
+        else:
+            future = self._pool.submit(_run, method, params)
+
+        if is_notification:
+            return None
+        return future
+
+
+#################
+# UNIX listener #
+#################
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        writelock = threading.Lock()
+
+        def _send(response):
+            data = (json.dumps(response) + "\n").encode("utf-8")
+            with writelock:
+                try:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                except OSError:
+                    logging.debug("service: client went away")
+
+        pending = []
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError as e:
+                _send({"jsonrpc": "2.0", "id": None,
+                       "error": {"code": PARSE_ERROR,
+                                 "message": "Parse error: %s" % e}})
+                continue
+
+            future = service.submit(request)
+            if future is None:
+                continue
+            future.add_done_callback(lambda f: _send(f.result()))
+            pending.append(future)
+
+        # Client closed its write side, finish answering what it sent
+        concurrent.futures.wait(pending)
+
+
+class VirtinstServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    """
+    UNIX socket server for a VirtinstService. The socket is created
+    with 0600 permissions since requests can change any VM the
+    service's connections can reach.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.service = service
+        if os.path.exists(path):
+            os.unlink(path)
+        oldmask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path,
+                                                   _RequestHandler)
+        finally:
+            os.umask(oldmask)
+
+    def server_close(self):
+        path = self.server_address
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def parse_args(argv=None):
+    parser = cli.setupParser("%(prog)s --socket PATH [options]",
+        _("Serve virt-install, virt-clone and virt-xml style operations "
+          "over a JSON-RPC UNIX socket."))
+    cli.add_connect_option(parser)
+    parser.add_argument("--socket", required=True,
+        help=_("Path of the UNIX socket to listen on"))
+    parser.add_argument("--workers", type=int, default=4,
+        help=_("Number of requests to run at the same time"))
+    parser.add_argument("-d", "--debug", action="store_true",
+        help=_("Print debugging information"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    cli.earlyLogging()
+    options = parse_args(argv)
+    cli.setupLogging("virtinst-service", options.debug, False)
+
+    service = VirtinstService(options.connect, options.workers)
+    server = VirtinstServer(options.socket, service)
+    logging.debug("service: listening on %s", options.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.debug("service: interrupted")
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,8 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import xml.parsers.expat
+
 import libvirt
 
 from . import util
@@ -42,6 +44,7 @@ class DomainSnapshot(XMLBuilder):
 
 
     XML_NAME = "domainsnapshot"
+    _XML_READONLY_PARSE = True
     _XML_PROP_ORDER = ["name", "description", "creationTime"]
 
     name = XMLProperty("./name")
@@ -62,3 +65,70 @@ class DomainSnapshot(XMLBuilder):
     def validate(self):
         if not self.name:
             raise RuntimeError(_("A name must be specified."))
+
+
+class DomainSnapshotSummary(object):
+    """
+    The top level fields of a snapshot XML document that are needed to
+    list snapshots. They are pulled out with a streaming parser, which
+    avoids building a tree for the full <domain> document that every
+    snapshot XML embeds. Use DomainSnapshot for anything else.
+    """
+    # Element path -> attribute storing its text
+    _TEXT_PATHS = {
+        ("domainsnapshot", "name"): "name",
+        ("domainsnapshot", "description"): "description",
+        ("domainsnapshot", "state"): "state",
+        ("domainsnapshot", "creationTime"): "creationTime",
+        ("domainsnapshot", "parent", "name"): "parent",
+    }
+
+    def __init__(self, parsexml):
+        self.name = None
+        self.description = None
+        self.state = None
+        self.creationTime = None
+        self.parent = None
+        self.memory_type = None
+        self.disk_snapshot_modes = []
+
+        self._parse(parsexml)
+        if self.creationTime is not None:
+            self.creationTime = int(self.creationTime)
+
+    def _parse(self, parsexml):
+        path = []
+        text = []
+
+        def _start(tag, attrs):
+            path.append(tag)
+            del(text[:])
+            key = tuple(path)
+            if key == ("domainsnapshot", "memory"):
+                self.memory_type = attrs.get("snapshot")
+            elif key == ("domainsnapshot", "disks", "disk"):
+                self.disk_snapshot_modes.append(attrs.get("snapshot"))
+
+        def _end(tag):
+            ignore = tag
+            attrname = self._TEXT_PATHS.get(tuple(path))
+            if attrname:
+                setattr(self, attrname, "".join(text))
+            path.pop()
+
+        def _chardata(data):
+            # Only collect text for the elements we want, not for the
+            # whole embedded <domain>
+            if tuple(path) in self._TEXT_PATHS:
+                text.append(data)
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = _start
+        parser.EndElementHandler = _end
+        parser.CharacterDataHandler = _chardata
+        parser.Parse(parsexml, True)
+
+    def is_external(self):
+        if self.memory_type == "external":
+            return True
+        return "external" in self.disk_snapshot_modes
@@ -623,6 +623,7 @@ class StorageVolume(_StorageObject):
     ##################
 
     XML_NAME = "volume"
+    _XML_READONLY_PARSE = True
     _XML_PROP_ORDER = ["name", "key", "capacity", "allocation", "format",
                        "target_path", "permissions"]
 
@@ -0,0 +1,766 @@
+#
+# Copyright 2005-2014 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+Option handling and guest building for virt-install. The virt-install
+script and the virtinst service both build guests with these.
+"""
+
+import argparse
+import logging
+import sys
+
+from . import cli
+from . import util
+from .cli import fail, print_stdout
+from .guest import Guest
+from .installer import Installer
+from .network import Network
+
+
+##############################
+# Validation utility helpers #
+##############################
+
+install_methods = "--location URL, --cdrom CD/ISO, --pxe, --import, --boot hd|cdrom|..."
+
+
+def all_install_options(options):
+    return [options.pxe, options.cdrom, options.location,
+            options.import_install]
+
+
+def install_specified(options):
+    return any([bool(o) for o in all_install_options(options)])
+
+
+def supports_pxe(guest):
+    """
+    Return False if we are pretty sure the config doesn't support PXE
+    """
+    for nic in guest.devices.interface:
+        if nic.type == nic.TYPE_USER:
+            continue
+        if nic.type != nic.TYPE_VIRTUAL:
+            return True
+
+        try:
+            netobj = nic.conn.networkLookupByName(nic.source)
+            xmlobj = Network(nic.conn, parsexml=netobj.XMLDesc(0))
+            if xmlobj.can_pxe():
+                return True
+        except Exception:
+            logging.debug("Error checking if PXE supported", exc_info=True)
+            return True
+
+    return False
+
+
+def check_cdrom_option_error(options):
+    if options.cdrom_short and options.cdrom:
+        fail("Cannot specify both -c and --cdrom")
+
+    if options.cdrom_short:
+        if "://" in options.cdrom_short:
+            fail("-c specified with what looks like a URI. Did you mean "
+                 "to use --connect? If not, use --cdrom instead")
+        options.cdrom = options.cdrom_short
+
+    if not options.cdrom:
+        return
+
+    # Catch a strangely common error of users passing -vcpus=2 instead of
+    # --vcpus=2. The single dash happens to map to enough shortened options
+    # that things can fail weirdly if --paravirt is also specified.
+    for vcpu in [o for o in sys.argv if o.startswith("-vcpu")]:
+        if options.cdrom == vcpu[3:]:
+            fail("You specified -vcpus, you want --vcpus")
+
+
+#################################
+# Back compat option conversion #
+#################################
+
+def convert_old_printxml(options):
+    if options.xmlstep:
+        options.xmlonly = options.xmlstep
+        del(options.xmlstep)
+
+
+def convert_old_sound(options):
+    if not options.sound:
+        return
+    for idx in range(len(options.sound)):
+        if options.sound[idx] is None:
+            options.sound[idx] = "default"
+
+
+def convert_old_init(options):
+    if not options.init:
+        return
+    if not options.boot:
+        options.boot = [""]
+    options.boot[-1] += ",init=%s" % options.init
+    logging.debug("Converted old --init to --boot %s", options.boot[-1])
+
+
+def _do_convert_old_disks(options):
+    paths = util.listify(options.file_paths)
+    sizes = util.listify(options.disksize)
+
+    def padlist(l, padsize):
+        l = util.listify(l)
+        l.extend((padsize - len(l)) * [None])
+        return l
+
+    disklist = padlist(paths, max(0, len(sizes)))
+    sizelist = padlist(sizes, len(disklist))
+
+    opts = []
+    for idx, path in enumerate(disklist):
+        optstr = ""
+        if path:
+            optstr += "path=%s" % path
+        if sizelist[idx]:
+            if optstr:
+                optstr += ","
+            optstr += "size=%s" % sizelist[idx]
+        if options.sparse is False:
+            if optstr:
+                optstr += ","
+            optstr += "sparse=no"
+        logging.debug("Converted to new style: --disk %s", optstr)
+        opts.append(optstr)
+
+    options.disk = opts
+
+
+def convert_old_disks(options):
+    if options.nodisks and (options.file_paths or
+                            options.disk or
+                            options.disksize):
+        fail(_("Cannot specify storage and use --nodisks"))
+
+    if ((options.file_paths or options.disksize or not options.sparse) and
+        options.disk):
+        fail(_("Cannot mix --file, --nonsparse, or --file-size with --disk "
+               "options. Use --disk PATH[,size=SIZE][,sparse=yes|no]"))
+
+    if not options.disk:
+        if options.nodisks:
+            options.disk = ["none"]
+        else:
+            _do_convert_old_disks(options)
+
+    del(options.file_paths)
+    del(options.disksize)
+    del(options.sparse)
+    del(options.nodisks)
+    logging.debug("Distilled --disk options: %s", options.disk)
+
+
+def convert_old_os_options(options):
+    # Default to distro autodetection
+    distkey = "auto"
+    if options.os_variant:
+        distkey = options.os_variant
+    elif options.old_os_type:
+        distkey = options.old_os_type
+
+    options.os_variant = cli.parse_os_variant(distkey)
+    del(options.old_os_type)
+
+
+def convert_old_memory(options):
+    if options.memory:
+        return
+    if not options.oldmemory:
+        return
+    options.memory = str(options.oldmemory)
+
+
+def convert_old_cpuset(options):
+    if not options.cpuset:
+        return
+    if not options.vcpus:
+        options.vcpus = [""]
+    options.vcpus[-1] += ",cpuset=%s" % options.cpuset
+    logging.debug("Generated compat cpuset: --vcpus %s", options.vcpus[-1])
+
+
+def convert_old_networks(options):
+    if options.nonetworks:
+        if options.mac:
+            fail(_("Cannot use --mac with --nonetworks"))
+        if options.bridge:
+            fail(_("Cannot use --bridge with --nonetworks"))
+        if options.network:
+            fail(_("Cannot use --nonetworks with --network"))
+        options.network = ["none"]
+
+    macs = util.listify(options.mac)
+    networks = util.listify(options.network)
+    bridges = util.listify(options.bridge)
+
+    if bridges and networks:
+        fail(_("Cannot mix both --bridge and --network arguments"))
+
+    if bridges:
+        # Convert old --bridges to --networks
+        networks = ["bridge:" + b for b in bridges]
+
+    def padlist(l, padsize):
+        l = util.listify(l)
+        l.extend((padsize - len(l)) * [None])
+        return l
+
+    # If a plain mac is specified, have it imply a default network
+    networks = padlist(networks, max(len(macs), 1))
+    macs = padlist(macs, len(networks))
+
+    for idx, ignore in enumerate(networks):
+        if networks[idx] is None:
+            networks[idx] = "default"
+        if macs[idx]:
+            networks[idx] += ",mac=%s" % macs[idx]
+
+        # Handle old format of bridge:foo instead of bridge=foo
+        for prefix in ["network", "bridge"]:
+            if networks[idx].startswith(prefix + ":"):
+                networks[idx] = networks[idx].replace(prefix + ":",
+                                                      prefix + "=")
+
+    del(options.mac)
+    del(options.bridge)
+    del(options.nonetworks)
+
+    options.network = networks
+    logging.debug("Distilled --network options: %s", options.network)
+
+
+def convert_old_graphics(options):
+    vnc = options.vnc
+    vncport = options.vncport
+    vnclisten = options.vnclisten
+    nographics = options.nographics
+    sdl = options.sdl
+    keymap = options.keymap
+    graphics = options.graphics
+
+    if graphics and (vnc or sdl or keymap or vncport or vnclisten):
+        fail(_("Cannot mix --graphics and old style graphical options"))
+
+    optnum = sum([bool(g) for g in [vnc, nographics, sdl, graphics]])
+    if optnum > 1:
+        raise ValueError(_("Can't specify more than one of VNC, SDL, "
+                           "--graphics or --nographics"))
+
+    if options.graphics:
+        return
+
+    if optnum == 0:
+        return
+
+    # Build a --graphics command line from old style opts
+    optstr = ((vnc and "vnc") or
+              (sdl and "sdl") or
+              (nographics and ("none")))
+    if vnclisten:
+        optstr += ",listen=%s" % vnclisten
+    if vncport:
+        optstr += ",port=%s" % vncport
+    if keymap:
+        optstr += ",keymap=%s" % keymap
+
+    logging.debug("--graphics compat generated: %s", optstr)
+    options.graphics = [optstr]
+
+
+def convert_old_features(options):
+    if options.features:
+        return
+
+    opts = ""
+    if options.noacpi:
+        opts += "acpi=off"
+    if options.noapic:
+        if opts:
+            opts += ","
+        opts += "apic=off"
+    if opts:
+        options.features = [opts]
+
+
+def set_test_stub_options(options):
+    # Set some basic options that will let virt-install succeed. Helps
+    # save boiler plate typing when testing new command line additions
+    if not options.test_stub_command:
+        return
+
+    if not options.connect:
+        options.connect = "test:///default"
+    if not options.name:
+        options.name = "test-stub-command"
+    if not options.memory:
+        options.memory = "256"
+    if not options.disk:
+        options.disk = "none"
+    if not install_specified(options):
+        options.import_install = True
+    if not options.graphics:
+        options.graphics = "none"
+    if not options.os_variant:
+        options.os_variant = "fedora27"
+
+
+def process_options(options):
+    """
+    Validate and convert old style options. This is also run on each
+    --batch manifest entry.
+    """
+    check_cdrom_option_error(options)
+    cli.convert_old_force(options)
+    cli.parse_check(options.check)
+    cli.set_prompt(options.prompt)
+    convert_old_memory(options)
+    convert_old_sound(options)
+    convert_old_networks(options)
+    convert_old_graphics(options)
+    convert_old_disks(options)
+    convert_old_features(options)
+    convert_old_cpuset(options)
+    convert_old_init(options)
+    set_test_stub_options(options)
+    convert_old_os_options(options)
+
+
+#############################
+# General option validation #
+#############################
+
+def validate_required_options(options, guest, installer):
+    # Required config. Don't error right away if nothing is specified,
+    # aggregate the errors to help first time users get it right
+    msg = ""
+
+    if not guest.name:
+        msg += "\n" + _("--name is required")
+
+    if not guest.memory:
+        msg += "\n" + _("--memory amount in MiB is required")
+
+    if (not guest.os.is_container() and
+        not (options.disk or options.filesystem)):
+        msg += "\n" + (
+            _("--disk storage must be specified (override with --disk none)"))
+
+    if not installer:
+        msg += "\n" + (
+            _("An install method must be specified\n(%(methods)s)") %
+            {"methods": install_methods})
+
+    if msg:
+        fail(msg)
+
+
+_cdrom_location_man_page = _("See the man page for examples of "
+    "using --location with CDROM media")
+
+
+def check_option_collisions(options, guest, installer):
+    if options.noreboot and options.transient:
+        fail(_("--noreboot and --transient can not be specified together"))
+
+    # Install collisions
+    if sum([bool(l) for l in all_install_options(options)]) > 1:
+        fail(_("Only one install method can be used (%(methods)s)") %
+             {"methods": install_methods})
+
+    if guest.os.is_container() and install_specified(options):
+        fail(_("Install methods (%s) cannot be specified for "
+               "container guests") % install_methods)
+
+    cdrom_err = ""
+    if installer.cdrom:
+        cdrom_err = " " + _cdrom_location_man_page
+    if not options.location and options.extra_args:
+        fail(_("--extra-args only work if specified with --location.") +
+             cdrom_err)
+    if not options.location and options.initrd_inject:
+        fail(_("--initrd-inject only works if specified with --location.") +
+             cdrom_err)
+
+
+def _show_nographics_warnings(options, guest, installer):
+    if guest.devices.graphics:
+        return
+    if not options.autoconsole:
+        return
+
+    if installer.cdrom:
+        logging.warning(_("CDROM media does not print to the text console "
+            "by default, so you likely will not see text install output. "
+            "You might want to use --location.") + " " +
+            _cdrom_location_man_page)
+        return
+
+    if not options.location:
+        return
+
+    # Trying --location --nographics with console connect. Warn if
+    # they likely won't see any output.
+
+    if not guest.devices.console:
+        logging.warning(_("No --console device added, you likely will not "
+            "see text install output from the guest."))
+        return
+
+    serial_arg = "console=ttyS0"
+    serial_arm_arg = "console=ttyAMA0"
+    hvc_arg = "console=hvc0"
+
+    console_type = serial_arg
+    if guest.os.is_arm():
+        console_type = serial_arm_arg
+    if guest.devices.console[0].target_type in ["virtio", "xen"]:
+        console_type = hvc_arg
+    if guest.os.is_ppc64() or guest.os.is_arm_machvirt():
+        # Later arm/ppc kernels figure out console= automatically, so don't
+        # warn about it.
+        return
+
+    for args in (options.extra_args or []):
+        if console_type in (args or ""):
+            return
+
+    logging.warning(_("Did not find '%(console_string)s' in --extra-args, "
+        "which is likely required to see text install output from the "
+        "guest."), {"console_string": console_type})
+
+
+def show_warnings(options, guest, installer):
+    if options.pxe and not supports_pxe(guest):
+        logging.warning(_("The guest's network configuration does not support "
+                       "PXE"))
+
+    # Limit it to hvm x86 guests which presently our defaults
+    # only really matter for
+    if (guest.osinfo.name == "generic" and
+        not options.os_variant.is_none and
+        not options.os_variant.name == "generic" and
+        guest.os.is_x86() and guest.os.is_hvm()):
+        logging.warning(_("No operating system detected, VM performance may "
+            "suffer. Specify an OS with --os-variant for optimal results."))
+
+    _show_nographics_warnings(options, guest, installer)
+
+
+##########################
+# Guest building helpers #
+##########################
+
+def build_installer(options, guest):
+    cdrom = None
+    location = None
+    location_kernel = None
+    location_initrd = None
+    install_bootdev = None
+
+    has_installer = True
+    if options.os_variant.install == "location":
+        if not options.location:
+            location = guest.osinfo.get_location(guest.os.arch)
+            logging.debug(
+                    "Generated default libosinfo '--location %s'", location)
+            options.location = location
+    elif options.os_variant.install:
+        fail(_("Unknown --os-variant install=%s") %
+                options.os_variant.install)
+
+    if options.location:
+        (location,
+         location_kernel,
+         location_initrd) = cli.parse_location(options.location)
+    elif options.cdrom:
+        cdrom = options.cdrom
+    elif options.pxe:
+        install_bootdev = "network"
+    elif (guest.os.is_container() or
+          options.import_install or
+          options.xmlonly or
+          options.boot):
+        pass
+    else:
+        has_installer = False
+
+    if not has_installer:
+        # This triggers an error in validate_required_options
+        return None
+
+    installer = Installer(guest.conn,
+            cdrom=cdrom,
+            location=location,
+            location_kernel=location_kernel,
+            location_initrd=location_initrd,
+            install_bootdev=install_bootdev)
+    if cdrom and options.livecd:
+        installer.livecd = True
+    if options.extra_args:
+        installer.extra_args = options.extra_args
+    if options.initrd_inject:
+        installer.set_initrd_injections(options.initrd_inject)
+    if options.autostart:
+        installer.autostart = True
+
+    distro = None
+    try:
+        # This also validates the install location
+        autodistro = installer.detect_distro(guest)
+        if options.os_variant.is_auto:
+            distro = autodistro
+    except ValueError as e:
+        fail(_("Error validating install location: %s") % str(e))
+
+    if distro:
+        guest.set_os_name(distro)
+    return installer
+
+
+def set_resources_from_osinfo(options, guest):
+    if guest.os.is_container():
+        return
+    if options.disk:
+        return
+
+    res = guest.osinfo.get_recommended_resources(guest)
+    if res and res.get('storage') > 0:
+        diskstr = 'size=%d' % (res.get('storage') // (1024 ** 3))
+        logging.debug("Generated default libosinfo '--disk %s'", diskstr)
+        options.disk = [diskstr]
+        cli.ParserDisk(guest, diskstr).parse(None)
+
+
+def build_guest_instance(conn, options):
+    guest = Guest(conn)
+
+    if options.name:
+        guest.name = options.name
+    if options.uuid:
+        guest.uuid = options.uuid
+    if options.description:
+        guest.description = options.description
+    if options.os_type:
+        guest.os.os_type = options.os_type
+    if options.virt_type:
+        guest.type = options.virt_type
+    if options.arch:
+        guest.os.arch = options.arch
+    if options.machine:
+        guest.os.machine = options.machine
+
+    # If explicit os-variant requested, set it early since it will
+    # provide more defaults in the future
+    options.os_variant.set_os_name(guest)
+
+    cli.parse_option_strings(options, guest, None)
+
+    # Call set_capabilities_defaults explicitly here rather than depend
+    # on set_defaults calling it. Installer setup needs filled in values.
+    # However we want to do it after parse_option_strings to ensure
+    # we are operating on any arch/os/type values passed in with --boot
+    guest.set_capabilities_defaults()
+    installer = build_installer(options, guest)
+    set_resources_from_osinfo(options, guest)
+
+    if installer:
+        installer.set_install_defaults(guest)
+
+    # cli specific disk validation
+    for disk in guest.devices.disk:
+        cli.validate_disk(disk)
+
+    validate_required_options(options, guest, installer)
+    check_option_collisions(options, guest, installer)
+    show_warnings(options, guest, installer)
+
+    return guest, installer
+
+
+########################
+# XML printing helpers #
+########################
+
+def get_install_xml(guest, installer, dry):
+    """
+    Return the (start_xml, final_xml) XML of the install steps. For a
+    single step install, start_xml is that step and final_xml is None.
+    """
+    start_xml, final_xml = installer.start_install(
+            guest, dry=dry, return_xml=True)
+    if not start_xml:
+        start_xml = final_xml
+        final_xml = None
+    return start_xml, final_xml
+
+
+def xml_to_print(guest, installer, xmlonly, dry):
+    start_xml, final_xml = get_install_xml(guest, installer, dry)
+
+    if dry and not xmlonly:
+        print_stdout(_("Dry run completed successfully"))
+        return
+
+    if xmlonly not in [False, "1", "2", "all"]:
+        fail(_("Unknown XML step request '%s', must be 1, 2, or all") %
+             xmlonly)
+
+    if xmlonly == "1":
+        return start_xml
+    if xmlonly == "2":
+        if not final_xml:
+            fail(_("Requested installation does not have XML step 2"))
+        return final_xml
+
+    # "all" case
+    xml = start_xml
+    if final_xml:
+        xml += final_xml
+    return xml
+
+
+#######################
+# CLI option handling #
+#######################
+
+def build_parser():
+    """
+    Return the argparse parser for virt-install options
+    """
+    parser = cli.setupParser(
+        "%(prog)s --name NAME --memory MB STORAGE INSTALL [options]",
+        _("Create a new virtual machine from specified install media."),
+        introspection_epilog=True)
+    cli.add_connect_option(parser)
+
+    geng = parser.add_argument_group(_("General Options"))
+    geng.add_argument("-n", "--name",
+                    help=_("Name of the guest instance"))
+    cli.add_memory_option(geng, backcompat=True)
+    cli.vcpu_cli_options(geng)
+    cli.add_metadata_option(geng)
+    geng.add_argument("-u", "--uuid", help=argparse.SUPPRESS)
+    geng.add_argument("--description", help=argparse.SUPPRESS)
+
+    insg = parser.add_argument_group(_("Installation Method Options"))
+    insg.add_argument("-c", dest="cdrom_short", help=argparse.SUPPRESS)
+    insg.add_argument("--cdrom", help=_("CD-ROM installation media"))
+    insg.add_argument("-l", "--location",
+            help=_("Distro install URL, eg. https://host/path. See man "
+                   "page for specific distro examples."))
+    insg.add_argument("--pxe", action="store_true",
+                    help=_("Boot from the network using the PXE protocol"))
+    insg.add_argument("--import", action="store_true", dest="import_install",
+                    help=_("Build guest around an existing disk image"))
+    insg.add_argument("--livecd", action="store_true",
+                    help=_("Treat the CD-ROM media as a Live CD"))
+    insg.add_argument("-x", "--extra-args", action="append",
+                    help=_("Additional arguments to pass to the install kernel "
+                           "booted from --location"))
+    insg.add_argument("--initrd-inject", action="append",
+                    help=_("Add given file to root of initrd from --location"))
+
+    # Takes a URL and just prints to stdout the detected distro name
+    insg.add_argument("--test-media-detection", help=argparse.SUPPRESS)
+    # Helper for cli testing, fills in standard stub options
+    insg.add_argument("--test-stub-command", action="store_true",
+            help=argparse.SUPPRESS)
+
+    cli.add_boot_options(insg)
+    insg.add_argument("--init", help=argparse.SUPPRESS)
+
+    osg = cli.add_os_variant_option(parser, virtinstall=True)
+    osg.add_argument("--os-type", dest="old_os_type", help=argparse.SUPPRESS)
+
+    devg = parser.add_argument_group(_("Device Options"))
+    cli.add_disk_option(devg)
+    cli.add_net_option(devg)
+    cli.add_gfx_option(devg)
+    cli.add_device_options(devg, sound_back_compat=True)
+
+    # Deprecated device options
+    devg.add_argument("-f", "--file", dest="file_paths", action="append",
+                    help=argparse.SUPPRESS)
+    devg.add_argument("-s", "--file-size", type=float,
+                    action="append", dest="disksize",
+                    help=argparse.SUPPRESS)
+    devg.add_argument("--nonsparse", action="store_false",
+                    default=True, dest="sparse",
+                    help=argparse.SUPPRESS)
+    devg.add_argument("--nodisks", action="store_true", help=argparse.SUPPRESS)
+    devg.add_argument("--nonetworks", action="store_true",
+        help=argparse.SUPPRESS)
+    devg.add_argument("-b", "--bridge", action="append",
+        help=argparse.SUPPRESS)
+    devg.add_argument("-m", "--mac", action="append", help=argparse.SUPPRESS)
+    devg.add_argument("--vnc", action="store_true", help=argparse.SUPPRESS)
+    devg.add_argument("--vncport", type=int, help=argparse.SUPPRESS)
+    devg.add_argument("--vnclisten", help=argparse.SUPPRESS)
+    devg.add_argument("-k", "--keymap", help=argparse.SUPPRESS)
+    devg.add_argument("--sdl", action="store_true", help=argparse.SUPPRESS)
+    devg.add_argument("--nographics", action="store_true",
+        help=argparse.SUPPRESS)
+
+
+    gxmlg = parser.add_argument_group(_("Guest Configuration Options"))
+    cli.add_guest_xml_options(gxmlg)
+
+
+    virg = parser.add_argument_group(_("Virtualization Platform Options"))
+    ostypeg = virg.add_mutually_exclusive_group()
+    ostypeg.add_argument("-v", "--hvm",
+        action="store_const", const="hvm", dest="os_type",
+        help=_("This guest should be a fully virtualized guest"))
+    ostypeg.add_argument("-p", "--paravirt",
+        action="store_const", const="xen", dest="os_type",
+        help=_("This guest should be a paravirtualized guest"))
+    ostypeg.add_argument("--container",
+        action="store_const", const="exe", dest="os_type",
+        help=_("This guest should be a container guest"))
+    virg.add_argument("--virt-type",
+        help=_("Hypervisor name to use (kvm, qemu, xen, ...)"))
+    virg.add_argument("--arch", help=_("The CPU architecture to simulate"))
+    virg.add_argument("--machine", help=_("The machine type to emulate"))
+    virg.add_argument("--accelerate", action="store_true",
+        help=argparse.SUPPRESS)
+    virg.add_argument("--noapic", action="store_true",
+        default=False, help=argparse.SUPPRESS)
+    virg.add_argument("--noacpi", action="store_true",
+        default=False, help=argparse.SUPPRESS)
+
+
+    misc = parser.add_argument_group(_("Miscellaneous Options"))
+    misc.add_argument("--autostart", action="store_true", default=False,
+                      help=_("Have domain autostart on host boot up."))
+    misc.add_argument("--transient", action="store_true", default=False,
+                      help=_("Create a transient domain."))
+    misc.add_argument("--destroy-on-exit", action="store_true", default=False,
+                      help=_("Force power off the domain when the console "
+                             "viewer is closed."))
+    misc.add_argument("--wait", type=int,
+                      help=_("Minutes to wait for install to complete."))
+    misc.add_argument("--batch", metavar="MANIFEST",
+                      help=_("Create every guest listed in a JSON or YAML "
+                             "manifest over a single connection. Other "
+                             "options are used as defaults for each "
+                             "guest. Implies --noautoconsole."))
+    misc.add_argument("--batch-jobs", type=int, default=4,
+                      help=_("Max number of --batch guests to create "
+                             "at once. Default is 4."))
+
+    cli.add_misc_options(misc, prompt=True, printxml=True, printstep=True,
+                         noreboot=True, dryrun=True, noautoconsole=True)
+
+    return parser
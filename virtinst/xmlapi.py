@@ -4,6 +4,9 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import logging
+from xml.parsers import expat
+
 import libxml2
 
 from . import util
@@ -253,9 +256,13 @@ def node_is_text(n):
 
 
 class _Libxml2API(_XMLBase):
-    def __init__(self, xml):
+    def __init__(self, xml, doc=None):
+        """
+        :param doc: Already parsed libxml2 document to take ownership of,
+            instead of parsing xml
+        """
         _XMLBase.__init__(self)
-        self._doc = libxml2.parseDoc(xml)
+        self._doc = doc if doc is not None else libxml2.parseDoc(xml)
         self._ctx = self._doc.xpathNewContext()
         self._ctx.setContextNode(self._doc.children)
         for key, val in self.NAMESPACES.items():
@@ -276,7 +283,9 @@ class _Libxml2API(_XMLBase):
         return xml
 
     def copy_api(self):
-        return _Libxml2API(self._doc.children.serialize())
+        # Copy the node tree directly, rather than serializing the whole
+        # document and parsing it again
+        return _Libxml2API(None, doc=self._doc.copyDoc(1))
 
     def _find(self, fullxpath):
         xpath = _XPath(fullxpath).xpath
@@ -372,4 +381,209 @@ class _Libxml2API(_XMLBase):
         parentnode.addChild(libxml2.newText(endtext))
 
 
+class _NeedDOM(Exception):
+    """
+    Raised by _StreamingAPI for xpaths it can't answer on its own
+    """
+    pass
+
+
+class _StreamNode(object):
+    """
+    Element from a _StreamingAPI parse. name is the expat name, so
+    'nsuri localname' for namespaced elements. content is the text of
+    the element and all its descendants, like libxml2 node.content
+    """
+    __slots__ = ["name", "attrs", "children", "content"]
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.children = []
+        self.content = ""
+
+
+def _stream_parse(xml):
+    """
+    Parse the passed XML in a single expat pass, into a tree of
+    _StreamNode. Returns the root element
+    """
+    parser = expat.ParserCreate(namespace_separator=" ")
+    parser.buffer_text = True
+
+    top = _StreamNode(None, {})
+    nodestack = [top]
+    textstack = [[]]
+
+    def _start(name, attrs):
+        node = _StreamNode(name, attrs)
+        nodestack[-1].children.append(node)
+        nodestack.append(node)
+        textstack.append([])
+
+    def _end(name):
+        ignore = name
+        node = nodestack.pop()
+        node.content = "".join(textstack.pop())
+        textstack[-1].append(node.content)
+
+    def _chardata(data):
+        textstack[-1].append(data)
+
+    parser.StartElementHandler = _start
+    parser.EndElementHandler = _end
+    parser.CharacterDataHandler = _chardata
+    parser.Parse(xml, True)
+    return top.children[0]
+
+
+class _StreamingAPI(_XMLBase):
+    """
+    Read only XML API, for objects that are parsed only to read some
+    values out of them, like capabilities or nodedev XML.
+
+    The document is parsed in one expat pass into plain python nodes,
+    and property lookups are answered from there and remembered in a
+    flat xpath->value table, so there's no libxml2 DOM or xpath
+    context. The first time the document is modified, serialized, or
+    asked about an xpath we can't evaluate ourselves, a full
+    _Libxml2API is built from the original XML and every call is
+    passed through to it from then on.
+    """
+    def __init__(self, xml):
+        _XMLBase.__init__(self)
+        self._xml = xml
+        self._root = None
+        self._values = {}
+        self._dom = None
+
+        try:
+            self._root = _stream_parse(xml)
+        except expat.ExpatError:
+            # libxml2 is more forgiving, undeclared namespace prefixes
+            # for example, so let it have a go
+            logging.debug("Streaming XML parse failed, using libxml2",
+                          exc_info=True)
+            self._get_dom()
+
+    def _get_dom(self):
+        if not self._dom:
+            self._dom = _Libxml2API(self._xml)
+            self._root = None
+            self._values = None
+        return self._dom
+
+    def _make_key(self, xpathseg):
+        if xpathseg.nsname:
+            if xpathseg.nsname not in self.NAMESPACES:
+                raise _NeedDOM()
+            return "%s %s" % (self.NAMESPACES[xpathseg.nsname],
+                              xpathseg.nodename)
+        return xpathseg.nodename
+
+    def _attr_key(self, propname):
+        return self._make_key(_XPathSegment("@" + propname))
+
+    def _match(self, nodes, xpathseg):
+        fullseg = xpathseg.fullsegment
+        if (xpathseg.nodename in ["", ".", "..", "*"] or
+            "(" in fullseg or
+            ("[" in fullseg and
+             xpathseg.condition_num is None and
+             "[@" not in fullseg) or
+            (xpathseg.condition_val or "").startswith('"')):
+            raise _NeedDOM()
+
+        key = self._make_key(xpathseg)
+        ret = []
+        for node in nodes:
+            matches = [c for c in node.children if c.name == key]
+            if xpathseg.condition_num is not None:
+                num = xpathseg.condition_num
+                matches = matches[num - 1:num]
+            elif xpathseg.condition_prop is not None:
+                propkey = self._attr_key(xpathseg.condition_prop)
+                matches = [c for c in matches if
+                           c.attrs.get(propkey) == xpathseg.condition_val]
+            ret.extend(matches)
+        return ret
+
+    def _eval(self, xpathobj):
+        segments = xpathobj.segments
+        if not segments or segments[0].fullsegment != ".":
+            raise _NeedDOM()
+
+        nodes = [self._root]
+        for xpathseg in segments[1:]:
+            nodes = self._match(nodes, xpathseg)
+            if not nodes:
+                break
+        return nodes
+
+    def _eval_prop(self, xpathobj):
+        """
+        Like _eval, but for an xpath ending in @prop only return the
+        elements that have that attribute
+        """
+        nodes = self._eval(xpathobj)
+        if xpathobj.is_prop:
+            propkey = self._attr_key(xpathobj.propname)
+            nodes = [n for n in nodes if propkey in n.attrs]
+        return nodes
+
+    def _lookup(self, xpath, is_bool):
+        xpathobj = _XPath(xpath)
+        nodes = self._eval_prop(xpathobj)
+        if not nodes:
+            return None
+        if is_bool:
+            return True
+        if xpathobj.is_prop:
+            return nodes[0].attrs[self._attr_key(xpathobj.propname)]
+        return nodes[0].content
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def get_xpath_content(self, xpath, is_bool):
+        if self._dom:
+            return self._dom.get_xpath_content(xpath, is_bool)
+
+        key = (xpath, is_bool)
+        if key not in self._values:
+            try:
+                self._values[key] = self._lookup(xpath, is_bool)
+            except _NeedDOM:
+                return self._get_dom().get_xpath_content(xpath, is_bool)
+        return self._values[key]
+
+    def count(self, xpath):
+        if self._dom:
+            return self._dom.count(xpath)
+
+        try:
+            return len(self._eval_prop(_XPath(xpath)))
+        except _NeedDOM:
+            return self._get_dom().count(xpath)
+
+    def copy_api(self):
+        if self._dom:
+            return self._dom.copy_api()
+        return _Libxml2API(self._xml)
+
+    def get_xml(self, xpath):
+        return self._get_dom().get_xml(xpath)
+    def set_xpath_content(self, xpath, setval):
+        return self._get_dom().set_xpath_content(xpath, setval)
+    def node_add_xml(self, xml, xpath):
+        return self._get_dom().node_add_xml(xml, xpath)
+    def node_force_remove(self, fullxpath):
+        return self._get_dom().node_force_remove(fullxpath)
+    def node_clear(self, xpath):
+        return self._get_dom().node_clear(xpath)
+
+
 XMLAPI = _Libxml2API
+READONLY_XMLAPI = _StreamingAPI
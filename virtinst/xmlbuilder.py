@@ -12,7 +12,7 @@ import os
 import re
 import string  # pylint: disable=deprecated-module
 
-from .xmlapi import XMLAPI
+from .xmlapi import XMLAPI, READONLY_XMLAPI
 from . import util
 
 
@@ -332,8 +332,9 @@ class XMLProperty(_XMLPropertyBase):
 
 class _XMLState(object):
     def __init__(self, root_name, parsexml, parentxmlstate,
-                 relative_object_xpath):
+                 relative_object_xpath, readonly=False):
         self._root_name = root_name
+        self._readonly = readonly
         self._namespace = ""
         if ":" in self._root_name:
             ns = self._root_name.split(":")[0]
@@ -367,8 +368,11 @@ class _XMLState(object):
             parsexml = parsexml.replace("<" + self._root_name,
                     "<" + self._root_name + self._namespace)
 
+        apiclass = XMLAPI
+        if self._readonly and not self.is_build:
+            apiclass = READONLY_XMLAPI
         try:
-            self.xmlapi = XMLAPI(parsexml)
+            self.xmlapi = apiclass(parsexml)
         except Exception:
             logging.debug("Error parsing xml=\n%s", parsexml)
             raise
@@ -420,6 +424,12 @@ class XMLBuilder(object):
     # https://bugzilla.redhat.com/show_bug.cgi?id=1184131
     _XML_SANITIZE = False
 
+    # For XML that we mostly parse to read values out of, like
+    # capabilities or nodedev XML. Parsed XML is then read with a
+    # single expat pass rather than building a libxml2 DOM, which is
+    # only created if the object is modified or serialized.
+    _XML_READONLY_PARSE = False
+
     @staticmethod
     def register_namespace(nsname, uri):
         XMLAPI.register_namespace(nsname, uri)
@@ -448,7 +458,8 @@ class XMLBuilder(object):
         self._propstore = collections.OrderedDict()
         self._xmlstate = _XMLState(self.XML_NAME,
                                    parsexml, parentxmlstate,
-                                   relative_object_xpath)
+                                   relative_object_xpath,
+                                   readonly=self._XML_READONLY_PARSE)
 
         self._validate_xmlbuilder()
         self._initial_child_parse()